@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Benchmarks run offline, so the settings src.config insists on get harmless defaults.
+os.environ.setdefault("DISCORD_TOKEN", "")
+os.environ.setdefault("GUILD_ID", "0")
+os.environ.setdefault("PORT", "0")
+# Keep the tax journal of a benchmark away from the one of the real bot
+os.environ.setdefault("TAX_JOURNAL_PATH", os.path.join(tempfile.gettempdir(), f"benchmark_tax_journal_{os.getpid()}.jsonl"))
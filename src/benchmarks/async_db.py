@@ -0,0 +1,52 @@
+"""
+Shows that commands no longer serialize on database calls.
+
+Run with: python -m src.benchmarks.async_db
+"""
+import asyncio
+import time
+
+from src.config import DB_POOL_SIZE
+from src.db.executor import execute
+
+QUERY_LATENCY = 0.05
+QUERIES_PER_COMMAND = 3
+CONCURRENT_COMMANDS = 20
+
+
+class SlowQuery:
+    # Stand-in for a postgrest request builder: .execute() blocks like a network round trip
+    def execute(self):
+        time.sleep(QUERY_LATENCY)
+        return self
+
+
+async def blocking_command():
+    for _ in range(QUERIES_PER_COMMAND):
+        SlowQuery().execute()
+
+
+async def async_command():
+    for _ in range(QUERIES_PER_COMMAND):
+        await execute(SlowQuery())
+
+
+async def measure(command):
+    start = time.perf_counter()
+    await asyncio.gather(*(command() for _ in range(CONCURRENT_COMMANDS)))
+    return time.perf_counter() - start
+
+
+async def main():
+    blocking = await measure(blocking_command)
+    pooled = await measure(async_command)
+    serialized = CONCURRENT_COMMANDS * QUERIES_PER_COMMAND * QUERY_LATENCY
+
+    print(f"{CONCURRENT_COMMANDS} concurrent commands, {QUERIES_PER_COMMAND} queries each, {QUERY_LATENCY * 1000:.0f} ms per query")
+    print(f"  {'fully serialized would take:':<30}{serialized:.2f}s")
+    print(f"  {'blocking .execute():':<30}{blocking:.2f}s")
+    print(f"  {f'executor (pool of {DB_POOL_SIZE}):':<30}{pooled:.2f}s  ({blocking / pooled:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+"""
+Decode cost of a guild dump (get_all_players of a big server): the old hand-written Player mapping
+against the generated decoder (src/db/decoders.py), and Player (slots=True, tuple snapshot) against the model
+before that change: the same fields with an instance __dict__ and a dict snapshot.
+The old model is decoded by the generated decoder plus mark_clean(), so its time is a bit higher than it used to be,
+the memory is the same.
+
+Run with: python -m src.benchmarks.decode --rows 50000
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from dataclasses import MISSING, fields, make_dataclass
+from datetime import datetime, timedelta, timezone
+
+from src.db.decoders import compile_decoder, parse_datetime
+from src.db.models import Player
+
+
+def hand_written(entry):
+    # _to_player before the decoders were generated
+    def parse(dt_str):
+        return datetime.fromisoformat(dt_str.replace("Z", "+00:00")) if dt_str else None
+
+    return Player(
+        id=entry["id"],
+        server_id=entry["server_id"],
+        created_at=parse(entry["created_at"]),
+        money=entry["money"],
+        debt=entry["debt"],
+        hunger=entry["hunger"],
+        thirst=entry["thirst"],
+        job=entry["job"],
+        health=entry["health"],
+        company_entrepreneur_id=entry["company_entrepreneur_id"],
+        taxes_owed=entry["taxes_owed"],
+        work_cooldown_until=parse(entry["work_cooldown_until"]),
+        job_switch_cooldown_until=parse(entry["job_switch_cooldown_until"]),
+        company_creation_cooldown_until=parse(entry["company_creation_cooldown_until"]),
+        gift_cooldown_until=parse(entry["gift_cooldown_until"]),
+        version=entry.get("version", 0)
+    ).mark_clean()
+
+
+class DictTrackedModel:
+    # TrackedModel before slots: instance __dict__, snapshot as a dict of field name -> value
+    def mark_clean(self):
+        self._snapshot = {field.name: getattr(self, field.name) for field in fields(self)}
+        return self
+
+
+DictPlayer = make_dataclass(
+    "DictPlayer",
+    [(field.name, field.type) if field.default is MISSING else (field.name, field.type, field.default) for field in fields(Player)],
+    bases=(DictTrackedModel,),
+)
+
+
+HOT_ROWS = 1000
+
+
+def guild_dump(rows: int, server_id: int = 1):
+    '''
+    Rows like supabase returns them for one big server: a creation timestamp per player,
+    most cooldowns empty, the rest somewhere in the next day.
+    '''
+    random.seed(0)
+    now = datetime.now(timezone.utc)
+
+    def timestamp(within: timedelta, chance: float = 1.0):
+        if random.random() > chance:
+            return None
+        return (now + random.random() * within).isoformat()
+
+    return [
+        {
+            "id": 10 ** 17 + index, "server_id": server_id, "created_at": timestamp(-timedelta(days=365)),
+            "money": round(random.uniform(0, 10000), 2), "debt": 0.0, "hunger": random.randint(0, 100),
+            "thirst": random.randint(0, 100), "job": random.choice(["Miner", "Lumberjack", "Worker", None]), "health": 100,
+            "company_entrepreneur_id": None, "taxes_owed": 0.0,
+            "work_cooldown_until": timestamp(timedelta(hours=1), 0.3),
+            "job_switch_cooldown_until": timestamp(timedelta(days=1), 0.1),
+            "company_creation_cooldown_until": None,
+            "gift_cooldown_until": timestamp(timedelta(days=1), 0.1),
+            "version": random.randint(0, 50),
+        }
+        for index in range(rows)
+    ]
+
+
+def measure(decode, rows):
+    '''
+    :return: Seconds for decoding all rows, bytes the decoded objects take (second run, under tracemalloc)
+    '''
+    parse_datetime.cache_clear()
+    gc.collect()
+    started = time.perf_counter()
+    result = [decode(entry) for entry in rows]
+    seconds = time.perf_counter() - started
+    del result
+
+    parse_datetime.cache_clear()
+    gc.collect()
+    tracemalloc.start()
+    result = [decode(entry) for entry in rows]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return seconds, memory
+
+
+def main(rows: int):
+    dump = guild_dump(rows)
+    # The same few players loaded again and again, e.g. the active players of a server on every command
+    hot = dump[:HOT_ROWS] * (rows // HOT_ROWS)
+    generated = compile_decoder(Player)
+    decode_dict_player = compile_decoder(DictPlayer)
+
+    def before_slots(entry):
+        return decode_dict_player(entry).mark_clean()
+
+    print(f"Decoding {rows} Players rows, MB = decoded objects incl. parsed timestamps")
+    print(f"  {'decoder':<40}{'total ms':>10}{'us/row':>9}{'MB':>8}")
+    for name, decode, entries in (
+        ("hand-written", hand_written, dump),
+        ("generated", generated, dump),
+        ("generated, model before slots", before_slots, dump),
+        (f"hand-written, {HOT_ROWS} rows repeated", hand_written, hot),
+        (f"generated, {HOT_ROWS} rows repeated", generated, hot),
+    ):
+        seconds, memory = measure(decode, entries)
+        print(f"  {name:<40}{seconds * 1000:>10.1f}{seconds / len(entries) * 1e6:>9.2f}{memory / 2 ** 20:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    main(parser.parse_args().rows)
@@ -0,0 +1,127 @@
+"""
+Just enough of discord.Interaction to call the command callbacks without a gateway connection.
+Everything the bot would send is kept in FakeInteraction.sent.
+"""
+from datetime import datetime, timezone
+
+from discord import Interaction, NotFound
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.display_name = f"User {user_id}"
+        self.mention = f"<@{user_id}>"
+        self.bot = False
+        self.sent = []
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(kwargs.get("embed") or content)
+
+
+class FakeMessage:
+    def __init__(self, content=None, embed=None):
+        self.content = content
+        self.embed = embed
+        self.edits = 0
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        self.content, self.embed = content, embed
+        self.edits += 1
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+    async def send_message(self, content=None, embed=None, **kwargs):
+        self._done = True
+        self._interaction.sent.append(embed or content)
+
+    async def edit_message(self, content=None, embed=None, **kwargs):
+        self._done = True
+        self._interaction.sent.append(embed or content)
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+
+    async def send(self, content=None, embed=None, wait=False, **kwargs):
+        self._interaction.sent.append(embed or content)
+        return FakeMessage(content, embed)
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, members=()):
+        self.id = guild_id
+        self._members = {member.id: member for member in members}
+
+    def get_member(self, user_id: int):
+        return self._members.get(user_id)
+
+
+class FakeClient:
+    def __init__(self, users=()):
+        self._users = {user.id: user for user in users}
+
+    def get_user(self, user_id: int):
+        return self._users.get(user_id)
+
+    async def fetch_user(self, user_id: int):
+        user = self._users.get(user_id)
+        if user is None:
+            raise NotFound(type("Response", (), {"status": 404, "reason": "Not Found"})(), "Unknown User")
+        return user
+
+
+class FakeInteraction(Interaction):
+    # Subclass, so isinstance checks like the one in locks_player still work. Interaction.__init__ needs a gateway payload
+    def __init__(self, client: FakeClient, guild: FakeGuild, user: FakeUser):
+        self.user = user
+        self.extras = {}
+        self.sent = []
+        self._fake_client = client
+        self._fake_guild = guild
+        self._fake_response = FakeResponse(self)
+        self._fake_followup = FakeFollowup(self)
+        self._fake_created_at = datetime.now(timezone.utc)
+
+    @property
+    def client(self):
+        return self._fake_client
+
+    @property
+    def guild(self):
+        return self._fake_guild
+
+    @property
+    def guild_id(self):
+        return self._fake_guild.id
+
+    @property
+    def response(self):
+        return self._fake_response
+
+    @property
+    def followup(self):
+        return self._fake_followup
+
+    @property
+    def created_at(self):
+        return self._fake_created_at
+
+    @property
+    def command(self):
+        return None
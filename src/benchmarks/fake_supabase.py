@@ -0,0 +1,501 @@
+"""
+In-memory stand-in for the supabase client, for benchmarks without a Supabase project.
+
+Supports the part of the PostgREST query builder db_calls uses (select / insert / upsert / update / delete,
+eq, neq, gt, gte, lt, lte, ilike, in_, or_, order, range, limit, count) and the SQL functions
+from src/db/migrations as Python code. Every .execute() sleeps `latency` seconds like a network round trip.
+
+install() has to run before anything imports src.db.db_calls.
+"""
+import re
+import sys
+import threading
+import time
+import types
+
+from collections import defaultdict
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from math import floor
+
+
+PRIMARY_KEYS = {
+    "Players": ("id", "server_id"),
+    "Companies": ("entrepreneur_id", "server_id"),
+    "Player_Items": ("user_id", "server_id", "item_tag"),
+    "Company_Items": ("company_entrepreneur_id", "server_id", "item_tag"),
+    "Company_Join_Requests": ("user_id", "server_id"),
+    "Buy_Orders": ("user_id", "server_id", "item_tag", "unit_price", "is_company"),
+    "Sell_Orders": ("user_id", "server_id", "item_tag", "unit_price", "is_company"),
+    "Market_Items": ("item_tag", "server_id"),
+    "Government": ("id",),
+    "Government_GDP": ("server_id", "date"),
+    "Items": ("item_tag",),
+}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@lru_cache(maxsize=4096)
+def _timestamp(value) -> datetime:
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _same_tag(a, b) -> bool:
+    return str(a).strip().lower() == str(b).strip().lower()
+
+
+def _like_regex(pattern: str) -> re.Pattern:
+    # ilike: % and _ are wildcards, a backslash escapes the next character
+    regex, escaped = "", False
+    for char in pattern:
+        if escaped:
+            regex += re.escape(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == "%":
+            regex += ".*"
+        elif char == "_":
+            regex += "."
+        else:
+            regex += re.escape(char)
+    return re.compile(regex, re.IGNORECASE | re.DOTALL)
+
+
+def _split_or(filters: str):
+    # item_tag.ilike."a\\,b",item_tag.eq.c -> [(column, operator, value)]
+    parts, current, quoted, escaped = [], "", False, False
+    for char in filters:
+        if escaped:
+            current += char
+            escaped = False
+        elif char == "\\" and quoted:
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char == "," and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    parts.append(current)
+    return [tuple(part.split(".", 2)) for part in parts if part]
+
+
+def _matches(row, column, operator, value) -> bool:
+    actual = row.get(column)
+    if operator == "eq":
+        return actual == value or (actual is not None and str(actual) == str(value))
+    if operator == "neq":
+        return not _matches(row, column, "eq", value)
+    if operator == "ilike":
+        return actual is not None and bool(_like_regex(value).fullmatch(str(actual)))
+    if operator == "in":
+        return actual in value
+    if actual is None:
+        return False
+    return {"gt": actual > value, "gte": actual >= value, "lt": actual < value, "lte": actual <= value}[operator]
+
+
+class Response:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class Query:
+    def __init__(self, db: "FakeSupabase", table: str):
+        self._db = db
+        self._table = table
+        self._operation = "select"
+        self._payload = None
+        self._on_conflict = None
+        self._ignore_duplicates = False
+        self._count = None
+        self._head = False
+        self._filters = []
+        self._order = []
+        self._range = None
+
+    # Operations
+    def select(self, columns="*", count=None, head=False):
+        self._operation, self._count, self._head = "select", count, head
+        return self
+
+    def insert(self, rows):
+        self._operation, self._payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict="", ignore_duplicates=False):
+        self._operation, self._payload = "upsert", rows
+        self._on_conflict = tuple(column.strip() for column in on_conflict.split(",")) if on_conflict else None
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, data):
+        self._operation, self._payload = "update", data
+        return self
+
+    def delete(self):
+        self._operation = "delete"
+        return self
+
+    # Filters
+    def _filter(self, column, operator, value):
+        self._filters.append(lambda row: _matches(row, column, operator, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", value)
+
+    def neq(self, column, value):
+        return self._filter(column, "neq", value)
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._filter(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "lte", value)
+
+    def ilike(self, column, pattern):
+        return self._filter(column, "ilike", pattern)
+
+    def in_(self, column, values):
+        return self._filter(column, "in", list(values))
+
+    def or_(self, filters):
+        conditions = _split_or(filters)
+        self._filters.append(lambda row: any(_matches(row, *condition) for condition in conditions))
+        return self
+
+    # Modifiers
+    def order(self, column, desc=False):
+        self._order.append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end + 1)
+        return self
+
+    def limit(self, count):
+        self._range = (0, count)
+        return self
+
+    def execute(self) -> Response:
+        return self._db.run(getattr(self, f"_execute_{self._operation}"))
+
+    def _selected(self):
+        return [row for row in self._db.tables[self._table] if all(check(row) for check in self._filters)]
+
+    def _execute_select(self):
+        rows = self._selected()
+        for column, desc in reversed(self._order):
+            rows.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        count = len(rows) if self._count else None
+        if self._range:
+            rows = rows[self._range[0]:self._range[1]]
+        return Response([] if self._head else [dict(row) for row in rows], count)
+
+    def _execute_insert(self):
+        rows = self._payload if isinstance(self._payload, list) else [self._payload]
+        return Response([dict(self._db.insert(self._table, row)) for row in rows])
+
+    def _execute_upsert(self):
+        rows = self._payload if isinstance(self._payload, list) else [self._payload]
+        result = []
+        for row in rows:
+            existing = self._db.find(self._table, row, self._on_conflict)
+            if existing is None:
+                result.append(dict(self._db.insert(self._table, row)))
+            elif not self._ignore_duplicates:
+                existing.update(row)
+                result.append(dict(existing))
+        return Response(result)
+
+    def _execute_update(self):
+        rows = self._selected()
+        for row in rows:
+            self._db.update(self._table, row, self._payload)
+        return Response([dict(row) for row in rows])
+
+    def _execute_delete(self):
+        rows = self._selected()
+        self._db.tables[self._table] = [row for row in self._db.tables[self._table] if row not in rows]
+        return Response([dict(row) for row in rows])
+
+
+class Rpc:
+    def __init__(self, db: "FakeSupabase", name: str, params: dict):
+        self._db = db
+        self._name = name
+        self._params = params
+
+    def execute(self) -> Response:
+        return self._db.run(lambda: Response(getattr(self._db, f"_rpc_{self._name}")(**self._params)))
+
+
+class FakeSupabase:
+    '''
+    :param latency: Seconds every query / rpc blocks its db thread, like a round trip to Supabase
+    '''
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables = defaultdict(list)
+        self.lock = threading.Lock()
+        self.round_trips = 0
+        self.busy_seconds = 0.0  # Time spent executing queries, without the latency
+        self._settled_batches = set()
+
+    def run(self, operation):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            started = time.perf_counter()
+            try:
+                return operation()
+            finally:
+                self.busy_seconds += time.perf_counter() - started
+
+    def table(self, name: str) -> Query:
+        return Query(self, name)
+
+    def rpc(self, name: str, params: dict) -> Rpc:
+        return Rpc(self, name, params)
+
+    # Row helpers, also used to seed the tables. Call them with self.lock held while queries may run.
+    def find(self, table: str, values: dict, columns=None):
+        columns = columns or PRIMARY_KEYS.get(table, ())
+        if not columns:
+            return None
+        for row in self.tables[table]:
+            if all(_matches(row, column, "eq", values.get(column)) for column in columns):
+                return row
+        return None
+
+    def insert(self, table: str, row: dict) -> dict:
+        if table in PRIMARY_KEYS and self.find(table, row) is not None:
+            raise Exception(f'duplicate key value violates unique constraint on "{table}"')
+        row = dict(row)
+        # Column defaults of the real tables
+        row.setdefault("created_at", _now().isoformat())
+        if table == "Players":
+            row.setdefault("version", 0)
+        if table in ("Buy_Orders", "Sell_Orders"):
+            row.setdefault("expires_at", (_now() + timedelta(days=3)).isoformat())
+        self.tables[table].append(row)
+        return row
+
+    def seed(self, table: str, rows):
+        '''
+        Bulk insert for large benchmark tables, without the primary key check. The caller keeps the keys unique.
+        '''
+        for row in rows:
+            row = dict(row)
+            row.setdefault("created_at", _now().isoformat())
+            self.tables[table].append(row)
+
+    def update(self, table: str, row: dict, values: dict):
+        row.update(values)
+        if table == "Players":
+            # players_bump_version trigger
+            row["version"] = row.get("version", 0) + 1
+
+    def _balance_row(self, server_id, user_id, is_company):
+        if is_company:
+            return self.find("Companies", {"entrepreneur_id": user_id, "server_id": server_id})
+        return self.find("Players", {"id": user_id, "server_id": server_id})
+
+    def _adjust_balance(self, server_id, user_id, is_company, delta):
+        row = self._balance_row(server_id, user_id, is_company)
+        if row is not None:
+            column = "capital" if is_company else "money"
+            self.update("Companies" if is_company else "Players", row, {column: row[column] + delta})
+
+    def _item_row(self, server_id, user_id, is_company, item_tag):
+        table = "Company_Items" if is_company else "Player_Items"
+        owner = "company_entrepreneur_id" if is_company else "user_id"
+        for row in self.tables[table]:
+            if row[owner] == user_id and row["server_id"] == server_id and _same_tag(row["item_tag"], item_tag):
+                return table, row
+        return table, None
+
+    def _adjust_items(self, server_id, user_id, is_company, item_tag, delta):
+        table, row = self._item_row(server_id, user_id, is_company, item_tag)
+        if row is None:
+            if delta <= 0:
+                return
+            if is_company:
+                row = {"company_entrepreneur_id": user_id, "server_id": server_id, "item_tag": item_tag, "amount": 0}
+            else:
+                item = next((item for item in self.tables["Items"] if _same_tag(item["item_tag"], item_tag)), None)
+                if item is None:
+                    return
+                row = {"user_id": user_id, "server_id": server_id, "item_tag": item["item_tag"], "amount": 0,
+                       "durability": item.get("durability")}
+            row = self.insert(table, row)
+        row["amount"] += delta
+        if row["amount"] <= 0:
+            self.tables[table].remove(row)
+
+    def _accrue_taxes(self, server_id, user_id, is_company, amount, today):
+        if amount <= 0:
+            return
+        self._rpc_increment_gdp(server_id, today, amount)
+        government = self.find("Government", {"id": server_id}) or self.insert(
+            "Government", {"id": server_id, "taxrate": 0.1, "interest_rate": 0.3, "treasury": 0, "gambling_pool": 0})
+        tax = round(amount * (government.get("taxrate") or 0), 2)
+        row = self._balance_row(server_id, user_id, is_company)
+        if tax > 0 and row is not None:
+            self.update("Companies" if is_company else "Players", row, {"taxes_owed": (row.get("taxes_owed") or 0) + tax})
+
+    def _resting_orders(self, table, server_id, item_tag, crosses):
+        now = _now()
+        return [
+            order for order in self.tables[table]
+            if order["server_id"] == server_id and order["item_tag"] == item_tag and crosses(order["unit_price"])
+            and _timestamp(order["expires_at"]) > now
+        ]
+
+    def _fill(self, table, order, amount):
+        if amount == order["amount"]:
+            self.tables[table].remove(order)
+        else:
+            order["amount"] -= amount
+
+    @staticmethod
+    def _fill_entry(order, amount, total):
+        return {"user_id": order["user_id"], "is_company": order["is_company"], "amount": amount,
+                "unit_price": order["unit_price"], "total_price": total}
+
+    # SQL functions (src/db/migrations)
+    def _rpc_fill_buy_order(self, p_server_id, p_user_id, p_is_company, p_item_tag, p_unit_price, p_amount, p_today):
+        fills = []
+        buyer = self._balance_row(p_server_id, p_user_id, p_is_company)
+        if buyer is None:
+            return fills
+        balance = buyer["capital" if p_is_company else "money"]
+        orders = self._resting_orders("Sell_Orders", p_server_id, p_item_tag, lambda price: price <= p_unit_price)
+        for order in sorted(orders, key=lambda order: (order["unit_price"], order["created_at"])):
+            if p_amount <= 0:
+                break
+            if self._balance_row(p_server_id, order["user_id"], order["is_company"]) is None:
+                self.tables["Sell_Orders"].remove(order)
+                continue
+            match = min(p_amount, order["amount"], floor(balance / order["unit_price"]))
+            if match <= 0:
+                break
+            total = round(match * order["unit_price"], 2)
+            self._adjust_balance(p_server_id, p_user_id, p_is_company, -total)
+            self._adjust_items(p_server_id, p_user_id, p_is_company, p_item_tag, match)
+            self._adjust_balance(p_server_id, order["user_id"], order["is_company"], total)
+            self._accrue_taxes(p_server_id, order["user_id"], order["is_company"], total, p_today)
+            fills.append(self._fill_entry(order, match, total))
+            self._fill("Sell_Orders", order, match)
+            balance -= total
+            p_amount -= match
+        return fills
+
+    def _rpc_fill_sell_order(self, p_server_id, p_user_id, p_is_company, p_item_tag, p_unit_price, p_amount, p_today):
+        fills = []
+        if self._balance_row(p_server_id, p_user_id, p_is_company) is None:
+            return fills
+        _, items = self._item_row(p_server_id, p_user_id, p_is_company, p_item_tag)
+        p_amount = min(p_amount, items["amount"] if items else 0)
+        orders = self._resting_orders("Buy_Orders", p_server_id, p_item_tag, lambda price: price >= p_unit_price)
+        for order in sorted(orders, key=lambda order: (-order["unit_price"], order["created_at"])):
+            if p_amount <= 0:
+                break
+            buyer = self._balance_row(p_server_id, order["user_id"], order["is_company"])
+            if buyer is None:
+                self.tables["Buy_Orders"].remove(order)
+                continue
+            balance = buyer["capital" if order["is_company"] else "money"]
+            match = min(p_amount, order["amount"], floor(balance / order["unit_price"]))
+            if match <= 0:
+                continue
+            total = round(match * order["unit_price"], 2)
+            self._adjust_items(p_server_id, p_user_id, p_is_company, p_item_tag, -match)
+            self._adjust_items(p_server_id, order["user_id"], order["is_company"], p_item_tag, match)
+            self._adjust_balance(p_server_id, order["user_id"], order["is_company"], -total)
+            self._adjust_balance(p_server_id, p_user_id, p_is_company, total)
+            self._accrue_taxes(p_server_id, p_user_id, p_is_company, total, p_today)
+            fills.append(self._fill_entry(order, match, total))
+            self._fill("Buy_Orders", order, match)
+            p_amount -= match
+        return fills
+
+    def _rpc_expire_orders(self, p_now=None):
+        now = _timestamp(p_now) if p_now else _now()
+        expired = {}
+        for table, key in (("Buy_Orders", "buy_orders"), ("Sell_Orders", "sell_orders")):
+            expired[key] = [dict(order) for order in self.tables[table] if _timestamp(order["expires_at"]) <= now]
+            self.tables[table] = [order for order in self.tables[table] if _timestamp(order["expires_at"]) > now]
+        for order in expired["sell_orders"]:
+            self._adjust_items(order["server_id"], order["user_id"], order["is_company"], order["item_tag"], order["amount"])
+        return expired
+
+    def _rpc_increment_gdp(self, p_server_id, p_date, p_amount):
+        entry = self.find("Government_GDP", {"server_id": p_server_id, "date": p_date})
+        if entry is None:
+            self.insert("Government_GDP", {"server_id": p_server_id, "date": p_date, "gdp_value": p_amount})
+        else:
+            entry["gdp_value"] += p_amount
+
+    def _rpc_settle_taxes(self, p_batch_id, p_entries):
+        if p_batch_id in self._settled_batches:
+            return False
+        self._settled_batches.add(p_batch_id)
+        for entry in p_entries:
+            row = self._balance_row(entry["server_id"], entry["user_id"], entry["is_company"])
+            if row is not None:
+                self.update("Companies" if entry["is_company"] else "Players", row,
+                            {"taxes_owed": (row.get("taxes_owed") or 0) + entry["amount"]})
+        return True
+
+    def _rpc_adjust_government(self, p_id, p_treasury, p_gambling_pool):
+        row = self.find("Government", {"id": p_id})
+        if row is None:
+            return []
+        if p_treasury < 0 and (row.get("treasury") or 0) + p_treasury < 0:
+            return []
+        if p_gambling_pool < 0 and (row.get("gambling_pool") or 0) + p_gambling_pool < 0:
+            return []
+        row["treasury"] = (row.get("treasury") or 0) + p_treasury
+        row["gambling_pool"] = (row.get("gambling_pool") or 0) + p_gambling_pool
+        return [dict(row)]
+
+    def _rpc_adjust_company(self, p_entrepreneur_id, p_server_id, p_capital, p_taxes_owed):
+        row = self.find("Companies", {"entrepreneur_id": p_entrepreneur_id, "server_id": p_server_id})
+        if row is None:
+            return []
+        row["capital"] = (row.get("capital") or 0) + p_capital
+        row["taxes_owed"] = (row.get("taxes_owed") or 0) + p_taxes_owed
+        return [dict(row)]
+
+
+def install(latency: float = 0.0) -> FakeSupabase:
+    '''
+    Puts a FakeSupabase in place of src.db.db, so db_calls talks to it instead of Supabase.
+    Returns the one that is already in place if there is one (several test modules in one run).
+    '''
+    current = sys.modules.get("src.db.db")
+    if current is not None and isinstance(getattr(current, "supabase", None), FakeSupabase):
+        return current.supabase
+    if "src.db.db_calls" in sys.modules:
+        raise RuntimeError("install() has to run before src.db.db_calls is imported")
+    fake = FakeSupabase(latency)
+    module = types.ModuleType("src.db.db")
+    module.supabase = fake
+    sys.modules["src.db.db"] = module
+    return fake
@@ -0,0 +1,200 @@
+"""
+Offline load test: runs the real command callbacks against an in-memory database (fake_supabase)
+and fake interactions (fake_discord), for many users on many guilds at once.
+Reports p50 / p95 / p99 latency and the queries per command.
+
+Needs the bot's own dependencies (discord.py, fastapi, ...), but no Discord token and no Supabase project.
+
+Run with: python -m src.benchmarks.load_test --users 50 --guilds 4 --rounds 5 --latency 0.02
+"""
+import argparse
+import asyncio
+import io
+import random
+import sys
+import time
+
+from collections import defaultdict
+from contextlib import redirect_stdout
+from statistics import mean
+
+from src.benchmarks import fake_supabase
+from src.benchmarks.fake_discord import FakeClient, FakeGuild, FakeInteraction, FakeUser
+
+ITEMS = [
+    {"item_tag": "Wood", "producible": False, "ingredients": None, "worksteps": None, "base_price": 10.0, "durability": None},
+    {"item_tag": "Rubber", "producible": False, "ingredients": None, "worksteps": None, "base_price": 15.0, "durability": None},
+    {"item_tag": "Axe", "producible": False, "ingredients": None, "worksteps": None, "base_price": 50.0, "durability": 1000000},
+    {"item_tag": "Tool", "producible": False, "ingredients": None, "worksteps": None, "base_price": 40.0, "durability": 1000000},
+    {"item_tag": "Chair", "producible": True, "ingredients": "Wood:2", "worksteps": 2, "base_price": 60.0, "durability": None},
+]
+
+# Commands per role, every user runs the next one of its role each round
+TRADER_COMMANDS = ("buy", "sell", "roulette", "leaderboard")
+LUMBERJACK_COMMANDS = ("chop",)
+WORKER_COMMANDS = ("work",)
+
+
+class Harness:
+    def __init__(self, db, users: int, guilds: int):
+        # Imported here, after the fake database is installed
+        import src.main as main
+        from src.db.db_calls import to_row
+        from src.helper.defaults import get_default_player
+
+        self.db = db
+        self.main = main
+        self.guilds = [FakeGuild(1000 + g) for g in range(guilds)]
+        self.users = [FakeUser(1 + u) for u in range(users)]
+        self.client = FakeClient(self.users)
+        self.durations = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+
+        for item in ITEMS:
+            db.insert("Items", item)
+        for guild in self.guilds:
+            db.insert("Government", {"id": guild.id, "created_at": None, "taxrate": 0.1, "interest_rate": 0.3,
+                                     "treasury": 0.0, "governing_role": None, "admin_role": None, "gambling_pool": 1e9})
+            db.insert("Companies", {"entrepreneur_id": 0, "server_id": guild.id, "producible_items": "Chair",
+                                    "capital": 1e9, "worksteps": "0", "wage": 10.0, "name": "Benchmark Inc.", "taxes_owed": 0.0})
+            db.insert("Company_Items", {"company_entrepreneur_id": 0, "server_id": guild.id, "item_tag": "Wood", "amount": 10 ** 9})
+            for index, user in enumerate(self.users):
+                player = to_row(get_default_player(user.id, guild.id))
+                player["money"] = 1e6
+                player["job"] = self.role(index)
+                if player["job"] == "Worker":
+                    player["company_entrepreneur_id"] = 0
+                db.insert("Players", player)
+                tool = {"Lumberjack": "Axe", "Worker": "Tool"}.get(player["job"])
+                if tool:
+                    db.insert("Player_Items", {"user_id": user.id, "server_id": guild.id, "item_tag": tool,
+                                               "amount": 1, "durability": 1000000})
+                db.insert("Player_Items", {"user_id": user.id, "server_id": guild.id, "item_tag": "Wood",
+                                           "amount": 10 ** 6, "durability": None})
+
+    @staticmethod
+    def role(index: int) -> str:
+        return ("Trader", "Lumberjack", "Worker")[index % 3]
+
+    def commands_of(self, index: int):
+        return {"Trader": TRADER_COMMANDS, "Lumberjack": LUMBERJACK_COMMANDS, "Worker": WORKER_COMMANDS}[self.role(index)]
+
+    def rest(self, user_id: int, server_id: int):
+        # Jobs and /work have a cooldown and need food, reset them so every round actually works
+        with self.db.lock:
+            player = self.db.find("Players", {"id": user_id, "server_id": server_id})
+            self.db.update("Players", player, {"hunger": 100, "thirst": 100, "work_cooldown_until": None})
+
+    def callback(self, command: str, interaction, user_id: int):
+        from discord import app_commands
+
+        main = self.main
+        if command == "buy":
+            return main.init_buy.callback(interaction, "Wood", round(random.uniform(9, 12), 1), random.randint(1, 5))
+        if command == "sell":
+            return main.init_sell.callback(interaction, "Wood", round(random.uniform(8, 11), 1), random.randint(1, 5))
+        if command == "roulette":
+            color = random.choice(("red", "black"))
+            return main.init_roulette.callback(interaction, app_commands.Choice(name=color, value=color), 10)
+        if command == "leaderboard":
+            return main.leaderboard.callback(interaction)
+        if command == "chop":
+            self.rest(user_id, interaction.guild.id)
+            return main.init_chop.callback(interaction)
+        if command == "work":
+            self.rest(user_id, interaction.guild.id)
+            return main.work.callback(interaction, "Chair")
+        raise ValueError(command)
+
+    async def run_command(self, command: str, guild: FakeGuild, user: FakeUser):
+        from src.db.instrumentation import start_trace
+
+        interaction = FakeInteraction(self.client, guild, user)
+        # Runs in its own task like a real interaction, so the trace only sees this command
+        trace = start_trace()
+        started = time.perf_counter()
+        try:
+            await self.callback(command, interaction, user.id)
+        except Exception as e:
+            self.errors[command] += 1
+            print(f"/{command} failed: {e!r}", file=sys.stderr)
+        self.durations[command].append(time.perf_counter() - started)
+        self.queries[command].append(trace.queries)
+
+    async def setup(self):
+        from src.db.db_calls import item_catalog
+        from src.helper.market import ensure_market_initialized
+        from src.helper.notifications import dm_queue
+
+        # The wheel animation sleeps for several seconds, that's not what we measure
+        roulette_module = sys.modules[self.main.roulette.__module__]
+        roulette_module.asyncio = type("NoSleep", (), {"sleep": staticmethod(lambda seconds: asyncio.sleep(0))})
+
+        await item_catalog.load()
+        await asyncio.gather(*(ensure_market_initialized(guild.id) for guild in self.guilds))
+        dm_queue.start(self.client)
+
+    async def run(self, rounds: int):
+        for round_number in range(rounds):
+            tasks = []
+            for guild in self.guilds:
+                for index, user in enumerate(self.users):
+                    commands = self.commands_of(index)
+                    command = commands[(round_number + index) % len(commands)]
+                    tasks.append(asyncio.create_task(self.run_command(command, guild, user)))
+            await asyncio.gather(*tasks)
+
+    async def teardown(self):
+        from src.helper.gdp import gdp_accumulator
+        from src.helper.notifications import dm_queue
+        from src.helper.tax_ledger import tax_ledger
+
+        await gdp_accumulator.flush()
+        await tax_ledger.close()
+        await dm_queue.close()
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(harness: Harness, elapsed: float, latency: float):
+    total = sum(len(durations) for durations in harness.durations.values())
+    print(f"{len(harness.users)} users on {len(harness.guilds)} guilds, {latency * 1000:.0f} ms per query, "
+          f"{total} commands in {elapsed:.2f}s ({total / elapsed:.1f} commands/s, {harness.db.round_trips} round trips)")
+    print(f"  {'command':<14}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}")
+    for command in sorted(harness.durations):
+        durations = [seconds * 1000 for seconds in harness.durations[command]]
+        print(f"  {'/' + command:<14}{len(durations):>7}{harness.errors[command]:>8}"
+              f"{percentile(durations, 50):>10.1f}{percentile(durations, 95):>10.1f}{percentile(durations, 99):>10.1f}"
+              f"{mean(harness.queries[command]):>10.1f}")
+
+
+async def main(args):
+    db = fake_supabase.install(args.latency)
+    harness = Harness(db, args.users, args.guilds)
+
+    output = sys.stdout if args.verbose else io.StringIO()
+    with redirect_stdout(output):
+        await harness.setup()
+        started = time.perf_counter()
+        await harness.run(args.rounds)
+        elapsed = time.perf_counter() - started
+        await harness.teardown()
+
+    report(harness, elapsed, args.latency)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=30, help="Users per guild")
+    parser.add_argument("--guilds", type=int, default=2)
+    parser.add_argument("--rounds", type=int, default=5, help="Every user runs one command per round, rounds run one after another")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per database round trip")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="Show what the commands print")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(main(args))
@@ -0,0 +1,167 @@
+"""
+Micro-benchmark of the order matching paths against books of 10, 1k and 100k resting orders:
+handle_player_sell_orders (/buy), handle_player_buy_orders (/sell) and /company buy, /company sell.
+Runs against the in-memory database (fake_supabase) without latency, so the numbers are the bot's own work
+plus the fake database, which is shown separately. Compare the output before and after touching the matching code.
+filled/s is how fast the resting orders of the other side shrink. A path that doesn't fill anything is reported
+as NO FILLS instead of a rate.
+
+The player paths only need this repo. The company paths call the command callbacks in src.main
+and need the bot's dependencies (discord.py, fastapi, ...).
+
+Run with: python -m src.benchmarks.matching --sizes 10 1000 100000 --calls 200
+"""
+import argparse
+import asyncio
+import io
+import sys
+import time
+
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+from statistics import median
+
+from src.benchmarks import fake_supabase
+from src.benchmarks.fake_discord import FakeClient, FakeGuild, FakeInteraction, FakeUser
+
+ITEM = {"item_tag": "Wood", "producible": False, "ingredients": None, "worksteps": None, "base_price": 10.0, "durability": None}
+MAX_RESTING_USERS = 1000
+RESTING_AMOUNT = 10 ** 9  # Every call only takes a part of the best order, so the book keeps its size
+AMOUNT = 5  # Per call, the company commands allow at most 10
+TRADER_ID = 10 ** 7
+PATHS = ("buy", "sell", "company_buy", "company_sell")
+
+
+def seed(db, server_id: int, size: int):
+    from src.db.db_calls import to_row
+    from src.helper.defaults import get_default_player
+
+    # The order key is (user, price, ...), so the resting orders are spread over users and price levels
+    users = min(size, MAX_RESTING_USERS)
+    user_ids = [1 + u for u in range(users)] + [TRADER_ID]
+    players = [to_row(get_default_player(user_id, server_id)) for user_id in user_ids]
+    for player in players:
+        player.update(money=1e15, job="Entrepreneur" if player["id"] == TRADER_ID else None, version=0)
+    db.seed("Players", players)
+    db.seed("Player_Items", ({"user_id": user_id, "server_id": server_id, "item_tag": ITEM["item_tag"],
+                              "amount": 10 ** 12, "durability": None} for user_id in user_ids))
+    db.insert("Companies", {"entrepreneur_id": TRADER_ID, "server_id": server_id, "producible_items": "", "capital": 1e15,
+                            "worksteps": "", "wage": 0.0, "name": "Benchmark Inc.", "taxes_owed": 0.0})
+    db.insert("Company_Items", {"company_entrepreneur_id": TRADER_ID, "server_id": server_id,
+                                "item_tag": ITEM["item_tag"], "amount": 10 ** 12})
+    db.insert("Government", {"id": server_id, "created_at": None, "taxrate": 0.1, "interest_rate": 0.3,
+                             "treasury": 0.0, "governing_role": None, "admin_role": None, "gambling_pool": 0.0})
+
+    expires_at = (datetime.now(timezone.utc) + timedelta(days=30)).isoformat()
+    for table, direction in (("Sell_Orders", 1), ("Buy_Orders", -1)):
+        db.seed(table, (
+            {"user_id": 1 + index % users, "item_tag": ITEM["item_tag"], "server_id": server_id, "amount": RESTING_AMOUNT,
+             "unit_price": round(10.0 + direction * 0.01 * (index // users), 2), "is_company": False, "expires_at": expires_at}
+            for index in range(size)
+        ))
+
+
+def resting_amount(db, table: str, server_id: int) -> int:
+    return sum(order["amount"] for order in db.tables[table] if order["server_id"] == server_id)
+
+
+class Bench:
+    def __init__(self, db, server_id: int, paths):
+        self.db = db
+        self.guild = FakeGuild(server_id)
+        self.trader = FakeUser(TRADER_ID)
+        self.client = FakeClient([self.trader])
+        self.company_group = None
+        if {"company_buy", "company_sell"} & set(paths):
+            import src.main as main
+            self.company_group = main.CompanyGroup()
+
+    def rest(self):
+        # /company sell costs hunger and thirst and sets the work cooldown
+        with self.db.lock:
+            player = self.db.find("Players", {"id": TRADER_ID, "server_id": self.guild.id})
+            self.db.update("Players", player, {"hunger": 100, "thirst": 100, "work_cooldown_until": None})
+
+    async def call(self, path: str, interaction):
+        from src.commands.buy import handle_player_sell_orders
+        from src.commands.sell import handle_player_buy_orders
+        from src.db.db_calls import get_player
+
+        # Prices cross the best level of the other side only, see seed()
+        if path == "buy":
+            player = await get_player(TRADER_ID, self.guild.id)
+            await handle_player_sell_orders(interaction, player, ITEM["item_tag"], 10.0, AMOUNT)
+        elif path == "sell":
+            player = await get_player(TRADER_ID, self.guild.id)
+            await handle_player_buy_orders(interaction, player, ITEM["item_tag"], 10.0, AMOUNT)
+        elif path == "company_buy":
+            await self.company_group.company_buy.callback(self.company_group, interaction, ITEM["item_tag"], 10.0, AMOUNT)
+        elif path == "company_sell":
+            self.rest()
+            await self.company_group.company_sell.callback(self.company_group, interaction, ITEM["item_tag"], 10.0, AMOUNT)
+
+    async def measure(self, path: str, calls: int):
+        from src.db.instrumentation import start_trace
+
+        # Warm up: loads the order book
+        await self.call(path, FakeInteraction(self.client, self.guild, self.trader))
+        table = "Sell_Orders" if path.endswith("buy") else "Buy_Orders"
+        before = resting_amount(self.db, table, self.guild.id)
+
+        durations, db_seconds, queries = [], 0.0, 0
+        for _ in range(calls):
+            if path == "company_sell":
+                self.rest()
+            interaction = FakeInteraction(self.client, self.guild, self.trader)
+            trace = start_trace()
+            busy = self.db.busy_seconds
+            started = time.perf_counter()
+            await self.call(path, interaction)
+            durations.append(time.perf_counter() - started)
+            db_seconds += self.db.busy_seconds - busy
+            queries += trace.queries
+
+        filled = before - resting_amount(self.db, table, self.guild.id)
+        total = sum(durations)
+        return {
+            "calls/s": calls / total,
+            # None = the path didn't fill a single resting order, which is a broken path and not a slow one
+            "filled/s": filled / total if filled > 0 else None,
+            "p50 ms": median(durations) * 1000,
+            "max ms": max(durations) * 1000,
+            "queries": queries / calls,
+            "db %": 100 * db_seconds / total,
+        }
+
+
+async def main(args):
+    db = fake_supabase.install(0.0)
+    db.insert("Items", ITEM)
+
+    from src.db.db_calls import item_catalog
+
+    await item_catalog.load()
+    print(f"{args.calls} calls per path, {AMOUNT} units per call")
+    print(f"  {'orders':>8} {'path':<14}{'calls/s':>10}{'filled/s':>10}{'p50 ms':>9}{'max ms':>9}{'queries':>9}{'db %':>7}")
+    for size in args.sizes:
+        server_id = size
+        seed(db, server_id, size)
+        bench = Bench(db, server_id, args.paths)
+        for path in args.paths:
+            output = sys.stdout if args.verbose else io.StringIO()
+            with redirect_stdout(output):
+                result = await bench.measure(path, args.calls)
+            filled = f"{result['filled/s']:>10.1f}" if result["filled/s"] is not None else f"{'NO FILLS':>10}"
+            print(f"  {size:>8} {path:<14}{result['calls/s']:>10.1f}{filled}{result['p50 ms']:>9.2f}"
+                  f"{result['max ms']:>9.2f}{result['queries']:>9.1f}{result['db %']:>7.0f}")
+            if result["filled/s"] is None:
+                print(f"           {path} didn't fill any resting order, check the path before reading its timings")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000], help="Resting orders per side")
+    parser.add_argument("--calls", type=int, default=200, help="Measured calls per path and size")
+    parser.add_argument("--paths", nargs="+", choices=PATHS, default=list(PATHS))
+    parser.add_argument("--verbose", action="store_true", help="Show what the commands print")
+    asyncio.run(main(parser.parse_args()))
@@ -1,11 +1,11 @@
 from discord import Interaction, User, Member, Embed, Color
 
-from datetime import datetime
-
-from src.db.db_calls import get_item, get_player, get_own_buy_orders, get_market_item, get_all_items, get_sell_orders, add_object, update_player, update_buy_order, delete_sell_orders, update_sell_order, update_market_item
-from src.helper.defaults import get_default_player, get_default_market_item, get_default_buy_order
+from src.db.db_calls import get_item, get_player, get_own_buy_orders, get_market_item, add_object, update_player, update_buy_order, update_market_item, \
+    fill_buy_order
+from src.helper.defaults import get_default_player, get_default_buy_order
 from src.helper.item import add_player_item
-from src.helper.transactions import transfer_money, increase_npc_price
+from src.helper.market import ensure_market_initialized
+from src.helper.transactions import notify_order_filled, increase_npc_price
 
 
 async def buy(
@@ -46,14 +46,18 @@ async def buy(
 
     if await check_existing_orders(interaction, user_id, server_id, item_tag, unit_price, amount): return
 
-    await check_market_initialized(server_id, item_tag)
+    await ensure_market_initialized(server_id)
 
     market_item = await get_market_item(server_id, item_tag)
 
     if unit_price == -1:
         unit_price = market_item.max_price
 
-    amount = await handle_player_sell_orders(interaction, player, item_tag, unit_price, amount)
+    remaining = await handle_player_sell_orders(interaction, player, item_tag, unit_price, amount)
+    if remaining < amount:
+        # The fills changed the player's money in the database
+        player = await get_player(user_id, server_id)
+    amount = remaining
 
     if amount > 0 and unit_price >= market_item.max_price and market_item.stockpile > 0:
         amount = await buy_from_npc_market(interaction, player, market_item, amount)
@@ -128,70 +132,26 @@ async def check_existing_orders(interaction, user_id, server_id, item_tag, unit_
         return True
     return False
 
-async def check_market_initialized(server_id, item_tag):
-    if await get_market_item(server_id, item_tag) is None:
-        items = await get_all_items()
-
-        for item in items:
-            market_item = get_default_market_item(item, server_id)
-            await add_object(market_item, "Market_Items")
-
-
 async def handle_player_sell_orders(interaction, player, item_tag, unit_price, amount):
-    fulfilled_total = 0
-    total_spent = 0.0
-
-    sell_orders = await get_sell_orders(player.server_id, item_tag, unit_price, datetime.now())
-
-    for sell_order in sell_orders:
-        if round(player.money,2) < round(sell_order.unit_price,2):
-            break
-
-        print(f"Checking sell order for {item_tag} at ${sell_order.unit_price}")
+    # Matching, money, taxes and inventory are handled by the database in one transaction
+    fills = await fill_buy_order(player.id, player.server_id, item_tag, unit_price, amount)
+    if not fills:
+        return amount
 
-        match_amount = min(amount, sell_order.amount)
-        total_price = round(match_amount * sell_order.unit_price, 2)
+    fulfilled_total = sum(fill.amount for fill in fills)
+    total_spent = sum(fill.total_price for fill in fills)
+    amount -= fulfilled_total
 
-        if round(player.money,2) < total_price:
-            match_amount = int(player.money // sell_order.unit_price)
-            total_price = round(match_amount * sell_order.unit_price, 2)
-
-        if match_amount <= 0:
-            break
-
-        await add_player_item(player.id, player.server_id, item_tag, match_amount)
-        await transfer_money(interaction, sell_order, total_price, match_amount, item_tag,
-                             "player", "company" if sell_order.is_company else "player", buyer=player)
-
-
-        if sell_order.amount == match_amount:
-            await delete_sell_orders(sell_order.user_id, sell_order.server_id, sell_order.item_tag, sell_order.unit_price)
-        else:
-            sell_order.amount -= match_amount
-            await update_sell_order(sell_order)
-
-        fulfilled_total += match_amount
-        total_spent += total_price
-        amount -= match_amount
-
-        if amount == 0:
-            await interaction.followup.send(
-                embed=Embed(
-                    title="Buy Order Fulfilled",
-                    description=f"You bought **{fulfilled_total}x {item_tag}** from player orders for **${total_spent:.2f}**.",
-                    color=Color.green()
-                )
-            )
-            return 0
-
-    if fulfilled_total > 0:
-        await interaction.followup.send(
-            embed=Embed(
-                title="Buy Order Partially Fulfilled",
-                description=f"You bought **{fulfilled_total}x {item_tag}** from player orders for **${total_spent:.2f}**.",
-                color=Color.green()
-            )
+    await interaction.followup.send(
+        embed=Embed(
+            title="Buy Order Fulfilled" if amount == 0 else "Buy Order Partially Fulfilled",
+            description=f"You bought **{fulfilled_total}x {item_tag}** from player orders for **${total_spent:.2f}**.",
+            color=Color.green()
         )
+    )
+
+    for fill in fills:
+        notify_order_filled(fill, "Sell", item_tag)
 
     return amount
 
@@ -90,10 +90,21 @@ async def roulette(
         )
         return
     
+    # The stake goes into the pool and the possible win (2x) is reserved right away,
+    # so games running at the same time can't pay out more than the pool holds
+    gov.gambling_pool -= amount
+    if not await update_government(gov):
+        await interaction.followup.send(
+            embed=discord.Embed(
+                title="Invalid Amount",
+                description=f"The gambling pool only consists of ${gov.gambling_pool} now, you cannot gamble for more!",
+                color=discord.Color.red()
+            )
+        )
+        return
+
     player.money -= amount
-    gov.gambling_pool += amount
     await update_player(player)
-    await update_government(gov)
 
     # Animation: send initial spinning message
     wheel_message = await interaction.followup.send("🎲 Spinning the wheel...", wait=True)
@@ -117,14 +128,16 @@ async def roulette(
     print(f"Final color: {final_color}. User chosen color: {color}")
 
     if final_color == color:
+        # Paid from the reservation
         player.money += 2 * amount
-        gov.gambling_pool -= 2 * amount
         result_embed = discord.Embed(
             title="You Win!",
             description=f"The ball landed on **{final_color.upper()} {final_number}**.\nYou won **${amount}**!",
             color=discord.Color.green()
         )
     else:
+        # Stake and reservation go back to the pool
+        gov.gambling_pool += 2 * amount
         result_embed = discord.Embed(
             title="You Lose!",
             description=f"The ball landed on **{final_color.upper()} {final_number}**.\nYou lost **${amount}**.",
@@ -49,7 +49,17 @@ async def sponsor(interaction: discord.Interaction, amount: int):
 
     gov.treasury -= amount
     gov.gambling_pool += amount
-    await update_government(gov)
+    # The check above used the cached row, another command may have spent the treasury since
+    if not await update_government(gov):
+        await interaction.followup.send(
+            embed=discord.Embed(
+                title="Error!",
+                description=f"The treasury only has ${gov.treasury} now, so you can't spend ${amount}.",
+                color=discord.Color.red()
+            ),
+            ephemeral=True
+        )
+        return
 
     await interaction.followup.send(embed=discord.Embed(
         title="Gambling sponsored",
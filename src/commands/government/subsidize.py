@@ -60,8 +60,19 @@ async def subsidize(interaction: discord.Interaction, user: discord.User | disco
         return
 
     gov.treasury -= amount
+    # The check above used the cached row, another command may have spent the treasury since
+    if not await update_government(gov):
+        await interaction.followup.send(
+            embed=discord.Embed(
+                title="Error!",
+                description=f"The treasury only has ${gov.treasury} now, so you can't spend ${amount}.",
+                color=discord.Color.red()
+            ),
+            ephemeral=True
+        )
+        return
+
     company.capital += amount
-    await update_government(gov)
     await update_company(company)
 
     await interaction.followup.send(embed=discord.Embed(
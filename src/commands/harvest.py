@@ -1,6 +1,8 @@
 from src.db.db_calls import get_player, add_object, update_player
 from src.helper.defaults import get_default_player
-from src.helper.player_checks import check_if_employed, check_if_on_cooldown, get_tool, check_hunger_thirst_bar
+from src.db.catalog import normalize_tag
+from src.helper.player_checks import check_if_employed, check_if_on_cooldown, get_tool, check_hunger_thirst_bar, \
+    probe_job_tools
 from src.helper.randoms import generate_resources
 from src.helper.item import use_item, add_player_item
 from src.helper.embed_creators import create_job_embed
@@ -29,7 +31,9 @@ async def harvest(interaction):
 
     if await check_if_on_cooldown(interaction, player): return
 
-    tool = await get_tool(interaction, player, job_items, err_message)
+    held_items = await probe_job_tools(player, job_items)
+
+    tool = await get_tool(interaction, player, job_items, err_message, held_items)
     if not tool: return
 
     old_hunger, old_thirst = await check_hunger_thirst_bar(interaction, player)
@@ -37,7 +41,8 @@ async def harvest(interaction):
 
     resource, amount = generate_resources(resource_choices, tool)
 
-    durability = await use_item(user_id, server_id, tool)
+    tool_item = held_items.get(normalize_tag(tool))
+    durability = await use_item(user_id, server_id, tool, tool_item) if tool_item else None
 
     await add_player_item(user_id, server_id, resource, amount)
 
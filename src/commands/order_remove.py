@@ -3,7 +3,7 @@ from discord import Interaction, Embed, Color
 from datetime import datetime
 
 from src.db.db_calls import get_sell_orders, get_own_item_sell_orders, get_own_sell_orders, get_company, \
-    delete_buy_orders, delete_sell_orders
+    delete_buy_orders, delete_sell_orders, get_item
 from src.helper.item import add_company_item, add_player_item
 
 
@@ -14,6 +14,19 @@ async def order_remove(interaction: Interaction, item_tag: str, price: float | N
         user_id = int(interaction.user.id)
         server_id = int(interaction.guild.id)
 
+        # Orders are stored under the spelling of the item catalog
+        item_obj = await get_item(item_tag)
+        if not item_obj:
+            await interaction.followup.send(
+                embed=Embed(
+                    title="Error!",
+                    description=f"Item **{item_tag}** does not exist.",
+                    color=Color.red()
+                ), ephemeral=True
+            )
+            return
+        item_tag = item_obj.item_tag
+
         now = datetime.now()
         if price is None:
             sell_orders = await get_own_item_sell_orders(user_id, server_id, item_tag, now, "both")
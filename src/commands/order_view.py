@@ -1,8 +1,10 @@
 from discord import Interaction, User, Embed, Color
 
+from asyncio import gather
 from datetime import datetime
 
-from src.db.db_calls import get_all_own_buy_orders, get_all_own_sell_orders
+from src.db.db_calls import get_all_own_buy_orders, get_all_own_sell_orders, count_own_orders
+from src.helper.paginator import Paginator
 
 
 async def order_view(interaction: Interaction, user: User | None = None):
@@ -15,40 +17,56 @@ async def order_view(interaction: Interaction, user: User | None = None):
     server_id = int(interaction.guild.id)
     now = datetime.now()
 
-    buy_orders = await get_all_own_buy_orders(user_id, server_id, now, "both")
-
-    sell_orders = await get_all_own_sell_orders(user_id, server_id, now, "both")
-
-    embed = Embed(
-        title=f"{target_user.display_name}'s Active Orders",
-        color=Color.yellow()
+    buy_count, sell_count = await gather(
+        count_own_orders("Buy_Orders", user_id, server_id),
+        count_own_orders("Sell_Orders", user_id, server_id)
     )
 
-    if buy_orders:
-        embed.add_field(
-            name="Buy Orders",
-            value="\n".join([
-                f"{'🏭 ' if o.is_company else ''}"
-                f"{o.amount}x {o.item_tag} @ ${o.unit_price:.2f} "
-                f"(expires <t:{int(o.expires_at.timestamp())}:R>)"
-                for o in buy_orders
-            ]),
-            inline=False
-        )
-    else:
-        embed.add_field(name="Buy Orders", value="None", inline=False)
-
-    if sell_orders:
-        embed.add_field(
-            name="Sell Orders",
-            value="\n".join([
-                f"{'🏭 ' if o.is_company else ''}"
-                f"{o.amount}x {o.item_tag} @ ${o.unit_price:.2f} "
-                for o in sell_orders
-            ]),
-            inline=False
+    # The pages run through the buy orders first, then the sell orders
+    async def fetch_page(offset, limit):
+        buy_orders, sell_orders = [], []
+        if offset < buy_count:
+            buy_orders = await get_all_own_buy_orders(user_id, server_id, now, "both", offset, limit) or []
+        if offset + limit > buy_count:
+            sell_offset = max(0, offset - buy_count)
+            sell_orders = await get_all_own_sell_orders(user_id, server_id, now, "both", sell_offset, limit - len(buy_orders)) or []
+        return buy_orders, sell_orders
+
+    def get_page_embed(page, orders, max_page):
+        buy_orders, sell_orders = orders
+        embed = Embed(
+            title=f"{target_user.display_name}'s Active Orders" + (f" (Page {page + 1}/{max_page + 1})" if max_page > 0 else ""),
+            color=Color.yellow()
         )
-    else:
-        embed.add_field(name="Sell Orders", value="None", inline=False)
 
-    await interaction.followup.send(embed=embed, ephemeral=(user is None))
+        if buy_orders:
+            embed.add_field(
+                name="Buy Orders",
+                value="\n".join([
+                    f"{'🏭 ' if o.is_company else ''}"
+                    f"{o.amount}x {o.item_tag} @ ${o.unit_price:.2f} "
+                    f"(expires <t:{int(o.expires_at.timestamp())}:R>)"
+                    for o in buy_orders
+                ]),
+                inline=False
+            )
+        elif page == 0:
+            embed.add_field(name="Buy Orders", value="None", inline=False)
+
+        if sell_orders:
+            embed.add_field(
+                name="Sell Orders",
+                value="\n".join([
+                    f"{'🏭 ' if o.is_company else ''}"
+                    f"{o.amount}x {o.item_tag} @ ${o.unit_price:.2f} "
+                    for o in sell_orders
+                ]),
+                inline=False
+            )
+        elif page == max_page:
+            embed.add_field(name="Sell Orders", value="None", inline=False)
+
+        return embed
+
+    paginator = Paginator(get_page_embed, fetch_page, buy_count + sell_count, items_per_page=10)
+    await interaction.followup.send(embed=await paginator.page_embed(), view=paginator, ephemeral=(user is None))
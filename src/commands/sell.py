@@ -1,13 +1,12 @@
 from discord import Interaction, User, Member, Embed, Color
 
-from datetime import datetime
-
-from src.db.db_calls import get_item, get_player, get_own_buy_orders, get_market_item, get_all_items, get_sell_orders, \
-    get_player_item, get_own_sell_orders, get_buy_orders, add_object, update_sell_order, delete_buy_orders, update_market_item, update_buy_order, update_player
-from src.helper.defaults import get_default_player, get_default_market_item, get_default_buy_order, \
+from src.db.db_calls import get_item, get_player, get_own_buy_orders, get_market_item, \
+    get_player_item, get_own_sell_orders, add_object, update_sell_order, update_market_item, update_player, fill_sell_order
+from src.helper.defaults import get_default_player, get_default_buy_order, \
     get_default_sell_order
-from src.helper.item import add_player_item, remove_player_item
-from src.helper.transactions import transfer_money, increase_npc_price, add_owed_taxes
+from src.helper.item import remove_player_item
+from src.helper.market import ensure_market_initialized
+from src.helper.transactions import notify_order_filled, increase_npc_price, add_owed_taxes
 
 
 async def sell(
@@ -44,19 +43,25 @@ async def sell(
 
     if await check_existing_orders(interaction, user_id, server_id, item_tag, unit_price, amount): return
 
-    await check_market_initialized(server_id, item_tag)
+    await ensure_market_initialized(server_id)
 
     market_item = await get_market_item(server_id, item_tag)
 
     if unit_price == -1:
         unit_price = market_item.min_price
 
-    amount = await handle_player_buy_orders(interaction, player, item_tag, unit_price, amount)
+    remaining = await handle_player_buy_orders(interaction, player, item_tag, unit_price, amount)
+    if remaining < amount:
+        # The fills changed the player's money in the database
+        player = await get_player(user_id, server_id)
+    amount = remaining
 
     if amount > 0 and unit_price <= market_item.min_price:
         amount = await sell_to_npc_market(interaction, player, market_item, amount)
 
     if amount > 0:
+        # The items go into the order, /order remove gives them back
+        await remove_player_item(user_id, server_id, item_tag, amount)
         new_order = get_default_sell_order(user_id, item_tag, server_id, amount, unit_price, is_company=False)
         await add_object(new_order, "Sell_Orders")
 
@@ -100,6 +105,7 @@ async def check_existing_orders(interaction, user_id, server_id, item_tag, unit_
 
     if len(existing_orders) > 0:
         existing_order = existing_orders[0]
+        await remove_player_item(user_id, server_id, item_tag, amount)
         existing_order.amount += amount
         await update_sell_order(existing_order)
 
@@ -116,79 +122,26 @@ async def check_existing_orders(interaction, user_id, server_id, item_tag, unit_
         return True
     return False
 
-async def check_market_initialized(server_id, item_tag):
-    if await get_market_item(server_id, item_tag) is None:
-        items = await get_all_items()
-
-        for item in items:
-            market_item = get_default_market_item(item, server_id)
-            await add_object(market_item, "Market_Items")
-
-
 async def handle_player_buy_orders(interaction, player, item_tag, unit_price, amount):
-    total_sold = 0
-    total_earned = 0.0
-
-    buy_orders = await get_buy_orders(player.server_id, item_tag, unit_price, datetime.now())
-
-    for buy_order in buy_orders:
-        buyer_user = await get_player(buy_order.user_id, buy_order.server_id)
-        buyer_money = round(buyer_user.money,2)
-
-        print(f"Checking buy order for {item_tag} at ${buy_order.unit_price}")
-
-        if total_sold >= amount:
-            break
-
-        match_amount = min(amount, buy_order.amount)
-        total_price = round(match_amount * buy_order.unit_price, 2)
-
-        if buyer_money < unit_price:
-            continue
-
-        if buyer_money < total_price:
-            match_amount = int(round(player.money,2) // round(buy_order.unit_price,2))
-            total_price = round(match_amount * round(buy_order.unit_price,2), 2)
-
-        if match_amount <= 0:
-            break
-
-
-        await remove_player_item(player.id, player.server_id, item_tag, match_amount)
-        await add_player_item(buy_order.user_id, buy_order.server_id, item_tag, match_amount)
-        await transfer_money(interaction, buy_order, total_price, match_amount, item_tag,
-                             "company" if buy_order.is_company else "player", "player" , seller=player)
+    # Matching, money, taxes and inventory are handled by the database in one transaction
+    fills = await fill_sell_order(player.id, player.server_id, item_tag, unit_price, amount)
+    if not fills:
+        return amount
 
+    total_sold = sum(fill.amount for fill in fills)
+    total_earned = sum(fill.total_price for fill in fills)
+    amount -= total_sold
 
-        if buy_order.amount == match_amount:
-            await delete_buy_orders(buy_order.user_id, buy_order.server_id, buy_order.item_tag, buy_order.unit_price)
-        else:
-            buy_order.amount -= match_amount
-            await update_buy_order(buy_order)
-
-        total_sold += match_amount
-        total_earned += total_price
-        amount -= match_amount
-
-
-        if amount == 0:
-            await interaction.followup.send(
-                embed=Embed(
-                    title="Sell Order Fulfilled",
-                    description=f"You sold **{total_sold}x {item_tag}** to player orders for **${total_earned:.2f}**.",
-                    color=Color.green()
-                )
-            )
-            return 0
-
-    if amount > 0 and total_sold > 0:
-        await interaction.followup.send(
-            embed=Embed(
-                title="Sell Order Partially Fulfilled",
-                description=f"You sold **{total_sold}x {item_tag}** to player orders for **${total_earned:.2f}**.",
-                color=Color.green()
-            )
+    await interaction.followup.send(
+        embed=Embed(
+            title="Sell Order Fulfilled" if amount == 0 else "Sell Order Partially Fulfilled",
+            description=f"You sold **{total_sold}x {item_tag}** to player orders for **${total_earned:.2f}**.",
+            color=Color.green()
         )
+    )
+
+    for fill in fills:
+        notify_order_filled(fill, "Buy", item_tag)
 
     return amount
 
@@ -3,6 +3,7 @@ from discord import Interaction, User, Member, Embed, Color
 from src.db.db_calls import get_player, get_player_inventory, add_object
 from src.helper.defaults import get_default_player
 from src.helper.embed_creators import create_inventory_embed
+from src.helper.tax_ledger import tax_ledger
 
 
 async def stats(interaction: Interaction, user: User | Member = None):
@@ -36,7 +37,8 @@ def create_stats_embed(target_user, player):
     embed.add_field(name="Hunger", value=f"{player.hunger}", inline=True)
     embed.add_field(name="Thirst", value=f"{player.thirst}", inline=True)
     embed.add_field(name="Job", value=player.job or "None", inline=True)
-    embed.add_field(name="Taxes Owed", value=f"${player.taxes_owed:.2f}", inline=True)
+    taxes_owed = player.taxes_owed + tax_ledger.pending(player.server_id, player.id, False)
+    embed.add_field(name="Taxes Owed", value=f"${taxes_owed:.2f}", inline=True)
     embed.set_footer(text=f"User ID: {target_user.id}")
 
     return embed
\ No newline at end of file
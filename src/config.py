@@ -13,4 +13,19 @@ JOB_SWITCH_COOLDOWN = timedelta(minutes=30)
 WORK_COOLDOWN = timedelta(minutes=5)
 GIFT_COOLDOWN = timedelta(hours=1)
 BUY_ORDER_DURATION = timedelta(days=3)
-SELL_ORDER_DURATION = timedelta(days=3)
\ No newline at end of file
+SELL_ORDER_DURATION = timedelta(days=3)
+
+DB_POOL_SIZE = 8
+SLOW_DB_CALL = timedelta(milliseconds=500)
+ITEM_CATALOG_TTL = timedelta(minutes=10)  # None = only reload via /reloaditems
+GOVERNMENT_TTL = timedelta(minutes=5)
+ORDER_SWEEP_INTERVAL = timedelta(minutes=5)
+GDP_FLUSH_INTERVAL = timedelta(seconds=30)
+TAX_SETTLE_INTERVAL = timedelta(minutes=1)
+TAX_JOURNAL_PATH = os.getenv("TAX_JOURNAL_PATH", "tax_journal.jsonl")
+USER_NAME_CACHE_SIZE = 2000
+USER_NAME_TTL = timedelta(minutes=30)
+USER_FETCH_CONCURRENCY = 5
+DM_BATCH_WINDOW = timedelta(seconds=2)
+DM_SEND_INTERVAL = timedelta(milliseconds=500)
+PLAYER_UPDATE_RETRIES = 3
\ No newline at end of file
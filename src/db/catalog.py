@@ -0,0 +1,69 @@
+import asyncio
+
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from src.db.models import Item
+from src.metrics import CACHE_LOOKUPS
+
+
+def normalize_tag(item_tag: str) -> str:
+    return item_tag.strip().lower()
+
+
+class ItemCatalog:
+    '''
+    Process-wide copy of the Items table, keyed by normalized item tag.
+
+    :param loader: Coroutine function returning all items (db_calls.get_all_items)
+    :param ttl: Reload the catalog when it is older than this. None keeps it until invalidate()
+    '''
+    def __init__(self, loader: Callable[[], Awaitable[List[Item]]], ttl: Optional[timedelta] = None):
+        self._loader = loader
+        self._ttl = ttl
+        self._items: Dict[str, Item] = {}
+        self._loaded_at: Optional[datetime] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def loaded_at(self) -> Optional[datetime]:
+        return self._loaded_at
+
+    @property
+    def is_stale(self) -> bool:
+        if self._loaded_at is None:
+            return True
+        return self._ttl is not None and datetime.now() - self._loaded_at > self._ttl
+
+    async def load(self):
+        async with self._lock:
+            # Another command may have loaded the catalog while we were waiting for the lock
+            if not self.is_stale:
+                return
+            items = await self._loader()
+            if items is None:
+                # Keep serving the old catalog if the reload failed
+                return
+            self._items = {normalize_tag(item.item_tag): item for item in items}
+            self._loaded_at = datetime.now()
+            print(f"Item catalog loaded ({len(self._items)} items)")
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    async def reload(self):
+        self.invalidate()
+        await self.load()
+
+    async def get(self, item_tag: str) -> Optional[Item]:
+        if self.is_stale:
+            CACHE_LOOKUPS.inc("item_catalog", "miss")
+            await self.load()
+        else:
+            CACHE_LOOKUPS.inc("item_catalog", "hit")
+        return self._items.get(normalize_tag(item_tag))
+
+    async def all(self) -> List[Item]:
+        if self.is_stale:
+            await self.load()
+        return list(self._items.values())
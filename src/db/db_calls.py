@@ -1,1226 +1,1181 @@
-from datetime import datetime, date
-from dateutil.parser import parse
-from dataclasses import asdict
+import asyncio
+
+from datetime import datetime, date, timezone
 from typing import Any
 
 from src.db.db import supabase
+from src.config import ITEM_CATALOG_TTL, GOVERNMENT_TTL, PLAYER_UPDATE_RETRIES
+from src.db.catalog import ItemCatalog, normalize_tag
+from src.db.recipes import Recipes
+from src.db.executor import execute
+from src.db.instrumentation import instrumented, ConflictError
+from src.db.order_book import OrderBooks, BUY, SELL
+from src.db.leaderboard import Leaderboards
+from src.db.government_cache import GovernmentCache
+from src.db.decoders import compile_decoder
+from src.db.unit_of_work import tracked, track, defer_write, forget, wrote_through
 from src.db.models import Player, PlayerItem, Item, CompanyItem, BuyOrder, MarketItem, SellOrder, Company, Government, \
-    GovernmentGDP, CompanyJoinRequest
+    GovernmentGDP, CompanyJoinRequest, OrderFill, field_names
+
+
+
+def serialize_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def to_row(obj):
+    return {name: serialize_value(getattr(obj, name)) for name in field_names(type(obj))}
+
 
+# Numbers that are added to / subtracted from, merged as differences when an update_player conflicts
+PLAYER_DELTA_FIELDS = ("money", "debt", "hunger", "thirst", "health", "taxes_owed")
+# Sent as differences by update_company (adjust_company SQL function), Companies has no version column
+COMPANY_DELTA_FIELDS = ("capital", "taxes_owed")
 
+ORDER_PRIMARY_KEY = ("user_id", "server_id", "item_tag", "unit_price", "is_company")
 
-def parse_datetime(dt_str):
-    return datetime.fromisoformat(dt_str.replace("Z", "+00:00")) if dt_str else None
 
+def changed_columns(obj, primary_key):
+    '''
+    :return: Serialized columns of obj that changed since it was loaded / last written, without the primary key
+    '''
+    return {name: serialize_value(getattr(obj, name)) for name in obj.changed_fields() if name not in primary_key}
 
 
+# Row -> model, generated from the dataclass fields (src/db/decoders.py)
+_to_item = compile_decoder(Item, strip=("item_tag",))
+_to_player = compile_decoder(Player)
+_to_company = compile_decoder(Company)
+_to_player_item = compile_decoder(PlayerItem)
+_to_company_item = compile_decoder(CompanyItem)
+_to_join_request = compile_decoder(CompanyJoinRequest)
+_to_market_item = compile_decoder(MarketItem)
+_to_buy_order = compile_decoder(BuyOrder)
+_to_sell_order = compile_decoder(SellOrder)
+_to_government = compile_decoder(Government)
+_to_gdp_entry = compile_decoder(GovernmentGDP)
+
+
+
+@instrumented()
 async def get_all_items():
-    try:
-        response = (
-            supabase.table("Items")
-            .select("*")
-            .execute()
-        )
+    response = await execute(
+        supabase.table("Items")
+        .select("*")
+    )
 
-        items = []
-        for entry in response.data:
-            item = Item(
-                item_tag=entry["item_tag"].strip(),
-                producible=entry["producible"],
-                ingredients=entry.get("ingredients"),  # kann None sein
-                worksteps=entry.get("worksteps"),
-                base_price=entry["base_price"],
-                durability=entry.get("durability"),
-            )
-            items.append(item)
-        return items
-    except Exception as e:
-        print(e)
+    return [_to_item(entry) for entry in response.data]
 
 
-async def get_producible_items():
-    try:
-        response = (
-            supabase.table("Items")
-            .select("item_tag")
-            .eq("producible", True)
-            .execute()
-        )
+item_catalog = ItemCatalog(get_all_items, ttl=ITEM_CATALOG_TTL)
 
-        # We only return the item tags
-        return [entry["item_tag"].strip() for entry in response.data]
-    except Exception as e:
-        print(e)
 
+@instrumented()
+async def get_producible_items():
+    # We only return the item tags
+    return [item.item_tag for item in await item_catalog.all() if item.producible]
 
 
+@instrumented()
 async def get_item(item_tag: str):
-    try:
-        response = (
-            supabase.table("Items")
-            .select("*")
-            .execute()
-        )
+    return await item_catalog.get(item_tag)
 
-        for entry in response.data:
-            if entry.get("item_tag").strip().lower() == item_tag.strip().lower():
-                return Item(
-                    item_tag=entry.get("item_tag").strip(),
-                    producible=entry.get("producible"),
-                    ingredients=entry.get("ingredients"),
-                    worksteps=entry.get("worksteps"),
-                    base_price=entry.get("base_price"),
-                    durability=entry.get("durability")
-                )
 
-        return None
-    except Exception as e:
-        print(e)
+recipes = Recipes(item_catalog)
 
 
+@instrumented()
+async def get_recipe(item_tag: str):
+    '''
+    :return: Parsed ingredients, full bill of materials and total worksteps of the item, None if it has no ingredients
+    '''
+    return await recipes.get(item_tag)
 
-async def get_player_item(user_id, server_id, item_tag, min_amount=1):
-    try:
-        response = (
-            supabase.table("Player_Items")
-            .select("*")
-            .eq("user_id", user_id)
-            .eq("server_id", server_id)
-            .gte("amount", min_amount)
-            .execute()
-        )
 
-        for entry in response.data:
-            if entry.get("item_tag").strip().lower() == item_tag.strip().lower():
-                return PlayerItem(
-                    user_id=entry.get("user_id"),
-                    item_tag=entry.get("item_tag"),
-                    server_id=entry.get("server_id"),
-                    amount=entry.get("amount"),
-                    durability=entry.get("durability")
-                )
 
+async def _catalog_tag(item_tag: str):
+    '''
+    :return: The tag like the Items table spells it (trimmed), None for items that don't exist
+    '''
+    item = await item_catalog.get(item_tag)
+    return item.item_tag if item else None
+
+
+def _tag_pattern(item_tag: str):
+    # ilike without wildcards = case-insensitive equality, so escape the wildcard characters.
+    # PostgREST reads * as % and can't escape it, the single character wildcard still matches the * itself
+    return item_tag.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("*", "_")
+
+
+def _tags_filter(item_tags):
+    # Quoted or-filter values get unescaped once more, so the backslashes are doubled
+    patterns = (_tag_pattern(tag).replace("\\", "\\\\") for tag in item_tags)
+    return ",".join(f'item_tag.ilike."{pattern}"' for pattern in patterns)
+
+
+
+
+@instrumented()
+async def get_player_item(user_id, server_id, item_tag, min_amount=1):
+    cached = tracked(PlayerItem, user_id, server_id, item_tag)
+    if cached:
+        return cached if cached.amount >= min_amount else None
+    item_tag = await _catalog_tag(item_tag)
+    if item_tag is None:
         return None
-    except Exception as e:
-        print(e)
+    response = await execute(
+        supabase.table("Player_Items")
+        .select("*")
+        .eq("user_id", user_id)
+        .eq("server_id", server_id)
+        .ilike("item_tag", _tag_pattern(item_tag))
+        .gte("amount", min_amount)
+        .limit(1)
+    )
 
+    for entry in response.data:
+        return track(_to_player_item(entry))
+
+    return None
+
+
+@instrumented()
+async def get_player_items(user_id, server_id, item_tags, min_amount=1):
+    '''
+    Looks up several items of a player in one query.
+    :return: Dict of normalized item tag -> PlayerItem, only containing the items the player has
+    '''
+    item_tags = [tag for tag in [await _catalog_tag(tag) for tag in item_tags] if tag]
+    if not item_tags:
+        return {}
+    response = await execute(
+        supabase.table("Player_Items")
+        .select("*")
+        .eq("user_id", user_id)
+        .eq("server_id", server_id)
+        .or_(_tags_filter(item_tags))
+        .gte("amount", min_amount)
+    )
 
-async def get_company_item(user_id, server_id, item_tag):
-    try:
-        response = (
-            supabase.table("Company_Items")
-            .select("*")
-            .eq("company_entrepreneur_id", user_id)
-            .eq("server_id", server_id)
-            .execute()
-        )
+    items = (track(_to_player_item(entry)) for entry in response.data)
+    return {normalize_tag(item.item_tag): item for item in items if item.amount >= min_amount}
 
-        for entry in response.data:
-            if entry.get("item_tag").strip().lower() == item_tag.strip().lower():
-                return CompanyItem(
-                    company_entrepreneur_id=entry.get("company_entrepreneur_id"),
-                    item_tag=entry.get("item_tag"),
-                    server_id=entry.get("server_id"),
-                    amount=entry.get("amount"),
-                )
 
+@instrumented()
+async def get_company_item(user_id, server_id, item_tag):
+    cached = tracked(CompanyItem, user_id, server_id, item_tag)
+    if cached:
+        return cached
+    item_tag = await _catalog_tag(item_tag)
+    if item_tag is None:
         return None
-    except Exception as e:
-        print(e)
+    response = await execute(
+        supabase.table("Company_Items")
+        .select("*")
+        .eq("company_entrepreneur_id", user_id)
+        .eq("server_id", server_id)
+        .ilike("item_tag", _tag_pattern(item_tag))
+        .limit(1)
+    )
 
+    for entry in response.data:
+        return track(_to_company_item(entry))
+
+    return None
+
+
+@instrumented()
+async def get_company_items(user_id, server_id, item_tags):
+    '''
+    Looks up several items of a company in one query.
+    :return: Dict of normalized item tag -> CompanyItem, only containing the items the company has
+    '''
+    item_tags = [tag for tag in [await _catalog_tag(tag) for tag in item_tags] if tag]
+    if not item_tags:
+        return {}
+    response = await execute(
+        supabase.table("Company_Items")
+        .select("*")
+        .eq("company_entrepreneur_id", user_id)
+        .eq("server_id", server_id)
+        .or_(_tags_filter(item_tags))
+    )
 
-async def get_all_players(server_id):
-    try:
-        response = (
-            supabase.table("Players")
-            .select("*")
-            .eq("server_id", server_id)
-            .execute()
-        )
+    items = (track(_to_company_item(entry)) for entry in response.data)
+    return {normalize_tag(item.item_tag): item for item in items}
 
-        players = []
-        for entry in response.data:
-            player = Player(
-                id=entry["id"],
-                server_id=entry["server_id"],
-                created_at=parse_datetime(entry["created_at"]),
-                money=entry["money"],
-                debt=entry["debt"],
-                hunger=entry["hunger"],
-                thirst=entry["thirst"],
-                job=entry["job"],
-                health=entry["health"],
-                company_entrepreneur_id=entry["company_entrepreneur_id"],
-                taxes_owed=entry["taxes_owed"],
-                work_cooldown_until=parse_datetime(entry["work_cooldown_until"]),
-                job_switch_cooldown_until=parse_datetime(entry["job_switch_cooldown_until"]),
-                company_creation_cooldown_until=parse_datetime(entry["company_creation_cooldown_until"]),
-                gift_cooldown_until=parse_datetime(entry["gift_cooldown_until"])
-            )
-            players.append(player)
 
-        return players
-    except Exception as e:
-        print(e)
+
+@instrumented()
+async def get_all_players(server_id):
+    response = await execute(
+        supabase.table("Players")
+        .select("*")
+        .eq("server_id", server_id)
+    )
+
+    return [_to_player(entry) for entry in response.data]
 
 
+@instrumented()
 async def get_player(user_id, server_id):
-    try:
-        response = (
-            supabase.table("Players")
-            .select("*")
-            .eq("id", user_id)
-            .eq("server_id", server_id)
-            .execute()
-        )
+    cached = tracked(Player, user_id, server_id)
+    if cached:
+        return cached
+    response = await execute(
+        supabase.table("Players")
+        .select("*")
+        .eq("id", user_id)
+        .eq("server_id", server_id)
+    )
 
-        for entry in response.data:
-            return Player(
-                id=entry["id"],
-                server_id=entry["server_id"],
-                created_at=parse_datetime(entry["created_at"]),
-                money=entry["money"],
-                debt=entry["debt"],
-                hunger=entry["hunger"],
-                thirst=entry["thirst"],
-                job=entry["job"],
-                health=entry["health"],
-                company_entrepreneur_id=entry["company_entrepreneur_id"],
-                taxes_owed=entry["taxes_owed"],
-                work_cooldown_until=parse_datetime(entry["work_cooldown_until"]),
-                job_switch_cooldown_until=parse_datetime(entry["job_switch_cooldown_until"]),
-                company_creation_cooldown_until=parse_datetime(entry["company_creation_cooldown_until"]),
-                gift_cooldown_until=parse_datetime(entry["gift_cooldown_until"])
-            )
+    for entry in response.data:
+        return track(_to_player(entry))
 
-        return None
-    except Exception as e:
-        print(e)
+    return None
 
+@instrumented()
 async def get_tax_owing_players(server_id):
-    try:
-        response = (
-            supabase.table("Players")
-            .select("*")
-            .eq("server_id", server_id)
-            .gt("taxes_owed", 0)
-            .order("taxes_owed", desc=True)
-            .execute()
-        )
+    response = await execute(
+        supabase.table("Players")
+        .select("*")
+        .eq("server_id", server_id)
+        .gt("taxes_owed", 0)
+        .order("taxes_owed", desc=True)
+    )
 
-        players = []
-        for entry in response.data:
-            players.append(Player(
-                id=entry.get("id"),
-                server_id=entry.get("server_id"),
-                created_at=datetime.fromisoformat(entry.get("created_at")),
-                money=entry.get("money"),
-                debt=entry.get("debt"),
-                hunger=entry.get("hunger"),
-                thirst=entry.get("thirst"),
-                job=entry.get("job"),
-                health=entry.get("health"),
-                company_entrepreneur_id=entry.get("company_entrepreneur_id"),
-                taxes_owed=entry.get("taxes_owed"),
-                work_cooldown_until=datetime.fromisoformat(str(entry.get("work_cooldown_until"))) if entry.get("work_cooldown_until") else None,
-                job_switch_cooldown_until=datetime.fromisoformat(str(entry.get("job_switch_cooldown_until"))) if entry.get("job_switch_cooldown_until") else None,
-                company_creation_cooldown_until=datetime.fromisoformat(str(entry.get("company_creation_cooldown_until"))) if entry.get("company_creation_cooldown_until") else None,
-                gift_cooldown_until=datetime.fromisoformat(str(entry.get("gift_cooldown_until"))) if entry.get("gift_cooldown_until") else None,
-            ))
-
-        return players
-    except Exception as e:
-        print(e)
+    return [_to_player(entry) for entry in response.data]
 
+@instrumented()
 async def get_tax_owing_companies(server_id):
-    try:
-        response = (
-            supabase.table("Companies")
-            .select("*")
-            .eq("server_id", server_id)
-            .gt("taxes_owed", 0)
-            .order("taxes_owed", desc=True)
-            .execute()
-        )
+    response = await execute(
+        supabase.table("Companies")
+        .select("*")
+        .eq("server_id", server_id)
+        .gt("taxes_owed", 0)
+        .order("taxes_owed", desc=True)
+    )
 
-        companies = []
-        for entry in response.data:
-            companies.append(Company(
-                entrepreneur_id=entry.get("entrepreneur_id"),
-                server_id=entry.get("server_id"),
-                created_at=datetime.fromisoformat(str(entry["created_at"])) if entry.get("created_at") else None,
-                producible_items=entry.get("producible_items", ""),
-                capital=entry.get("capital", 0),
-                worksteps=entry.get("worksteps", 0),
-                wage=entry.get("wage", 0),
-                name=entry.get("name", ""),
-                taxes_owed=entry.get("taxes_owed", 0),
-            ))
-
-        return companies
-    except Exception as e:
-        print(e)
+    return [_to_company(entry) for entry in response.data]
 
+@instrumented()
 async def get_employees(entrepreneur_id: int, server_id: int):
-    try:
-        response = (
-            supabase.table("Players")
-            .select("*")
-            .eq("company_entrepreneur_id", entrepreneur_id)
-            .eq("server_id", server_id)
-            .execute()
-        )
+    response = await execute(
+        supabase.table("Players")
+        .select("*")
+        .eq("company_entrepreneur_id", entrepreneur_id)
+        .eq("server_id", server_id)
+    )
 
-        players = []
-        for entry in response.data:
-            players.append(Player(
-                id=entry.get("id"),
-                server_id=entry.get("server_id"),
-                created_at=datetime.fromisoformat(str(entry["created_at"])) if entry.get("created_at") else None,
-                money=entry.get("money", 0),
-                debt=entry.get("debt", 0),
-                hunger=entry.get("hunger", 0),
-                thirst=entry.get("thirst", 0),
-                job=entry.get("job", ""),
-                health=entry.get("health", 100),
-                company_entrepreneur_id=entry.get("company_entrepreneur_id"),
-                taxes_owed=entry.get("taxes_owed", 0),
-                work_cooldown_until=datetime.fromisoformat(str(entry["work_cooldown_until"])) if entry.get("work_cooldown_until") else None,
-                job_switch_cooldown_until=datetime.fromisoformat(str(entry["job_switch_cooldown_until"])) if entry.get("job_switch_cooldown_until") else None,
-                company_creation_cooldown_until=datetime.fromisoformat(str(entry["company_creation_cooldown_until"])) if entry.get("company_creation_cooldown_until") else None,
-                gift_cooldown_until=datetime.fromisoformat(str(entry["gift_cooldown_until"])) if entry.get("gift_cooldown_until") else None,
-            ))
-
-        return players
-    except Exception as e:
-        print(e)
+    return [_to_player(entry) for entry in response.data]
 
 
+@instrumented()
 async def fire_employees(target_user_id: int, server_id: int):
-    try:
-        response = (
-            supabase.table("Players")
-            .update({"company_entrepreneur_id": None, "job": ""})
-            .eq("company_entrepreneur_id", target_user_id)
-            .eq("server_id", server_id)
-            .execute()
-        )
-        return response
-    except Exception as e:
-        print(e)
+    response = await execute(
+        supabase.table("Players")
+        .update({"company_entrepreneur_id": None, "job": ""})
+        .eq("company_entrepreneur_id", target_user_id)
+        .eq("server_id", server_id)
+    )
+    return response
 
 
+@instrumented()
 async def get_join_requests(entrepreneur_id: int, server_id: int):
-    try:
-        response = (
-            supabase.table("Company_Join_Requests")
-            .select("*")
-            .eq("company_entrepreneur_id", entrepreneur_id)
-            .eq("server_id", server_id)
-            .execute()
-        )
-
-        requests = []
-        for entry in response.data:
-            requests.append(CompanyJoinRequest(
-                user_id=entry.get("user_id"),
-                server_id=entry.get("server_id"),
-                company_entrepreneur_id=entry.get("company_entrepreneur_id")
-            ))
+    response = await execute(
+        supabase.table("Company_Join_Requests")
+        .select("*")
+        .eq("company_entrepreneur_id", entrepreneur_id)
+        .eq("server_id", server_id)
+    )
 
-        return requests
-    except Exception as e:
-        print(e)
+    return [_to_join_request(entry) for entry in response.data]
 
 
+@instrumented()
 async def get_user_join_request(entrepreneur_id: int, server_id: int, user_id: int):
-    try:
-        response = (
-            supabase.table("Company_Join_Requests")
-            .select("*")
-            .eq("company_entrepreneur_id", entrepreneur_id)
-            .eq("server_id", server_id)
-            .eq("user_id", user_id)
-            .execute()
-        )
+    response = await execute(
+        supabase.table("Company_Join_Requests")
+        .select("*")
+        .eq("company_entrepreneur_id", entrepreneur_id)
+        .eq("server_id", server_id)
+        .eq("user_id", user_id)
+    )
 
-        if not response.data:
-            return None
+    if not response.data:
+        return None
 
-        entry = response.data[0]
-        return CompanyJoinRequest(
-            user_id=entry.get("user_id"),
-            server_id=entry.get("server_id"),
-            company_entrepreneur_id=entry.get("company_entrepreneur_id"),
-        )
-    except Exception as e:
-        print(e)
+    return _to_join_request(response.data[0])
 
 
+@instrumented()
 async def get_all_companies(server_id):
-    try:
-        response = (
-            supabase.table("Companies")
-            .select("*")
-            .eq("server_id", server_id)
-            .execute()
-        )
+    response = await execute(
+        supabase.table("Companies")
+        .select("*")
+        .eq("server_id", server_id)
+    )
 
-        companies = []
-        for entry in response.data:
-            companies.append(Company(
-                entrepreneur_id=entry.get("entrepreneur_id"),
-                server_id=entry.get("server_id"),
-                created_at=datetime.fromisoformat(str(entry["created_at"])) if entry.get("created_at") else None,
-                producible_items=entry.get("producible_items", ""),
-                capital=entry.get("capital", 0),
-                worksteps=entry.get("worksteps", 0),
-                wage=entry.get("wage", 0),
-                name=entry.get("name", ""),
-                taxes_owed=entry.get("taxes_owed", 0),
-            ))
-
-        return companies
-    except Exception as e:
-        print(e)
+    return [_to_company(entry) for entry in response.data]
 
 
+@instrumented()
+async def _load_leaderboard(server_id):
+    players, companies = await asyncio.gather(get_all_players(server_id), get_all_companies(server_id))
+    if players is None or companies is None:
+        return None
+    return players, companies
+
+
+leaderboards = Leaderboards(_load_leaderboard)
+
+
+def _adjust_net_worth(server_id, user_id, is_company, delta):
+    board = leaderboards.loaded(server_id)
+    if board:
+        if is_company:
+            board.adjust_company(user_id, delta)
+        else:
+            board.adjust_player(user_id, delta)
+
+
+@instrumented()
 async def get_company(user_id: int, server_id: int):
-    try:
-        response = (
-            supabase.table("Companies")
-            .select("*")
-            .eq("entrepreneur_id", user_id)
-            .eq("server_id", server_id)
-            .execute()
-        )
+    cached = tracked(Company, user_id, server_id)
+    if cached:
+        return cached
+    response = await execute(
+        supabase.table("Companies")
+        .select("*")
+        .eq("entrepreneur_id", user_id)
+        .eq("server_id", server_id)
+    )
 
-        if not response.data:
-            return None
-
-        entry = response.data[0]
-        return Company(
-            entrepreneur_id=entry.get("entrepreneur_id"),
-            server_id=entry.get("server_id"),
-            created_at=entry.get("created_at"),
-            producible_items=entry.get("producible_items"),
-            capital=entry.get("capital"),
-            worksteps=entry.get("worksteps"),
-            wage=entry.get("wage"),
-            name=entry.get("name"),
-            taxes_owed=entry.get("taxes_owed"),
-        )
-    except Exception as e:
-        print(e)
+    if not response.data:
+        return None
+
+    return track(_to_company(response.data[0]))
 
 
+@instrumented()
 async def get_player_inventory(user_id: int, server_id: int):
-    try:
-        response = (
-            supabase.table("Player_Items")
-            .select("*")
-            .eq("user_id", user_id)
-            .eq("server_id", server_id)
-            .execute()
-        )
+    response = await execute(
+        supabase.table("Player_Items")
+        .select("*")
+        .eq("user_id", user_id)
+        .eq("server_id", server_id)
+    )
 
-        items = []
-        for entry in response.data:
-            items.append(PlayerItem(
-                user_id=entry.get("user_id"),
-                item_tag=entry.get("item_tag"),
-                server_id=entry.get("server_id"),
-                amount=entry.get("amount"),
-                durability=entry.get("durability")
-            ))
-        return items
-    except Exception as e:
-        print(e)
+    return [_to_player_item(entry) for entry in response.data]
 
 
 
+@instrumented()
 async def get_company_inventory(user_id: int, server_id: int):
-    try:
-        response = (
-            supabase.table("Company_Items")
-            .select("*")
-            .eq("company_entrepreneur_id", user_id)
-            .eq("server_id", server_id)
-            .execute()
-        )
-
-        items = []
-        for entry in response.data:
-            items.append(CompanyItem(
-                company_entrepreneur_id=entry.get("company_entrepreneur_id"),
-                item_tag=entry.get("item_tag"),
-                server_id=entry.get("server_id"),
-                amount=entry.get("amount")
-            ))
-        return items
-    except Exception as e:
-        print(e)
+    response = await execute(
+        supabase.table("Company_Items")
+        .select("*")
+        .eq("company_entrepreneur_id", user_id)
+        .eq("server_id", server_id)
+    )
 
+    return [_to_company_item(entry) for entry in response.data]
 
 
 
 
 
-async def get_own_sell_orders(user_id: int, server_id: int, item_tag: str, unit_price: float, is_company):
-    
-    try:
-        if is_company == "both":
-            response = (
-                supabase.table("Sell_Orders")
-                .select("*")
-                .eq("user_id", user_id)
-                .eq("item_tag", item_tag)
-                .eq("server_id", server_id)
-                .eq("unit_price", unit_price)
-                .execute()
-            )
-        else:
-           response = (
-                supabase.table("Sell_Orders")
-                .select("*")
-                .eq("user_id", user_id)
-                .eq("item_tag", item_tag)
-                .eq("server_id", server_id)
-                .eq("unit_price", unit_price)
-                .eq("is_company", is_company)
-                .execute()
-            ) 
-        orders = []
-        for entry in response.data:
-            orders.append(SellOrder(
-                user_id=entry.get("user_id"),
-                item_tag=entry.get("item_tag"),
-                server_id=entry.get("server_id"),
-                amount=entry.get("amount"),
-                unit_price=entry.get("unit_price"),
-                is_company=entry.get("is_company"),
-            ))
-        return orders
-    except Exception as e:
-        print(e)
 
 
-async def get_sell_orders(server_id: int, item_tag: str, unit_price: float, now: datetime):
-    try:
-        response = (
-            supabase.table("Sell_Orders")
-            .select("*")
-            .eq("server_id", server_id)
-            .eq("item_tag", item_tag)
-            .lte("unit_price", unit_price)
-            .execute()
-        )
 
+async def _order_tag(item_tag: str) -> str:
+    # Orders are stored and matched (fill_* SQL functions compare exactly) under the catalog spelling of the tag
+    return await _catalog_tag(item_tag) or item_tag.strip()
 
-        # Mappe zu SellOrder Objekten
-        return [
-            SellOrder(
-                user_id=entry.get("user_id"),
-                item_tag=entry.get("item_tag"),
-                server_id=entry.get("server_id"),
-                amount=entry.get("amount"),
-                unit_price=entry.get("unit_price"),
-                is_company=entry.get("is_company"),
-            )
-            for entry in response.data
-        ]
-    except Exception as e:
-        print(e)
 
-async def get_item_sell_orders(server_id: int, item_tag: str, now: datetime):
-    try:
-        response = (
-            supabase.table("Sell_Orders")
+@instrumented()
+async def _load_order_book(server_id: int, item_tag: str):
+    # The book is kept under the normalized tag, so whatever spelling comes first has to load the stored rows
+    item_tag = await _order_tag(item_tag)
+    buy_response, sell_response = await asyncio.gather(
+        execute(
+            supabase.table("Buy_Orders")
             .select("*")
             .eq("server_id", server_id)
             .eq("item_tag", item_tag)
-            .execute()
-        )
-
-
-        return [
-            SellOrder(
-                user_id=entry.get("user_id"),
-                item_tag=entry.get("item_tag"),
-                server_id=entry.get("server_id"),
-                amount=entry.get("amount"),
-                unit_price=entry.get("unit_price"),
-                is_company=entry.get("is_company"),
-            )
-            for entry in response.data
-        ]
-    except Exception as e:
-        print(e)
-
-
-async def get_all_own_sell_orders(user_id: int, server_id: int, now: datetime, is_company):
-    try:
-        if is_company == "both":
-            response = (
+            .order("created_at")
+        ),
+        execute(
             supabase.table("Sell_Orders")
             .select("*")
-            .eq("user_id", user_id)
             .eq("server_id", server_id)
-            .execute()
-        )
-        else:
-
-            response = (
-                supabase.table("Sell_Orders")
-                .select("*")
-                .eq("user_id", user_id)
-                .eq("server_id", server_id)
-                .eq("is_company", is_company)
-                .execute()
-            )
+            .eq("item_tag", item_tag)
+            .order("created_at")
+        ),
+    )
+    return [_to_buy_order(entry) for entry in buy_response.data], [_to_sell_order(entry) for entry in sell_response.data]
 
 
-        return [
-            SellOrder(
-                user_id=entry.get("user_id"),
-                item_tag=entry.get("item_tag"),
-                server_id=entry.get("server_id"),
-                amount=entry.get("amount"),
-                unit_price=entry.get("unit_price"),
-                is_company=entry.get("is_company"),
-            )
-            for entry in response.data
-        ]
-    except Exception as e:
-        print(e)
+order_books = OrderBooks(_load_order_book)
 
 
+@instrumented()
+async def get_own_sell_orders(user_id: int, server_id: int, item_tag: str, unit_price: float, is_company):
+    book = await order_books.get(server_id, item_tag)
+    return book.own(SELL, user_id, unit_price, is_company) if book else []
 
-async def get_own_item_sell_orders(user_id: int, server_id: int, item_tag: str, now: datetime, is_company):
-    try:
-        if is_company == "both":
-            response = (
-                supabase.table("Sell_Orders")
-                .select("*")
-                .eq("user_id", user_id)
-                .eq("server_id", server_id)
-                .eq("item_tag", item_tag)
-                .execute()
-            )
-        else:
-            response = (
-                supabase.table("Sell_Orders")
-                .select("*")
-                .eq("user_id", user_id)
-                .eq("server_id", server_id)
-                .eq("item_tag", item_tag)
-                .eq("is_company", is_company)
-                .execute()
-            )
 
-        return [
-            SellOrder(
-                user_id=entry.get("user_id"),
-                item_tag=entry.get("item_tag"),
-                server_id=entry.get("server_id"),
-                amount=entry.get("amount"),
-                unit_price=entry.get("unit_price"),
-                is_company=entry.get("is_company"),
-            )
-            for entry in response.data
-        ]
-    except Exception as e:
-        print(e)
+@instrumented()
+async def get_sell_orders(server_id: int, item_tag: str, unit_price: float, now: datetime):
+    # Cheapest first, equal prices by arrival
+    book = await order_books.get(server_id, item_tag)
+    return book.orders(SELL, unit_price, now) if book else []
 
+@instrumented()
+async def get_item_sell_orders(server_id: int, item_tag: str, now: datetime):
+    book = await order_books.get(server_id, item_tag)
+    return book.orders(SELL, now=now) if book else []
 
-async def get_buy_orders(server_id: int, item_tag: str, unit_price: float, now: datetime):
-    try:
-        response = (
-            supabase.table("Buy_Orders")
-            .select("*")
-            .eq("server_id", server_id)
-            .eq("item_tag", item_tag)
-            .execute()
-        )
 
-        return [
-            BuyOrder(
-                user_id=entry.get("user_id"),
-                item_tag=entry.get("item_tag"),
-                server_id=entry.get("server_id"),
-                amount=entry.get("amount"),
-                unit_price=entry.get("unit_price"),
-                is_company=entry.get("is_company"),
-            )
-            for entry in response.data
-        ]
-    except Exception as e:
-        print(e)
+@instrumented()
+async def get_all_own_sell_orders(user_id: int, server_id: int, now: datetime, is_company, offset: int = 0, limit: int = None):
+    '''
+    :param limit: Only load the orders offset ... offset + limit - 1 (oldest first)
+    '''
+    query = supabase.table("Sell_Orders") \
+        .select("*") \
+        .eq("user_id", user_id) \
+        .eq("server_id", server_id)
 
+    if is_company != "both":
+        query = query.eq("is_company", is_company)
 
-async def get_item_buy_orders(server_id: int, item_tag: str, now: datetime):
-    try:
-        response = (
-            supabase.table("Buy_Orders")
-            .select("*")
-            .eq("server_id", server_id)
-            .eq("item_tag", item_tag)
-            .execute()
-        )
+    if limit is not None:
+        query = query.order("created_at").range(offset, offset + limit - 1)
 
+    response = await execute(query)
+    return [_to_sell_order(entry) for entry in response.data]
 
-        return [
-            BuyOrder(
-                user_id=entry.get("user_id"),
-                item_tag=entry.get("item_tag"),
-                server_id=entry.get("server_id"),
-                amount=entry.get("amount"),
-                unit_price=entry.get("unit_price"),
-                is_company=entry.get("is_company"),
-            )
-            for entry in response.data
-        ]
-    except Exception as e:
-        print(e)
 
 
-async def get_all_own_buy_orders(user_id: int, server_id: int, now: datetime, is_company):
+@instrumented()
+async def get_own_item_sell_orders(user_id: int, server_id: int, item_tag: str, now: datetime, is_company):
     if is_company == "both":
-        response = (
-            supabase.table("Buy_Orders")
+        response = await execute(
+            supabase.table("Sell_Orders")
             .select("*")
             .eq("user_id", user_id)
             .eq("server_id", server_id)
-            .execute()
+            .eq("item_tag", item_tag)
         )
     else:
-        response = (
-            supabase.table("Buy_Orders")
+        response = await execute(
+            supabase.table("Sell_Orders")
             .select("*")
             .eq("user_id", user_id)
             .eq("server_id", server_id)
+            .eq("item_tag", item_tag)
             .eq("is_company", is_company)
-            .execute()
         )
 
-    orders = []
-    for entry in response.data:
-        orders.append(BuyOrder(
-            user_id=entry.get("user_id"),
-            item_tag=entry.get("item_tag"),
-            server_id=entry.get("server_id"),
-            amount=entry.get("amount"),
-            unit_price=entry.get("unit_price"),
-            is_company=entry.get("is_company"),
-        ))
+    return [_to_sell_order(entry) for entry in response.data]
 
-    return orders
 
+@instrumented()
+async def get_buy_orders(server_id: int, item_tag: str, unit_price: float, now: datetime):
+    # Highest price first, equal prices by arrival
+    book = await order_books.get(server_id, item_tag)
+    return book.orders(BUY, unit_price, now) if book else []
 
-async def get_own_buy_orders(user_id: int, server_id: int, item_tag: str, unit_price: float, is_company):
-    try:
-        if is_company == "both":
 
-            response = (
-            supabase.table("Buy_Orders")
-            .select("*")
-            .eq("user_id", user_id)
-            .eq("item_tag", item_tag)
-            .eq("server_id", server_id)
-            .eq("unit_price", unit_price)
-            .execute()
-        )
-        else:
-            response = (
-            supabase.table("Buy_Orders")
-            .select("*")
-            .eq("user_id", user_id)
-            .eq("item_tag", item_tag)
-            .eq("server_id", server_id)
-            .eq("unit_price", unit_price)
-            .eq("is_company", is_company)
-            .execute()
-        )
-        
-        entries = []
-        for entry in response.data:
-            entries.append(BuyOrder(
-                user_id=entry.get("user_id"),
-                item_tag=entry.get("item_tag"),
-                server_id=entry.get("server_id"),
-                amount=entry.get("amount"),
-                unit_price=entry.get("unit_price"),
-                is_company=entry.get("is_company"),
-            ))
-        return entries
-    except Exception as e:
-        print(e)
+@instrumented()
+async def get_item_buy_orders(server_id: int, item_tag: str, now: datetime):
+    book = await order_books.get(server_id, item_tag)
+    return book.orders(BUY, now=now) if book else []
+
+
+@instrumented()
+async def get_all_own_buy_orders(user_id: int, server_id: int, now: datetime, is_company, offset: int = 0, limit: int = None):
+    '''
+    :param limit: Only load the orders offset ... offset + limit - 1 (oldest first)
+    '''
+    query = supabase.table("Buy_Orders") \
+        .select("*") \
+        .eq("user_id", user_id) \
+        .eq("server_id", server_id)
 
+    if is_company != "both":
+        query = query.eq("is_company", is_company)
 
+    if limit is not None:
+        query = query.order("created_at").range(offset, offset + limit - 1)
+
+    response = await execute(query)
+    return [_to_buy_order(entry) for entry in response.data]
+
+
+@instrumented(default=0)
+async def count_own_orders(table_name: str, user_id: int, server_id: int):
+    response = await execute(
+        supabase.table(table_name)
+        .select("*", count="exact", head=True)
+        .eq("user_id", user_id)
+        .eq("server_id", server_id)
+    )
+    return response.count or 0
+
+
+@instrumented()
+async def get_own_buy_orders(user_id: int, server_id: int, item_tag: str, unit_price: float, is_company):
+    book = await order_books.get(server_id, item_tag)
+    return book.own(BUY, user_id, unit_price, is_company) if book else []
+
+
+@instrumented()
 async def get_market_item(server_id: int, item_tag: str):
-    try:
-        response = (
-            supabase.table("Market_Items")
-            .select("*")
-            .eq("server_id", server_id)
-            .eq("item_tag", item_tag)
-            .execute()
-        )
+    response = await execute(
+        supabase.table("Market_Items")
+        .select("*")
+        .eq("server_id", server_id)
+        .eq("item_tag", item_tag)
+    )
 
-        if not response.data:
-            return None
+    if not response.data:
+        return None
 
-        entry = response.data[0]
-        return MarketItem(
-            item_tag=entry.get("item_tag"),
-            server_id=entry.get("server_id"),
-            min_price=entry.get("min_price"),
-            max_price=entry.get("max_price"),
-            stockpile=entry.get("stockpile"),
-        )
-    except Exception as e:
-        print(e)
+    return _to_market_item(response.data[0])
 
 
-async def get_government(server_id: int):
-    try:
-        response = (
-            supabase.table("Government")
-            .select("*")
-            .eq("id", server_id)
-            .execute()
-        )
+@instrumented()
+async def add_market_items(market_items):
+    '''
+    Inserts many Market_Items rows with one upsert. Rows that already exist are kept as they are.
+    :return: The inserted rows, None on error
+    '''
+    if not market_items:
+        return []
+    response = await execute(
+        supabase.table("Market_Items")
+        .upsert([to_row(item) for item in market_items], on_conflict="item_tag,server_id", ignore_duplicates=True)
+    )
+    for item in market_items:
+        item.mark_clean()
+    return response.data
 
-        if not response.data:
-            return None
-
-        entry = response.data[0]
-        return Government(
-            id=entry.get("id"),
-            created_at=entry.get("created_at"),
-            taxrate=entry.get("taxrate"),
-            interest_rate=entry.get("interest_rate"),
-            treasury=entry.get("treasury"),
-            governing_role=entry.get("governing_role"),
-            admin_role=entry.get("admin_role"),
-            gambling_pool=entry.get("gambling_pool")
-        )
-    except Exception as e:
-        print(e)
 
 
+@instrumented()
+async def _load_government(server_id: int):
+    response = await execute(
+        supabase.table("Government")
+        .select("*")
+        .eq("id", server_id)
+    )
+
+    if not response.data:
+        return None
+
+    return _to_government(response.data[0])
+
+
+governments = GovernmentCache(_load_government, GOVERNMENT_TTL)
+
+
+@instrumented()
+async def get_government(server_id: int):
+    return await governments.get(server_id)
+
+
+@instrumented()
 async def get_gdp_entry(server_id: int, date: date):
-    try:
-        response = (
-            supabase.table("Government_GDP")
-            .select("*")
-            .eq("server_id", server_id)
-            .eq("date", date.isoformat())
-            .execute()
-        )
+    cached = tracked(GovernmentGDP, server_id, date)
+    if cached:
+        return cached
+    response = await execute(
+        supabase.table("Government_GDP")
+        .select("*")
+        .eq("server_id", server_id)
+        .eq("date", date.isoformat())
+    )
 
-        if not response.data:
-            return None
+    if not response.data:
+        return None
 
-        entry = response.data[0]
-        return GovernmentGDP(
-            server_id=entry.get("server_id"),
-            date=entry.get("date"),
-            gdp_value=entry.get("gdp_value"),
-        )
-    except Exception as e:
-        print(e)
+    return track(_to_gdp_entry(response.data[0]))
+
+
+@instrumented(default=False)
+async def settle_taxes(batch_id: str, entries: list[dict]):
+    '''
+    Adds the accrued taxes to taxes_owed of the players and companies in one transaction (settle_taxes SQL function).
+    A batch id that was settled before is skipped.
+    :param entries: {"server_id", "user_id", "is_company", "amount"}, at most one per user and is_company
+    :return: True on success
+    '''
+    await execute(supabase.rpc("settle_taxes", {"p_batch_id": batch_id, "p_entries": entries}))
+    return True
+
+
+@instrumented(default=False)
+async def increment_gdp(server_id: int, day: date, amount: float):
+    '''
+    Atomically adds amount to the GDP of the day and creates the row if needed (increment_gdp SQL function).
+    :return: True on success
+    '''
+    await execute(
+        supabase.rpc("increment_gdp", {
+            "p_server_id": server_id,
+            "p_date": day.isoformat(),
+            "p_amount": amount,
+        })
+    )
+    return True
 
 
+@instrumented()
 async def get_all_gdp_entries(server_id: int, date: datetime):
-    try:
-        response = (
-            supabase.table("Government_GDP")
-            .select("*")
-            .eq("server_id", server_id)
-            .gte("date", date.isoformat())
-            .order("date", desc=False)
-            .execute()
-        )
-
-        if not response.data:
-            return []
+    response = await execute(
+        supabase.table("Government_GDP")
+        .select("*")
+        .eq("server_id", server_id)
+        .gte("date", date.isoformat())
+        .order("date", desc=False)
+    )
 
-        result = []
-        for entry in response.data:
-            result.append(
-                GovernmentGDP(
-                    server_id=entry.get("server_id"),
-                    date=entry.get("date"),
-                    gdp_value=entry.get("gdp_value"),
-                )
-            )
-        return result
-    except Exception as e:
-        print(e)
+    return [_to_gdp_entry(entry) for entry in response.data]
 
 
+@instrumented()
 async def delete_buy_orders(user_id, server_id, item_tag, price=None):
-    try:
-        query = supabase.table("Buy_Orders") \
-            .delete() \
-            .eq("user_id", user_id) \
-            .eq("server_id", server_id) \
-            .eq("item_tag", item_tag)
+    query = supabase.table("Buy_Orders") \
+        .delete() \
+        .eq("user_id", user_id) \
+        .eq("server_id", server_id) \
+        .eq("item_tag", item_tag)
+
+    if price is not None:
+        query = query.eq("unit_price", price)
 
-        if price is not None:
-            query = query.eq("unit_price", price)
+    response = await execute(query)
 
-        response = query.execute()
-        return response
-    except Exception as e:
-        print(e)
+    book = order_books.loaded(server_id, item_tag)
+    if book:
+        book.remove(BUY, user_id, price)
+    return response
 
 
+@instrumented()
 async def delete_sell_orders(user_id, server_id, item_tag, price=None):
-    try:
-        query = supabase.table("Sell_Orders") \
-            .delete() \
-            .eq("user_id", user_id) \
-            .eq("server_id", server_id) \
-            .eq("item_tag", item_tag)
+    query = supabase.table("Sell_Orders") \
+        .delete() \
+        .eq("user_id", user_id) \
+        .eq("server_id", server_id) \
+        .eq("item_tag", item_tag)
+
+    if price is not None:
+        query = query.eq("unit_price", price)
+
+    response = await execute(query)
+
+    book = order_books.loaded(server_id, item_tag)
+    if book:
+        book.remove(SELL, user_id, price)
+    return response
+
+
+
+
+@instrumented(default=list)
+async def fill_buy_order(user_id: int, server_id: int, item_tag: str, unit_price: float, amount: int, is_company: bool = False):
+    '''
+    Buys from the cheapest sell orders up to unit_price in a single database transaction.
+    Money, items, taxes, GDP and the sell orders are all updated by the fill_buy_order SQL function (migrations/001_order_matching.sql).
+    :return: List of OrderFill, one per sell order that was (partially) filled
+    '''
+    book = await order_books.get(server_id, item_tag)
+    if book and not book.crosses(SELL, unit_price, datetime.now(timezone.utc)):
+        # Nothing to match, no need for the round trip
+        return []
+
+    item_tag = await _order_tag(item_tag)
+    response = await execute(
+        supabase.rpc("fill_buy_order", {
+            "p_server_id": server_id,
+            "p_user_id": user_id,
+            "p_is_company": is_company,
+            "p_item_tag": item_tag,
+            "p_unit_price": unit_price,
+            "p_amount": amount,
+            "p_today": date.today().isoformat(),
+        })
+    )
+    fills = [OrderFill(**fill) for fill in response.data or []]
+
+    for fill in fills:
+        _adjust_net_worth(server_id, user_id, is_company, -fill.total_price)
+        _adjust_net_worth(server_id, fill.user_id, fill.is_company, fill.total_price)
 
-        if price is not None:
-            query = query.eq("unit_price", price)
+    if book:
+        if fills:
+            book.apply_fills(SELL, fills)
+        else:
+            # The book saw a match the database didn't (e.g. the owner of the order is gone), reload it
+            order_books.invalidate(server_id, item_tag)
+    return fills
+
+
+@instrumented(default=list)
+async def fill_sell_order(user_id: int, server_id: int, item_tag: str, unit_price: float, amount: int, is_company: bool = False):
+    '''
+    Sells into the highest buy orders down to unit_price in a single database transaction (see fill_buy_order).
+    :return: List of OrderFill, one per buy order that was (partially) filled
+    '''
+    book = await order_books.get(server_id, item_tag)
+    if book and not book.crosses(BUY, unit_price, datetime.now(timezone.utc)):
+        # Nothing to match, no need for the round trip
+        return []
+
+    item_tag = await _order_tag(item_tag)
+    response = await execute(
+        supabase.rpc("fill_sell_order", {
+            "p_server_id": server_id,
+            "p_user_id": user_id,
+            "p_is_company": is_company,
+            "p_item_tag": item_tag,
+            "p_unit_price": unit_price,
+            "p_amount": amount,
+            "p_today": date.today().isoformat(),
+        })
+    )
+    fills = [OrderFill(**fill) for fill in response.data or []]
 
-        response = query.execute()
-        return response
-    except Exception as e:
-        print(e)
+    for fill in fills:
+        _adjust_net_worth(server_id, user_id, is_company, fill.total_price)
+        _adjust_net_worth(server_id, fill.user_id, fill.is_company, -fill.total_price)
 
+    if book:
+        if fills:
+            book.apply_fills(BUY, fills)
+        else:
+            # The book saw a match the database didn't (e.g. the owner of the order is gone), reload it
+            order_books.invalidate(server_id, item_tag)
+    return fills
 
 
 
+
+@instrumented(default=lambda: ([], []))
+async def expire_orders():
+    '''
+    Deletes all expired buy and sell orders and gives the items of the sell orders back, in one transaction
+    (expire_orders SQL function, migrations/002_order_expiry.sql).
+    :return: (expired buy orders, expired sell orders)
+    '''
+    response = await execute(
+        supabase.rpc("expire_orders", {})
+    )
+
+    expired = response.data or {}
+    buy_orders = [_to_buy_order(entry) for entry in expired.get("buy_orders", [])]
+    sell_orders = [_to_sell_order(entry) for entry in expired.get("sell_orders", [])]
+
+    for order in buy_orders + sell_orders:
+        book = order_books.loaded(order.server_id, order.item_tag)
+        if book:
+            book.cancel(order)
+    return buy_orders, sell_orders
+
+
+
+
+@instrumented()
 async def update_player(player: Player):
+    if defer_write(player, update_player):
+        return []
 
-    try:
+    data = changed_columns(player, ("id", "server_id", "version"))
+    if not data:
+        return []
 
-        def serialize_value(value):
-            if isinstance(value, datetime):
-                return value.isoformat()
-            return value
-        
-        data = {k: serialize_value(v) for k, v in player.__dict__.items()}
-        
-        response = (
+    for _ in range(PLAYER_UPDATE_RETRIES):
+        # Only writes if nobody else changed the row since it was loaded (the version trigger bumps it on every update)
+        response = await execute(
             supabase.table("Players")
             .update(data)
             .eq("id", player.id)
             .eq("server_id", player.server_id)
-            .execute()
+            .eq("version", player.version)
         )
+        if response.data:
+            break
 
-        return response.data
-    except Exception as e:
-        print(e)
-
+        current = await execute(
+            supabase.table("Players")
+            .select("*")
+            .eq("id", player.id)
+            .eq("server_id", player.server_id)
+        )
+        if not current.data:
+            return []
+        # Conflict: put our changes on top of the current row and try again
+        player.rebase(_to_player(current.data[0]), PLAYER_DELTA_FIELDS)
+        data = changed_columns(player, ("id", "server_id", "version"))
+    else:
+        raise ConflictError(f"Player {player.id} was changed concurrently {PLAYER_UPDATE_RETRIES} times, giving up")
 
+    player.version = response.data[0].get("version", player.version)
+    player.mark_clean()
+    board = leaderboards.loaded(player.server_id)
+    if board and ("money" in data or "debt" in data):
+        board.set_player(player.id, player.money, player.debt)
+    return response.data
 
-async def update_company(company: Company):
-    try:
 
-        def serialize_value(value):
-            if isinstance(value, datetime):
-                return value.isoformat()
-            return value
-        
 
-        data = {k: serialize_value(v) for k, v in company.__dict__.items()}
-        
-        response = (
+@instrumented()
+async def update_company(company: Company):
+    '''
+    capital and taxes_owed are sent as the difference to the loaded values (adjust_company SQL function),
+    like update_government does it. Afterwards company holds the current money of the row.
+    '''
+    if defer_write(company, update_company):
+        return []
+
+    data = changed_columns(company, ("entrepreneur_id", "server_id"))
+    if not data:
+        return []
+
+    deltas = {}
+    for name in COMPANY_DELTA_FIELDS:
+        if name in data and company.original(name) is not None:
+            del data[name]
+            deltas[name] = getattr(company, name) - company.original(name)
+
+    rows = []
+    if data:
+        response = await execute(
             supabase.table("Companies")
             .update(data)
             .eq("entrepreneur_id", company.entrepreneur_id)
             .eq("server_id", company.server_id)
-            .execute()
         )
+        rows = response.data
+    if deltas:
+        response = await execute(
+            supabase.rpc("adjust_company", {
+                "p_entrepreneur_id": company.entrepreneur_id,
+                "p_server_id": company.server_id,
+                "p_capital": deltas.get("capital", 0.0),
+                "p_taxes_owed": deltas.get("taxes_owed", 0.0),
+            })
+        )
+        rows = response.data
 
-        return response.data
-    except Exception as e:
-        print(e)
+    if rows:
+        current = _to_company(rows[0])
+        for name in COMPANY_DELTA_FIELDS:
+            setattr(company, name, getattr(current, name))
+    company.mark_clean()
+    board = leaderboards.loaded(company.server_id)
+    if board and ("capital" in data or "capital" in deltas):
+        board.set_company(company.entrepreneur_id, company.capital)
+    return rows
 
 
 
+@instrumented()
 async def update_company_item(item: CompanyItem):
-    try:
-        data = asdict(item)
-        pk = {
-            "company_entrepreneur_id": data.pop("company_entrepreneur_id"),
-            "item_tag": data.pop("item_tag"),
-            "server_id": data.pop("server_id"),
-        }
-        response = (
-            supabase.table("Company_Items")
-            .update(data)
-            .eq("company_entrepreneur_id", pk["company_entrepreneur_id"])
-            .eq("item_tag", pk["item_tag"])
-            .eq("server_id", pk["server_id"])
-            .execute()
-        )
-        return response.data
-    except Exception as e:
-        print(e)
+    if defer_write(item, update_company_item):
+        return []
+
+    data = changed_columns(item, ("company_entrepreneur_id", "item_tag", "server_id"))
+    if not data:
+        return []
+
+    response = await execute(
+        supabase.table("Company_Items")
+        .update(data)
+        .eq("company_entrepreneur_id", item.company_entrepreneur_id)
+        .eq("item_tag", item.item_tag)
+        .eq("server_id", item.server_id)
+    )
+
+    item.mark_clean()
+    return response.data
 
 
 
 
+@instrumented()
 async def update_company_join_request(request: CompanyJoinRequest):
-    try:
-        data = asdict(request)
-        pk = {
-            "user_id": data.pop("user_id"),
-            "server_id": data.pop("server_id"),
-            "company_entrepreneur_id": data.pop("company_entrepreneur_id"),
-        }
-        response = (
-            supabase.table("Company_Join_Requests")
-            .update(data)
-            .eq("user_id", pk["user_id"])
-            .eq("server_id", pk["server_id"])
-            .eq("company_entrepreneur_id", pk["company_entrepreneur_id"])
-            .execute()
-        )
-        return response.data
-    except Exception as e:
-        print(e)
+    data = changed_columns(request, ("user_id", "server_id", "company_entrepreneur_id"))
+    if not data:
+        return []
+
+    response = await execute(
+        supabase.table("Company_Join_Requests")
+        .update(data)
+        .eq("user_id", request.user_id)
+        .eq("server_id", request.server_id)
+        .eq("company_entrepreneur_id", request.company_entrepreneur_id)
+    )
+
+    request.mark_clean()
+    return response.data
 
 
 
+@instrumented(default=False)
 async def update_government(gov: Government):
+    '''
+    treasury and gambling_pool are sent as the difference to the loaded values (adjust_government SQL function),
+    so concurrent commands don't overwrite each other's money. Afterwards gov holds the current row.
+    :return: False if the treasury or the gambling pool doesn't have the money anymore (nothing was written), else True
+    '''
     try:
-        def serialize_value(value):
-            if isinstance(value, datetime):
-                return value.isoformat()
-            return value
-        
-
-        data = {k: serialize_value(v) for k, v in gov.__dict__.items()}
-        
-        response = (
-            supabase.table("Government")
-            .update(data)
-            .eq("id", gov.id)
-            .execute()
-        )
+        data = changed_columns(gov, ("id",))
+        if not data:
+            return True
+
+        deltas = {}
+        for name in ("treasury", "gambling_pool"):
+            if name in data and gov.original(name) is not None:
+                del data[name]
+                deltas[name] = getattr(gov, name) - gov.original(name)
+
+        rows = []
+        if deltas:
+            # First, a refused change doesn't write the other columns either
+            response = await execute(
+                supabase.rpc("adjust_government", {
+                    "p_id": gov.id,
+                    "p_treasury": deltas.get("treasury", 0.0),
+                    "p_gambling_pool": deltas.get("gambling_pool", 0.0),
+                })
+            )
+            if not response.data:
+                # Spent by another command since gov was loaded: hand back the current row
+                governments.invalidate(gov.id)
+                current = await governments.get(gov.id)
+                if current:
+                    for name in field_names(Government):
+                        setattr(gov, name, getattr(current, name))
+                    gov.mark_clean()
+                return False
+            rows = response.data
+        if data:
+            response = await execute(
+                supabase.table("Government")
+                .update(data)
+                .eq("id", gov.id)
+            )
+            rows = response.data or rows
 
-        return response.data
-    except Exception as e:
-        print(e)
+        if rows:
+            current = _to_government(rows[0])
+            for name in field_names(Government):
+                setattr(gov, name, getattr(current, name))
+        gov.mark_clean()
+        governments.put(gov)
+        return True
+    except Exception:
+        # Unknown what reached the database, load it again next time
+        governments.invalidate(gov.id)
+        raise
 
 
 
+@instrumented()
 async def update_government_gdp(gdp: GovernmentGDP):
-    try:
-        def serialize_value(value):
-            if isinstance(value, date):
-                return value.isoformat()
-            return value
-        
+    if defer_write(gdp, update_government_gdp):
+        return []
 
-        data = {k: serialize_value(v) for k, v in gdp.__dict__.items()}
+    data = changed_columns(gdp, ("server_id", "date"))
+    if not data:
+        return []
 
-        pk = {"server_id": data.pop("server_id"), "date": data.pop("date")}
-        response = (
-            supabase.table("Government_GDP")
-            .update(data)
-            .eq("server_id", pk["server_id"])
-            .eq("date", pk["date"])
-            .execute()
-        )
-        return response.data
-    except Exception as e:
-        print(e)
+    response = await execute(
+        supabase.table("Government_GDP")
+        .update(data)
+        .eq("server_id", gdp.server_id)
+        .eq("date", serialize_value(gdp.date))
+    )
+
+    gdp.mark_clean()
+    return response.data
 
 
 
+@instrumented()
 async def update_market_item(item: MarketItem):
-    data = asdict(item)
-    pk = {"item_tag": data.pop("item_tag"), "server_id": data.pop("server_id")}
-    response = (
+    data = changed_columns(item, ("item_tag", "server_id"))
+    if not data:
+        return []
+
+    response = await execute(
         supabase.table("Market_Items")
         .update(data)
-        .eq("item_tag", pk["item_tag"])
-        .eq("server_id", pk["server_id"])
-        .execute()
+        .eq("item_tag", item.item_tag)
+        .eq("server_id", item.server_id)
     )
+
+    item.mark_clean()
     return response.data
 
 
 
+@instrumented()
 async def update_player_item(item: PlayerItem):
-    try:
-        data = asdict(item)
-        pk = {
-            "user_id": data.pop("user_id"),
-            "item_tag": data.pop("item_tag"),
-            "server_id": data.pop("server_id"),
-        }
-        response = (
-            supabase.table("Player_Items")
-            .update(data)
-            .eq("user_id", pk["user_id"])
-            .eq("item_tag", pk["item_tag"])
-            .eq("server_id", pk["server_id"])
-            .execute()
-        )
-        return response.data
-    except Exception as e:
-        print(e)
+    if defer_write(item, update_player_item):
+        return []
+
+    data = changed_columns(item, ("user_id", "item_tag", "server_id"))
+    if not data:
+        return []
+
+    response = await execute(
+        supabase.table("Player_Items")
+        .update(data)
+        .eq("user_id", item.user_id)
+        .eq("item_tag", item.item_tag)
+        .eq("server_id", item.server_id)
+    )
+
+    item.mark_clean()
+    return response.data
 
 
 
+@instrumented()
 async def update_sell_order(order: SellOrder):
-    try:
-        def serialize_value(value):
-            if isinstance(value, datetime):
-                return value.isoformat()
-            return value
-        
-
-        data = {k: serialize_value(v) for k, v in order.__dict__.items()}
-
-        pk = {
-            "user_id": data.pop("user_id"),
-            "server_id": data.pop("server_id"),
-            "item_tag": data.pop("item_tag"),
-            "unit_price": data.pop("unit_price"),
-            "is_company": data.pop("is_company"),
-        }
-        response = (
-            supabase.table("Sell_Orders")
-            .update(data)
-            .eq("user_id", pk["user_id"])
-            .eq("server_id", pk["server_id"])
-            .eq("item_tag", pk["item_tag"])
-            .eq("unit_price", pk["unit_price"])
-            .eq("is_company", pk["is_company"])
-            .execute()
-        )
-        return response.data
-    except Exception as e:
-        print(e)
+    data = changed_columns(order, ORDER_PRIMARY_KEY)
+    if not data:
+        return []
 
+    response = await execute(
+        supabase.table("Sell_Orders")
+        .update(data)
+        .eq("user_id", order.user_id)
+        .eq("server_id", order.server_id)
+        .eq("item_tag", order.item_tag)
+        .eq("unit_price", order.unit_price)
+        .eq("is_company", order.is_company)
+    )
+
+    order.mark_clean()
+    book = order_books.loaded(order.server_id, order.item_tag)
+    if book:
+        book.update(order)
+    return response.data
 
 
+
+@instrumented()
 async def update_buy_order(order: BuyOrder):
-    try:
-        def serialize_value(value):
-            if isinstance(value, datetime):
-                return value.isoformat()
-            return value
-        
-
-        data = {k: serialize_value(v) for k, v in order.__dict__.items()}
-
-        pk = {
-            "user_id": data.pop("user_id"),
-            "server_id": data.pop("server_id"),
-            "item_tag": data.pop("item_tag"),
-            "unit_price": data.pop("unit_price"),
-            "is_company": data.pop("is_company"),
-        }
-        response = (
-            supabase.table("Buy_Orders")
-            .update(data)
-            .eq("user_id", pk["user_id"])
-            .eq("server_id", pk["server_id"])
-            .eq("item_tag", pk["item_tag"])
-            .eq("unit_price", pk["unit_price"])
-            .eq("is_company", pk["is_company"])
-            .execute()
-        )
-        return response.data
-    except Exception as e:
-        print(e)
+    data = changed_columns(order, ORDER_PRIMARY_KEY)
+    if not data:
+        return []
 
+    response = await execute(
+        supabase.table("Buy_Orders")
+        .update(data)
+        .eq("user_id", order.user_id)
+        .eq("server_id", order.server_id)
+        .eq("item_tag", order.item_tag)
+        .eq("unit_price", order.unit_price)
+        .eq("is_company", order.is_company)
+    )
+
+    order.mark_clean()
+    book = order_books.loaded(order.server_id, order.item_tag)
+    if book:
+        book.update(order)
+    return response.data
 
 
+
+@instrumented()
 async def delete_company_item(company_entrepreneur_id: int, item_tag: str, server_id: int):
-    try:
-        response = (
-            supabase.table("Company_Items")
-            .delete()
-            .eq("company_entrepreneur_id", company_entrepreneur_id)
-            .eq("item_tag", item_tag)
-            .eq("server_id", server_id)
-            .execute()
-        )
-        return response.data
-    except Exception as e:
-        print(e)
+    forget(CompanyItem, company_entrepreneur_id, server_id, item_tag)
+    response = await execute(
+        supabase.table("Company_Items")
+        .delete()
+        .eq("company_entrepreneur_id", company_entrepreneur_id)
+        .eq("item_tag", item_tag)
+        .eq("server_id", server_id)
+    )
+    wrote_through()
+    return response.data
 
 
 
+@instrumented()
 async def delete_company(entrepreneur_id: int, server_id: int):
-    try:
-        response = (
-            supabase.table("Companies")
-            .delete()
-            .eq("entrepreneur_id", entrepreneur_id)
-            .eq("server_id", server_id)
-            .execute()
-        )
-        return response.data
-    except Exception as e:
-        print(e)
+    response = await execute(
+        supabase.table("Companies")
+        .delete()
+        .eq("entrepreneur_id", entrepreneur_id)
+        .eq("server_id", server_id)
+    )
 
+    board = leaderboards.loaded(server_id)
+    if board:
+        board.set_company(entrepreneur_id, None)
+    return response.data
 
+
+@instrumented()
 async def delete_join_requests(company_entrepreneur_id: int, user_id: int, server_id: int):
-    try:
-        response = (
-            supabase.table("Company_Join_Requests")
-            .delete()
-            .eq("company_entrepreneur_id", company_entrepreneur_id)
-            .eq("user_id", user_id)
-            .eq("server_id", server_id)
-            .execute()
-        )
-        return response.data
-    
-    except Exception as e:
-        print(e)
+    response = await execute(
+        supabase.table("Company_Join_Requests")
+        .delete()
+        .eq("company_entrepreneur_id", company_entrepreneur_id)
+        .eq("user_id", user_id)
+        .eq("server_id", server_id)
+    )
+    return response.data
 
 
+@instrumented()
 async def delete_player_item(user_id: int, item_tag: str, server_id: int):
-    try:
-        response = (
-            supabase.table("Player_Items")
-            .delete()
-            .eq("user_id", user_id)
-            .eq("item_tag", item_tag)
-            .eq("server_id", server_id)
-            .execute()
-        )
-    
-        return response.data
+    forget(PlayerItem, user_id, server_id, item_tag)
+    response = await execute(
+        supabase.table("Player_Items")
+        .delete()
+        .eq("user_id", user_id)
+        .eq("item_tag", item_tag)
+        .eq("server_id", server_id)
+    )
+    wrote_through()
 
-    except Exception as e:
-        print(e)
+    return response.data
 
 
+@instrumented()
 async def add_object(obj: Any, table_name: str):
-    try:
-        data = obj.__dict__.copy()
-
-        if isinstance(data.get("date"), date):
-            data["date"] = data["date"].isoformat()
-
-        if isinstance(data.get("created_at"), datetime):
-            data["created_at"] = data["created_at"].isoformat()
-
-        response = (
-            supabase.table(table_name)
-            .insert(data)
-            .execute()
-        )
-        return response.data
-    except Exception as e:
-        print(e)
+    response = await execute(
+        supabase.table(table_name)
+        .insert(to_row(obj))
+    )
+    wrote_through()
+    obj.mark_clean()
+    track(obj)
+    if table_name in ("Buy_Orders", "Sell_Orders"):
+        book = order_books.loaded(obj.server_id, obj.item_tag)
+        if book:
+            book.add(obj)
+    elif table_name == "Government":
+        governments.put(obj)
+    elif table_name in ("Players", "Companies"):
+        board = leaderboards.loaded(obj.server_id)
+        if board and table_name == "Players":
+            board.set_player(obj.id, obj.money, obj.debt)
+        elif board:
+            board.set_company(obj.entrepreneur_id, obj.capital)
+    return response.data
 
    
 
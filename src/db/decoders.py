@@ -0,0 +1,74 @@
+from dataclasses import fields, MISSING
+from datetime import datetime, date
+from functools import lru_cache
+from typing import Callable, Iterable, Type, TypeVar, Union, get_args, get_origin
+
+
+T = TypeVar("T")
+
+# Timestamps repeat a lot between rows (order expiry, cooldowns, default dates), parsed values are immutable
+TIMESTAMP_CACHE_SIZE = 16384
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_datetime(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _parser(field_type):
+    # Optional[datetime] -> datetime
+    if get_origin(field_type) is Union:
+        types = [arg for arg in get_args(field_type) if arg is not type(None)]
+        field_type = types[0] if len(types) == 1 else None
+    if field_type is datetime:
+        return "parse_datetime"
+    if field_type is date:
+        return "parse_date"
+    return None
+
+
+def compile_decoder(model: Type[T], strip: Iterable[str] = ()) -> Callable[[dict], T]:
+    '''
+    Builds the function that turns a row (dict from supabase) into a model object, from the fields of the dataclass.
+    datetime / date fields are parsed (cached), missing columns get the field default or None.
+    Tracked models (with mark_clean) come back clean, as if mark_clean() was called.
+
+    :param strip: Names of text columns to strip, e.g. item tags with trailing spaces
+    '''
+    namespace = {"model": model, "parse_datetime": parse_datetime, "parse_date": parse_date}
+    strip = set(strip)
+    lines = [f"def decode_{model.__name__}(entry):", "    get = entry.get"]
+    names = []
+    for field in fields(model):
+        name = field.name
+        names.append(name)
+        default = "None"
+        if field.default is not MISSING:
+            namespace[f"default_{name}"] = field.default
+            default = f"default_{name}"
+        lines.append(f"    {name} = get({name!r}, {default})")
+        parser = _parser(field.type)
+        if parser:
+            lines.append(f"    if {name}: {name} = {parser}({name})")
+            lines.append(f"    else: {name} = None")
+        if name in strip:
+            lines.append(f"    if {name} is not None: {name} = {name}.strip()")
+
+    lines.append(f"    obj = model({', '.join(f'{name}={name}' for name in names)})")
+    if hasattr(model, "mark_clean"):
+        lines.append(f"    obj._snapshot = ({', '.join(names)},)")
+    lines.append("    return obj")
+
+    exec("\n".join(lines), namespace)
+    return namespace[f"decode_{model.__name__}"]
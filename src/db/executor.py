@@ -0,0 +1,30 @@
+import asyncio
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from src.config import DB_POOL_SIZE
+from src.db.instrumentation import record_query
+from src.metrics import DB_QUERIES_IN_FLIGHT
+
+
+# The supabase client is synchronous, so every .execute() would block the event loop.
+# Queries are handed to a bounded thread pool instead, which lets other commands keep running
+# while one of them waits on the network.
+_pool = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+
+async def execute(query):
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    DB_QUERIES_IN_FLIGHT.inc()
+    try:
+        response = await loop.run_in_executor(_pool, query.execute)
+    finally:
+        DB_QUERIES_IN_FLIGHT.inc(amount=-1)
+    record_query(response, time.perf_counter() - started)
+    return response
+
+
+def shutdown():
+    _pool.shutdown(wait=True)
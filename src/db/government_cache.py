@@ -0,0 +1,70 @@
+import asyncio
+
+from collections import defaultdict
+from copy import copy
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from src.db.models import Government
+from src.metrics import CACHE_LOOKUPS
+
+
+class GovernmentCache:
+    '''
+    Government row per server. Loaded on first use, afterwards update_government / add_object write through,
+    so the rarely changing row doesn't cost a round trip on every command.
+    Every write bumps the version of the server, a load that raced with a write is used once and not kept.
+
+    :param loader: Coroutine function server_id -> Government, None if there is none or on error
+    :param ttl: Load again when the row is older than this (picks up edits made directly in the database). None keeps it until invalidate()
+    '''
+    def __init__(self, loader: Callable[[int], Awaitable[Optional[Government]]], ttl: Optional[timedelta] = None):
+        self._loader = loader
+        self._ttl = ttl
+        self._governments: Dict[int, Government] = {}
+        self._loaded_at: Dict[int, datetime] = {}
+        self._versions: Dict[int, int] = defaultdict(int)
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def _is_fresh(self, server_id: int) -> bool:
+        loaded_at = self._loaded_at.get(server_id)
+        if loaded_at is None:
+            return False
+        return self._ttl is None or datetime.now() - loaded_at <= self._ttl
+
+    async def get(self, server_id: int) -> Optional[Government]:
+        '''
+        :return: A copy, changes only reach the cache through update_government
+        '''
+        server_id = int(server_id)
+        CACHE_LOOKUPS.inc("governments", "hit" if self._is_fresh(server_id) else "miss")
+        if not self._is_fresh(server_id):
+            async with self._locks.setdefault(server_id, asyncio.Lock()):
+                if not self._is_fresh(server_id):
+                    version = self._versions[server_id]
+                    government = await self._loader(server_id)
+                    if government is None:
+                        return None
+                    if self._versions[server_id] != version:
+                        # Written while loading, the result may miss it. Use it once, load again next time
+                        return government
+                    self._governments[server_id] = copy(government)
+                    self._loaded_at[server_id] = datetime.now()
+
+        government = self._governments.get(server_id)
+        return copy(government) if government else None
+
+    def put(self, government: Government):
+        '''
+        Write-through: government was just written and reflects the row.
+        '''
+        server_id = int(government.id)
+        self._versions[server_id] += 1
+        self._governments[server_id] = copy(government)
+        self._loaded_at[server_id] = datetime.now()
+
+    def invalidate(self, server_id: int):
+        server_id = int(server_id)
+        self._versions[server_id] += 1
+        self._governments.pop(server_id, None)
+        self._loaded_at.pop(server_id, None)
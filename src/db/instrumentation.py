@@ -0,0 +1,101 @@
+import json
+import time
+
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import wraps
+from typing import Optional
+
+from src.config import SLOW_DB_CALL
+from src.metrics import DB_CALL_DURATION, DB_QUERIES, DB_ROWS, DB_PAYLOAD_BYTES
+
+
+class ConflictError(Exception):
+    '''
+    A row was changed concurrently too often, so the write was not done. instrumented lets it through,
+    the command has to stop instead of reporting a success.
+    '''
+
+
+@dataclass
+class QueryStats:
+    queries: int = 0
+    rows: int = 0
+    payload_bytes: int = 0
+    seconds: float = 0.0  # Time spent waiting for queries
+
+    def add(self, other: "QueryStats"):
+        self.queries += other.queries
+        self.rows += other.rows
+        self.payload_bytes += other.payload_bytes
+        self.seconds += other.seconds
+
+
+# Queries of the db_calls function that is running right now
+_current_call: ContextVar[Optional[QueryStats]] = ContextVar("db_call", default=None)
+# Queries of the whole command, set for every interaction by the command tree
+_command_trace: ContextVar[Optional[QueryStats]] = ContextVar("command_trace", default=None)
+
+
+def start_trace() -> QueryStats:
+    trace = QueryStats()
+    _command_trace.set(trace)
+    return trace
+
+
+def record_query(response, seconds: float):
+    '''
+    Called by executor.execute for every query.
+    '''
+    data = getattr(response, "data", None)
+    query = QueryStats(
+        queries=1,
+        rows=len(data) if isinstance(data, list) else int(bool(data)),
+        payload_bytes=len(json.dumps(data, default=str)) if data else 0,
+        seconds=seconds,
+    )
+    for stats in (_current_call.get(), _command_trace.get()):
+        if stats is not None:
+            stats.add(query)
+
+
+def instrumented(default=None):
+    '''
+    Times a db_calls function and counts its queries, rows and payload (including nested db_calls).
+    An exception is printed and counted, the function then returns default (called if it is callable, e.g. list).
+    ConflictError is counted as well, but raised again.
+    Calls slower than SLOW_DB_CALL are printed.
+    '''
+    def decorator(function):
+        name = function.__name__
+
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            parent = _current_call.get()
+            stats = QueryStats()
+            token = _current_call.set(stats)
+            started = time.perf_counter()
+            status = "ok"
+            try:
+                return await function(*args, **kwargs)
+            except ConflictError as e:
+                status = "error"
+                print(f"{name}: {e}")
+                raise
+            except Exception as e:
+                status = "error"
+                print(f"{name}: {e}")
+                return default() if callable(default) else default
+            finally:
+                _current_call.reset(token)
+                seconds = time.perf_counter() - started
+                DB_CALL_DURATION.observe(seconds, name, status)
+                DB_QUERIES.inc(name, amount=stats.queries)
+                DB_ROWS.inc(name, amount=stats.rows)
+                DB_PAYLOAD_BYTES.inc(name, amount=stats.payload_bytes)
+                if seconds >= SLOW_DB_CALL.total_seconds():
+                    print(f"Slow db call {name}: {seconds * 1000:.0f} ms, {stats.queries} queries, {stats.rows} rows")
+                if parent is not None:
+                    parent.add(stats)
+        return wrapper
+    return decorator
@@ -0,0 +1,120 @@
+import asyncio
+
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+from src.db.models import Player, Company
+from src.metrics import CACHE_LOOKUPS
+
+
+class NetWorthIndex:
+    '''
+    Net worth ranking of one server: money - debt of the player + capital of the company they own.
+    Kept sorted on every change, so rank and page lookups are O(log n) instead of loading and sorting every player.
+    '''
+    def __init__(self):
+        self._balances: Dict[int, float] = {}   # money - debt per player
+        self._capital: Dict[int, float] = {}    # company capital per entrepreneur
+        self._ranking = SortedList()            # (-net worth, user_id)
+        self._entries: Dict[int, Tuple[float, int]] = {}
+
+    def __len__(self):
+        return len(self._ranking)
+
+    def _rerank(self, user_id: int):
+        old = self._entries.pop(user_id, None)
+        if old is not None:
+            self._ranking.remove(old)
+        if user_id not in self._balances:
+            # Only players are ranked, a company without a player row just keeps its capital around
+            return
+        entry = (-(self._balances[user_id] + self._capital.get(user_id, 0.0)), user_id)
+        self._ranking.add(entry)
+        self._entries[user_id] = entry
+
+    def set_player(self, user_id: int, money: float, debt: float):
+        self._balances[int(user_id)] = (money or 0.0) - (debt or 0.0)
+        self._rerank(int(user_id))
+
+    def adjust_player(self, user_id: int, delta: float):
+        if int(user_id) in self._balances:
+            self._balances[int(user_id)] += delta
+            self._rerank(int(user_id))
+
+    def set_company(self, entrepreneur_id: int, capital: Optional[float]):
+        if capital is None:
+            self._capital.pop(int(entrepreneur_id), None)
+        else:
+            self._capital[int(entrepreneur_id)] = capital
+        self._rerank(int(entrepreneur_id))
+
+    def adjust_company(self, entrepreneur_id: int, delta: float):
+        if int(entrepreneur_id) in self._capital:
+            self._capital[int(entrepreneur_id)] += delta
+            self._rerank(int(entrepreneur_id))
+
+    def rank_of(self, user_id: int) -> Optional[int]:
+        '''
+        :return: 1-based position, None if the user isn't ranked
+        '''
+        entry = self._entries.get(int(user_id))
+        return self._ranking.index(entry) + 1 if entry else None
+
+    def page(self, start: int, count: int) -> List[Tuple[int, float]]:
+        '''
+        :return: (user_id, net worth) of the ranks start + 1 ... start + count
+        '''
+        return [(user_id, -negative_net) for negative_net, user_id in self._ranking[start:start + count]]
+
+
+class Leaderboards:
+    '''
+    NetWorthIndex per server. Loaded from Players and Companies on first use,
+    afterwards db_calls keeps it up to date on every money / capital / debt write.
+
+    :param loader: Coroutine function server_id -> (players, companies), or None on error
+    '''
+    def __init__(self, loader: Callable[[int], Awaitable[Optional[Tuple[List[Player], List[Company]]]]]):
+        self._loader = loader
+        self._boards: Dict[int, NetWorthIndex] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._changed_while_loading = set()
+
+    async def get(self, server_id: int) -> Optional[NetWorthIndex]:
+        server_id = int(server_id)
+        board = self._boards.get(server_id)
+        if board is not None:
+            CACHE_LOOKUPS.inc("leaderboards", "hit")
+            return board
+
+        CACHE_LOOKUPS.inc("leaderboards", "miss")
+        async with self._locks.setdefault(server_id, asyncio.Lock()):
+            if server_id in self._boards:
+                return self._boards[server_id]
+
+            self._changed_while_loading.discard(server_id)
+            loaded = await self._loader(server_id)
+            if loaded is None:
+                return None
+
+            players, companies = loaded
+            board = NetWorthIndex()
+            for player in players:
+                board.set_player(player.id, player.money, player.debt)
+            for company in companies:
+                board.set_company(company.entrepreneur_id, company.capital)
+
+            # A write landed while the query was running, the result may miss it. Use it once, load again next time
+            if server_id not in self._changed_while_loading:
+                self._boards[server_id] = board
+            return board
+
+    def loaded(self, server_id: int) -> Optional[NetWorthIndex]:
+        '''
+        Board for the write hooks. Returns None if it isn't loaded, it picks the change up on load.
+        '''
+        server_id = int(server_id)
+        if server_id in self._locks and self._locks[server_id].locked():
+            self._changed_while_loading.add(server_id)
+        return self._boards.get(server_id)
@@ -0,0 +1,249 @@
+-- Atomic order matching for /buy and /sell.
+-- fill_buy_order / fill_sell_order match an incoming order against the resting orders in one transaction:
+-- money, items, owed taxes, GDP and the order rows are all updated together, and the fills come back as a JSON array.
+-- Run this once in the Supabase SQL editor.
+
+alter table "Sell_Orders" add column if not exists created_at timestamptz not null default now();
+alter table "Buy_Orders" add column if not exists created_at timestamptz not null default now();
+
+
+-- Locks the player / company row and returns its money (null if it doesn't exist)
+create or replace function _market_lock_balance(p_server_id bigint, p_user_id bigint, p_is_company boolean)
+returns float8 language plpgsql as $$
+declare
+    v_balance float8;
+begin
+    if p_is_company then
+        select capital into v_balance from "Companies"
+        where entrepreneur_id = p_user_id and server_id = p_server_id for update;
+    else
+        select money into v_balance from "Players"
+        where id = p_user_id and server_id = p_server_id for update;
+    end if;
+    return v_balance;
+end $$;
+
+
+create or replace function _market_adjust_balance(p_server_id bigint, p_user_id bigint, p_is_company boolean, p_delta float8)
+returns void language plpgsql as $$
+begin
+    if p_is_company then
+        update "Companies" set capital = capital + p_delta
+        where entrepreneur_id = p_user_id and server_id = p_server_id;
+    else
+        update "Players" set money = money + p_delta
+        where id = p_user_id and server_id = p_server_id;
+    end if;
+end $$;
+
+
+-- Same as transactions.add_owed_taxes: the sale counts towards the GDP and the seller owes taxrate * amount
+create or replace function _market_accrue_taxes(p_server_id bigint, p_user_id bigint, p_is_company boolean, p_amount float8, p_today date)
+returns void language plpgsql as $$
+declare
+    v_taxrate float8;
+    v_tax float8;
+begin
+    if p_amount <= 0 then
+        return;
+    end if;
+
+    update "Government_GDP" set gdp_value = gdp_value + p_amount
+    where server_id = p_server_id and date = p_today;
+    if not found then
+        insert into "Government_GDP" (server_id, date, gdp_value) values (p_server_id, p_today, p_amount);
+    end if;
+
+    insert into "Government" (id, taxrate, interest_rate, treasury, gambling_pool)
+    values (p_server_id, 0.1, 0.3, 0, 0)
+    on conflict (id) do nothing;
+    select coalesce(taxrate, 0) into v_taxrate from "Government" where id = p_server_id;
+
+    v_tax := round((p_amount * v_taxrate)::numeric, 2)::float8;
+    if v_tax <= 0 then
+        return;
+    end if;
+
+    if p_is_company then
+        update "Companies" set taxes_owed = coalesce(taxes_owed, 0) + v_tax
+        where entrepreneur_id = p_user_id and server_id = p_server_id;
+    else
+        update "Players" set taxes_owed = coalesce(taxes_owed, 0) + v_tax
+        where id = p_user_id and server_id = p_server_id;
+    end if;
+end $$;
+
+
+-- Locks the inventory row and returns how many of the item the player / company holds
+create or replace function _market_lock_items(p_server_id bigint, p_user_id bigint, p_is_company boolean, p_item_tag text)
+returns integer language plpgsql as $$
+declare
+    v_amount integer;
+begin
+    if p_is_company then
+        select amount into v_amount from "Company_Items"
+        where company_entrepreneur_id = p_user_id and server_id = p_server_id and lower(trim(item_tag)) = lower(trim(p_item_tag))
+        for update;
+    else
+        select amount into v_amount from "Player_Items"
+        where user_id = p_user_id and server_id = p_server_id and lower(trim(item_tag)) = lower(trim(p_item_tag))
+        for update;
+    end if;
+    return coalesce(v_amount, 0);
+end $$;
+
+
+-- Adds (positive) or removes (negative) items, empty stacks are deleted
+create or replace function _market_adjust_items(p_server_id bigint, p_user_id bigint, p_is_company boolean, p_item_tag text, p_delta integer)
+returns void language plpgsql as $$
+begin
+    if p_is_company then
+        update "Company_Items" set amount = amount + p_delta
+        where company_entrepreneur_id = p_user_id and server_id = p_server_id and lower(trim(item_tag)) = lower(trim(p_item_tag));
+        if not found and p_delta > 0 then
+            insert into "Company_Items" (company_entrepreneur_id, server_id, item_tag, amount)
+            values (p_user_id, p_server_id, p_item_tag, p_delta);
+        end if;
+        delete from "Company_Items"
+        where company_entrepreneur_id = p_user_id and server_id = p_server_id and lower(trim(item_tag)) = lower(trim(p_item_tag)) and amount <= 0;
+    else
+        update "Player_Items" set amount = amount + p_delta
+        where user_id = p_user_id and server_id = p_server_id and lower(trim(item_tag)) = lower(trim(p_item_tag));
+        if not found and p_delta > 0 then
+            insert into "Player_Items" (user_id, server_id, item_tag, amount, durability)
+            select p_user_id, p_server_id, i.item_tag, p_delta, i.durability
+            from "Items" i where lower(trim(i.item_tag)) = lower(trim(p_item_tag));
+        end if;
+        delete from "Player_Items"
+        where user_id = p_user_id and server_id = p_server_id and lower(trim(item_tag)) = lower(trim(p_item_tag)) and amount <= 0;
+    end if;
+end $$;
+
+
+-- The buyer takes the cheapest sell orders first (oldest first on equal price).
+-- Sell orders are only deleted / reduced here, the seller's items are handled when the sell order is placed.
+create or replace function fill_buy_order(p_server_id bigint, p_user_id bigint, p_is_company boolean, p_item_tag text,
+                                          p_unit_price float8, p_amount integer, p_today date)
+returns jsonb language plpgsql as $$
+declare
+    v_order record;
+    v_balance float8;
+    v_match integer;
+    v_total float8;
+    v_fills jsonb := '[]'::jsonb;
+begin
+    v_balance := _market_lock_balance(p_server_id, p_user_id, p_is_company);
+    if v_balance is null then
+        return v_fills;
+    end if;
+
+    for v_order in
+        select o.user_id, o.is_company, o.amount, o.unit_price from "Sell_Orders" o
+        where o.server_id = p_server_id and o.item_tag = p_item_tag and o.unit_price <= p_unit_price
+        order by o.unit_price asc, o.created_at asc
+        for update
+    loop
+        exit when p_amount <= 0;
+
+        if _market_lock_balance(p_server_id, v_order.user_id, v_order.is_company) is null then
+            -- The person / company who made the sell order no longer exists
+            delete from "Sell_Orders"
+            where user_id = v_order.user_id and server_id = p_server_id and item_tag = p_item_tag
+              and unit_price = v_order.unit_price and is_company = v_order.is_company;
+            continue;
+        end if;
+
+        v_match := least(p_amount, v_order.amount, floor(v_balance / v_order.unit_price)::integer);
+        exit when v_match <= 0;
+        v_total := round((v_match * v_order.unit_price)::numeric, 2)::float8;
+
+        perform _market_adjust_balance(p_server_id, p_user_id, p_is_company, -v_total);
+        perform _market_adjust_items(p_server_id, p_user_id, p_is_company, p_item_tag, v_match);
+        perform _market_adjust_balance(p_server_id, v_order.user_id, v_order.is_company, v_total);
+        perform _market_accrue_taxes(p_server_id, v_order.user_id, v_order.is_company, v_total, p_today);
+
+        if v_match = v_order.amount then
+            delete from "Sell_Orders"
+            where user_id = v_order.user_id and server_id = p_server_id and item_tag = p_item_tag
+              and unit_price = v_order.unit_price and is_company = v_order.is_company;
+        else
+            update "Sell_Orders" set amount = amount - v_match
+            where user_id = v_order.user_id and server_id = p_server_id and item_tag = p_item_tag
+              and unit_price = v_order.unit_price and is_company = v_order.is_company;
+        end if;
+
+        v_balance := v_balance - v_total;
+        p_amount := p_amount - v_match;
+        v_fills := v_fills || jsonb_build_object(
+            'user_id', v_order.user_id, 'is_company', v_order.is_company, 'amount', v_match,
+            'unit_price', v_order.unit_price, 'total_price', v_total
+        );
+    end loop;
+
+    return v_fills;
+end $$;
+
+
+-- The seller serves the highest buy orders first (oldest first on equal price).
+-- Buy orders whose owner can't afford a single unit are skipped.
+create or replace function fill_sell_order(p_server_id bigint, p_user_id bigint, p_is_company boolean, p_item_tag text,
+                                           p_unit_price float8, p_amount integer, p_today date)
+returns jsonb language plpgsql as $$
+declare
+    v_order record;
+    v_balance float8;
+    v_match integer;
+    v_total float8;
+    v_fills jsonb := '[]'::jsonb;
+begin
+    if _market_lock_balance(p_server_id, p_user_id, p_is_company) is null then
+        return v_fills;
+    end if;
+    p_amount := least(p_amount, _market_lock_items(p_server_id, p_user_id, p_is_company, p_item_tag));
+
+    for v_order in
+        select o.user_id, o.is_company, o.amount, o.unit_price from "Buy_Orders" o
+        where o.server_id = p_server_id and o.item_tag = p_item_tag and o.unit_price >= p_unit_price
+        order by o.unit_price desc, o.created_at asc
+        for update
+    loop
+        exit when p_amount <= 0;
+
+        v_balance := _market_lock_balance(p_server_id, v_order.user_id, v_order.is_company);
+        if v_balance is null then
+            -- The person / company who made the buy order no longer exists
+            delete from "Buy_Orders"
+            where user_id = v_order.user_id and server_id = p_server_id and item_tag = p_item_tag
+              and unit_price = v_order.unit_price and is_company = v_order.is_company;
+            continue;
+        end if;
+
+        v_match := least(p_amount, v_order.amount, floor(v_balance / v_order.unit_price)::integer);
+        continue when v_match <= 0;
+        v_total := round((v_match * v_order.unit_price)::numeric, 2)::float8;
+
+        perform _market_adjust_items(p_server_id, p_user_id, p_is_company, p_item_tag, -v_match);
+        perform _market_adjust_items(p_server_id, v_order.user_id, v_order.is_company, p_item_tag, v_match);
+        perform _market_adjust_balance(p_server_id, v_order.user_id, v_order.is_company, -v_total);
+        perform _market_adjust_balance(p_server_id, p_user_id, p_is_company, v_total);
+        perform _market_accrue_taxes(p_server_id, p_user_id, p_is_company, v_total, p_today);
+
+        if v_match = v_order.amount then
+            delete from "Buy_Orders"
+            where user_id = v_order.user_id and server_id = p_server_id and item_tag = p_item_tag
+              and unit_price = v_order.unit_price and is_company = v_order.is_company;
+        else
+            update "Buy_Orders" set amount = amount - v_match
+            where user_id = v_order.user_id and server_id = p_server_id and item_tag = p_item_tag
+              and unit_price = v_order.unit_price and is_company = v_order.is_company;
+        end if;
+
+        p_amount := p_amount - v_match;
+        v_fills := v_fills || jsonb_build_object(
+            'user_id', v_order.user_id, 'is_company', v_order.is_company, 'amount', v_match,
+            'unit_price', v_order.unit_price, 'total_price', v_total
+        );
+    end loop;
+
+    return v_fills;
+end $$;
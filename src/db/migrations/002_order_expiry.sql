@@ -0,0 +1,171 @@
+-- Order expiry.
+-- Orders get an expires_at (BUY_ORDER_DURATION / SELL_ORDER_DURATION in config.py, existing orders get 3 days),
+-- matching ignores expired orders and expire_orders() removes them in bulk for the sweeper (helper/order_expiry.py).
+-- Run this once in the Supabase SQL editor, after 001_order_matching.sql.
+
+alter table "Buy_Orders" add column if not exists expires_at timestamptz not null default now() + interval '3 days';
+alter table "Sell_Orders" add column if not exists expires_at timestamptz not null default now() + interval '3 days';
+
+create index if not exists buy_orders_expires_at_idx on "Buy_Orders" (expires_at);
+create index if not exists sell_orders_expires_at_idx on "Sell_Orders" (expires_at);
+
+-- The matching functions and the order book loader look orders up by server and item
+create index if not exists buy_orders_matching_idx on "Buy_Orders" (server_id, item_tag, unit_price);
+create index if not exists sell_orders_matching_idx on "Sell_Orders" (server_id, item_tag, unit_price);
+
+
+-- The buyer takes the cheapest sell orders first (oldest first on equal price).
+-- Sell orders are only deleted / reduced here, the seller's items are handled when the sell order is placed.
+create or replace function fill_buy_order(p_server_id bigint, p_user_id bigint, p_is_company boolean, p_item_tag text,
+                                          p_unit_price float8, p_amount integer, p_today date)
+returns jsonb language plpgsql as $$
+declare
+    v_order record;
+    v_balance float8;
+    v_match integer;
+    v_total float8;
+    v_fills jsonb := '[]'::jsonb;
+begin
+    v_balance := _market_lock_balance(p_server_id, p_user_id, p_is_company);
+    if v_balance is null then
+        return v_fills;
+    end if;
+
+    for v_order in
+        select o.user_id, o.is_company, o.amount, o.unit_price from "Sell_Orders" o
+        where o.server_id = p_server_id and o.item_tag = p_item_tag and o.unit_price <= p_unit_price
+          and o.expires_at > now()
+        order by o.unit_price asc, o.created_at asc
+        for update
+    loop
+        exit when p_amount <= 0;
+
+        if _market_lock_balance(p_server_id, v_order.user_id, v_order.is_company) is null then
+            -- The person / company who made the sell order no longer exists
+            delete from "Sell_Orders"
+            where user_id = v_order.user_id and server_id = p_server_id and item_tag = p_item_tag
+              and unit_price = v_order.unit_price and is_company = v_order.is_company;
+            continue;
+        end if;
+
+        v_match := least(p_amount, v_order.amount, floor(v_balance / v_order.unit_price)::integer);
+        exit when v_match <= 0;
+        v_total := round((v_match * v_order.unit_price)::numeric, 2)::float8;
+
+        perform _market_adjust_balance(p_server_id, p_user_id, p_is_company, -v_total);
+        perform _market_adjust_items(p_server_id, p_user_id, p_is_company, p_item_tag, v_match);
+        perform _market_adjust_balance(p_server_id, v_order.user_id, v_order.is_company, v_total);
+        perform _market_accrue_taxes(p_server_id, v_order.user_id, v_order.is_company, v_total, p_today);
+
+        if v_match = v_order.amount then
+            delete from "Sell_Orders"
+            where user_id = v_order.user_id and server_id = p_server_id and item_tag = p_item_tag
+              and unit_price = v_order.unit_price and is_company = v_order.is_company;
+        else
+            update "Sell_Orders" set amount = amount - v_match
+            where user_id = v_order.user_id and server_id = p_server_id and item_tag = p_item_tag
+              and unit_price = v_order.unit_price and is_company = v_order.is_company;
+        end if;
+
+        v_balance := v_balance - v_total;
+        p_amount := p_amount - v_match;
+        v_fills := v_fills || jsonb_build_object(
+            'user_id', v_order.user_id, 'is_company', v_order.is_company, 'amount', v_match,
+            'unit_price', v_order.unit_price, 'total_price', v_total
+        );
+    end loop;
+
+    return v_fills;
+end $$;
+
+
+-- The seller serves the highest buy orders first (oldest first on equal price).
+-- Buy orders whose owner can't afford a single unit are skipped.
+create or replace function fill_sell_order(p_server_id bigint, p_user_id bigint, p_is_company boolean, p_item_tag text,
+                                           p_unit_price float8, p_amount integer, p_today date)
+returns jsonb language plpgsql as $$
+declare
+    v_order record;
+    v_balance float8;
+    v_match integer;
+    v_total float8;
+    v_fills jsonb := '[]'::jsonb;
+begin
+    if _market_lock_balance(p_server_id, p_user_id, p_is_company) is null then
+        return v_fills;
+    end if;
+    p_amount := least(p_amount, _market_lock_items(p_server_id, p_user_id, p_is_company, p_item_tag));
+
+    for v_order in
+        select o.user_id, o.is_company, o.amount, o.unit_price from "Buy_Orders" o
+        where o.server_id = p_server_id and o.item_tag = p_item_tag and o.unit_price >= p_unit_price
+          and o.expires_at > now()
+        order by o.unit_price desc, o.created_at asc
+        for update
+    loop
+        exit when p_amount <= 0;
+
+        v_balance := _market_lock_balance(p_server_id, v_order.user_id, v_order.is_company);
+        if v_balance is null then
+            -- The person / company who made the buy order no longer exists
+            delete from "Buy_Orders"
+            where user_id = v_order.user_id and server_id = p_server_id and item_tag = p_item_tag
+              and unit_price = v_order.unit_price and is_company = v_order.is_company;
+            continue;
+        end if;
+
+        v_match := least(p_amount, v_order.amount, floor(v_balance / v_order.unit_price)::integer);
+        continue when v_match <= 0;
+        v_total := round((v_match * v_order.unit_price)::numeric, 2)::float8;
+
+        perform _market_adjust_items(p_server_id, p_user_id, p_is_company, p_item_tag, -v_match);
+        perform _market_adjust_items(p_server_id, v_order.user_id, v_order.is_company, p_item_tag, v_match);
+        perform _market_adjust_balance(p_server_id, v_order.user_id, v_order.is_company, -v_total);
+        perform _market_adjust_balance(p_server_id, p_user_id, p_is_company, v_total);
+        perform _market_accrue_taxes(p_server_id, p_user_id, p_is_company, v_total, p_today);
+
+        if v_match = v_order.amount then
+            delete from "Buy_Orders"
+            where user_id = v_order.user_id and server_id = p_server_id and item_tag = p_item_tag
+              and unit_price = v_order.unit_price and is_company = v_order.is_company;
+        else
+            update "Buy_Orders" set amount = amount - v_match
+            where user_id = v_order.user_id and server_id = p_server_id and item_tag = p_item_tag
+              and unit_price = v_order.unit_price and is_company = v_order.is_company;
+        end if;
+
+        p_amount := p_amount - v_match;
+        v_fills := v_fills || jsonb_build_object(
+            'user_id', v_order.user_id, 'is_company', v_order.is_company, 'amount', v_match,
+            'unit_price', v_order.unit_price, 'total_price', v_total
+        );
+    end loop;
+
+    return v_fills;
+end $$;
+
+
+-- Deletes every expired order. Sell orders hold the seller's items, those go back to the inventory.
+-- Buy orders don't reserve money, so there is nothing to give back.
+create or replace function expire_orders(p_now timestamptz default now())
+returns jsonb language plpgsql as $$
+declare
+    v_order record;
+    v_buy_orders jsonb := '[]'::jsonb;
+    v_sell_orders jsonb := '[]'::jsonb;
+begin
+    for v_order in
+        delete from "Buy_Orders" where expires_at <= p_now returning *
+    loop
+        v_buy_orders := v_buy_orders || to_jsonb(v_order);
+    end loop;
+
+    for v_order in
+        delete from "Sell_Orders" where expires_at <= p_now returning *
+    loop
+        perform _market_adjust_items(v_order.server_id, v_order.user_id, v_order.is_company, v_order.item_tag, v_order.amount);
+        v_sell_orders := v_sell_orders || to_jsonb(v_order);
+    end loop;
+
+    return jsonb_build_object('buy_orders', v_buy_orders, 'sell_orders', v_sell_orders);
+end $$;
@@ -0,0 +1,5 @@
+-- ensure_market_initialized (helper/market.py) upserts all Market_Items of a server at once
+-- and relies on this index to skip the rows that already exist.
+-- Run this once in the Supabase SQL editor. Remove duplicate (item_tag, server_id) rows first if it fails.
+
+create unique index if not exists market_items_item_tag_server_id_idx on "Market_Items" (item_tag, server_id);
@@ -0,0 +1,58 @@
+-- GDP is summed up in memory (helper/gdp.py) and written with one atomic increment per server and day.
+-- Run this once in the Supabase SQL editor.
+
+-- The old read-then-insert could create the same day twice: merge those rows into one with the sum,
+-- otherwise the unique index can't be created
+with duplicates as (
+    delete from "Government_GDP" g
+    where exists (
+        select 1 from "Government_GDP" o
+        where o.server_id = g.server_id and o.date = g.date and o.ctid <> g.ctid
+    )
+    returning server_id, date, gdp_value
+)
+insert into "Government_GDP" (server_id, date, gdp_value)
+select server_id, date, sum(gdp_value) from duplicates group by server_id, date;
+
+create unique index if not exists government_gdp_server_id_date_idx on "Government_GDP" (server_id, date);
+
+create or replace function increment_gdp(p_server_id bigint, p_date date, p_amount float8)
+returns void language sql as $$
+    insert into "Government_GDP" (server_id, date, gdp_value)
+    values (p_server_id, p_date, p_amount)
+    on conflict (server_id, date) do update set gdp_value = "Government_GDP".gdp_value + excluded.gdp_value;
+$$;
+
+
+-- Same as in 001_order_matching.sql, but the GDP goes through increment_gdp: with "update; if not found insert"
+-- a fill and the accumulator could both insert the first row of the day, and the fill would roll back on the unique index
+create or replace function _market_accrue_taxes(p_server_id bigint, p_user_id bigint, p_is_company boolean, p_amount float8, p_today date)
+returns void language plpgsql as $$
+declare
+    v_taxrate float8;
+    v_tax float8;
+begin
+    if p_amount <= 0 then
+        return;
+    end if;
+
+    perform increment_gdp(p_server_id, p_today, p_amount);
+
+    insert into "Government" (id, taxrate, interest_rate, treasury, gambling_pool)
+    values (p_server_id, 0.1, 0.3, 0, 0)
+    on conflict (id) do nothing;
+    select coalesce(taxrate, 0) into v_taxrate from "Government" where id = p_server_id;
+
+    v_tax := round((p_amount * v_taxrate)::numeric, 2)::float8;
+    if v_tax <= 0 then
+        return;
+    end if;
+
+    if p_is_company then
+        update "Companies" set taxes_owed = coalesce(taxes_owed, 0) + v_tax
+        where entrepreneur_id = p_user_id and server_id = p_server_id;
+    else
+        update "Players" set taxes_owed = coalesce(taxes_owed, 0) + v_tax
+        where id = p_user_id and server_id = p_server_id;
+    end if;
+end $$;
@@ -0,0 +1,29 @@
+-- Taxes are accrued in memory + a journal file (helper/tax_ledger.py) and added to taxes_owed in batches.
+-- Run this once in the Supabase SQL editor.
+
+-- Settled batch ids, so a batch that is sent again after a crash is not added twice
+create table if not exists "Tax_Settlements" (
+    batch_id uuid primary key,
+    settled_at timestamptz not null default now()
+);
+
+-- p_entries: [{"server_id", "user_id", "is_company", "amount"}], at most one entry per user and is_company
+create or replace function settle_taxes(p_batch_id uuid, p_entries jsonb)
+returns boolean language plpgsql as $$
+begin
+    insert into "Tax_Settlements" (batch_id) values (p_batch_id) on conflict do nothing;
+    if not found then
+        return false;
+    end if;
+
+    update "Players" p set taxes_owed = coalesce(p.taxes_owed, 0) + e.amount
+    from jsonb_to_recordset(p_entries) as e(server_id bigint, user_id bigint, is_company boolean, amount float8)
+    where not e.is_company and p.id = e.user_id and p.server_id = e.server_id;
+
+    update "Companies" c set taxes_owed = coalesce(c.taxes_owed, 0) + e.amount
+    from jsonb_to_recordset(p_entries) as e(server_id bigint, user_id bigint, is_company boolean, amount float8)
+    where e.is_company and c.entrepreneur_id = e.user_id and c.server_id = e.server_id;
+
+    return true;
+end;
+$$;
@@ -0,0 +1,15 @@
+-- update_government sends treasury / gambling_pool changes as differences, so concurrent commands don't overwrite each other.
+-- A difference that would take the treasury or the gambling pool below 0 is refused (no row returned),
+-- the check of the command ran against the cached row and another command may have spent the money since.
+-- Run this once in the Supabase SQL editor.
+
+create or replace function adjust_government(p_id bigint, p_treasury float8, p_gambling_pool float8)
+returns setof "Government" language sql as $$
+    update "Government"
+    set treasury = coalesce(treasury, 0) + p_treasury,
+        gambling_pool = coalesce(gambling_pool, 0) + p_gambling_pool
+    where id = p_id
+      and (p_treasury >= 0 or coalesce(treasury, 0) + p_treasury >= 0)
+      and (p_gambling_pool >= 0 or coalesce(gambling_pool, 0) + p_gambling_pool >= 0)
+    returning *;
+$$;
@@ -0,0 +1,17 @@
+-- Optimistic concurrency for Players: update_player only writes if the version is still the one it loaded.
+-- Run this once in the Supabase SQL editor.
+
+alter table "Players" add column if not exists version bigint not null default 0;
+
+-- Bumped on every update, also the ones from the SQL functions (order fills, tax settlement)
+create or replace function _bump_version()
+returns trigger language plpgsql as $$
+begin
+    new.version := old.version + 1;
+    return new;
+end;
+$$;
+
+drop trigger if exists players_bump_version on "Players";
+create trigger players_bump_version before update on "Players"
+for each row execute function _bump_version();
@@ -0,0 +1,53 @@
+-- db_calls looks item tags up with a case-insensitive ilike on the catalog spelling, which can't trim the stored value,
+-- while the SQL functions compare lower(trim(item_tag)). Strips the stray spaces from the stored tags once,
+-- so both see the same rows. New rows are written with the catalog spelling (already trimmed).
+-- Run this once in the Supabase SQL editor.
+
+update "Items" set item_tag = trim(item_tag) where item_tag <> trim(item_tag);
+
+
+-- Stacks and orders that only differ by spaces are merged into the trimmed row
+with padded as (
+    delete from "Player_Items" where item_tag <> trim(item_tag)
+    returning user_id, server_id, trim(item_tag) as item_tag, amount, durability
+)
+insert into "Player_Items" (user_id, server_id, item_tag, amount, durability)
+select user_id, server_id, item_tag, sum(amount), max(durability) from padded group by user_id, server_id, item_tag
+on conflict (user_id, server_id, item_tag) do update set amount = "Player_Items".amount + excluded.amount;
+
+with padded as (
+    delete from "Company_Items" where item_tag <> trim(item_tag)
+    returning company_entrepreneur_id, server_id, trim(item_tag) as item_tag, amount
+)
+insert into "Company_Items" (company_entrepreneur_id, server_id, item_tag, amount)
+select company_entrepreneur_id, server_id, item_tag, sum(amount) from padded group by company_entrepreneur_id, server_id, item_tag
+on conflict (company_entrepreneur_id, server_id, item_tag) do update set amount = "Company_Items".amount + excluded.amount;
+
+with padded as (
+    delete from "Buy_Orders" where item_tag <> trim(item_tag)
+    returning user_id, server_id, trim(item_tag) as item_tag, unit_price, is_company, amount, expires_at, created_at
+)
+insert into "Buy_Orders" (user_id, server_id, item_tag, unit_price, is_company, amount, expires_at, created_at)
+select user_id, server_id, item_tag, unit_price, is_company, sum(amount), max(expires_at), min(created_at) from padded
+group by user_id, server_id, item_tag, unit_price, is_company
+on conflict (user_id, server_id, item_tag, unit_price, is_company) do update set amount = "Buy_Orders".amount + excluded.amount;
+
+with padded as (
+    delete from "Sell_Orders" where item_tag <> trim(item_tag)
+    returning user_id, server_id, trim(item_tag) as item_tag, unit_price, is_company, amount, expires_at, created_at
+)
+insert into "Sell_Orders" (user_id, server_id, item_tag, unit_price, is_company, amount, expires_at, created_at)
+select user_id, server_id, item_tag, unit_price, is_company, sum(amount), max(expires_at), min(created_at) from padded
+group by user_id, server_id, item_tag, unit_price, is_company
+on conflict (user_id, server_id, item_tag, unit_price, is_company) do update set amount = "Sell_Orders".amount + excluded.amount;
+
+
+-- Market rows are per item and server: a padded row is dropped if the trimmed row or an older padded one exists
+delete from "Market_Items" m
+where m.item_tag <> trim(m.item_tag)
+  and exists (
+      select 1 from "Market_Items" t
+      where t.server_id = m.server_id and trim(t.item_tag) = trim(m.item_tag) and t.ctid <> m.ctid
+        and (t.item_tag = trim(t.item_tag) or t.ctid < m.ctid)
+  );
+update "Market_Items" set item_tag = trim(item_tag) where item_tag <> trim(item_tag);
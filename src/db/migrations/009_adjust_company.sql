@@ -0,0 +1,12 @@
+-- update_company sends capital / taxes_owed changes as differences, so a /company buy and a /company deposit
+-- on the same company don't overwrite each other's capital (Companies has no version column like Players).
+-- Run this once in the Supabase SQL editor.
+
+create or replace function adjust_company(p_entrepreneur_id bigint, p_server_id bigint, p_capital float8, p_taxes_owed float8)
+returns setof "Companies" language sql as $$
+    update "Companies"
+    set capital = coalesce(capital, 0) + p_capital,
+        taxes_owed = coalesce(taxes_owed, 0) + p_taxes_owed
+    where entrepreneur_id = p_entrepreneur_id and server_id = p_server_id
+    returning *;
+$$;
@@ -1,11 +1,64 @@
-from datetime import datetime
+from datetime import datetime, date
 
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
 
-@dataclass
-class Player:
+@lru_cache(maxsize=None)
+def field_names(model) -> Tuple[str, ...]:
+    # fields() builds a new tuple on every call, the names of a model never change
+    return tuple(field.name for field in fields(model))
+
+
+class TrackedModel:
+    '''
+    Remembers the field values of the last load / write, so the updaters only send the columns that changed.
+    Objects without a snapshot (e.g. freshly created defaults) count as completely changed.
+    The snapshot is a tuple in field order. The models that are loaded in bulk are slots=True dataclasses,
+    so together with __slots__ here they don't carry an instance __dict__.
+    '''
+    __slots__ = ("_snapshot",)
+
+    def mark_clean(self):
+        self._snapshot = tuple(getattr(self, name) for name in field_names(type(self)))
+        return self
+
+    def changed_fields(self) -> List[str]:
+        names = field_names(type(self))
+        snapshot = getattr(self, "_snapshot", None)
+        if snapshot is None:
+            return list(names)
+        return [name for name, value in zip(names, snapshot) if getattr(self, name) != value]
+
+    def original(self, name: str):
+        '''
+        :return: Value of the field at the last load / write, None without snapshot
+        '''
+        snapshot = getattr(self, "_snapshot", None)
+        return snapshot[field_names(type(self)).index(name)] if snapshot is not None else None
+
+    def rebase(self, current, delta_fields):
+        '''
+        Puts the changes of this object on top of current, a fresh load of the same row.
+        Fields in delta_fields keep their difference to the loaded value, other changed fields overwrite.
+        '''
+        changes = {}
+        for name in self.changed_fields():
+            original = self.original(name)
+            if name in delta_fields and original is not None and getattr(current, name) is not None:
+                changes[name] = getattr(current, name) + (getattr(self, name) - original)
+            else:
+                changes[name] = getattr(self, name)
+        for name in field_names(type(self)):
+            setattr(self, name, getattr(current, name))
+        self.mark_clean()
+        for name, value in changes.items():
+            setattr(self, name, value)
+
+
+@dataclass(slots=True)
+class Player(TrackedModel):
     id: int
     server_id: int
     created_at: datetime
@@ -21,6 +74,7 @@ class Player:
     job_switch_cooldown_until: Optional[datetime]
     company_creation_cooldown_until: Optional[datetime]
     gift_cooldown_until: Optional[datetime]
+    version: int = 0  # Bumped by the database on every update, see update_player
 
 @dataclass
 class Item:
@@ -32,7 +86,7 @@ class Item:
     durability: Optional[int]
 
 @dataclass
-class Company:
+class Company(TrackedModel):
     entrepreneur_id: int
     server_id: int
     created_at: datetime
@@ -44,54 +98,68 @@ class Company:
     taxes_owed: float
 
 @dataclass
-class MarketItem:
+class MarketItem(TrackedModel):
     item_tag: str
     server_id: int
     min_price: float
     max_price: float
     stockpile: int
 
-@dataclass
-class PlayerItem:
+@dataclass(slots=True)
+class PlayerItem(TrackedModel):
     user_id: int
     item_tag: str
     server_id: int
     amount: int
     durability: Optional[int]
 
-@dataclass
-class CompanyItem:
+@dataclass(slots=True)
+class CompanyItem(TrackedModel):
     company_entrepreneur_id: int
     item_tag: str
     server_id: int
     amount: int
 
 @dataclass
-class CompanyJoinRequest:
+class CompanyJoinRequest(TrackedModel):
     user_id: int
     server_id: int
     company_entrepreneur_id: int
 
-@dataclass
-class BuyOrder:
+@dataclass(slots=True)
+class BuyOrder(TrackedModel):
     user_id: int
     item_tag: str
     server_id: int
     amount: int
     unit_price: float
     is_company: bool
+    expires_at: Optional[datetime] = None
 
-@dataclass
-class SellOrder:
+@dataclass(slots=True)
+class SellOrder(TrackedModel):
     user_id: int
     item_tag: str
     server_id: int
     amount: int
     unit_price: float
     is_company: bool
+    expires_at: Optional[datetime] = None
+
+@dataclass
+class OrderFill:
+    '''
+    One resting order that was (partially) filled by fill_buy_order / fill_sell_order.
+    user_id and is_company belong to the owner of the resting order.
+    '''
+    user_id: int
+    is_company: bool
+    amount: int
+    unit_price: float
+    total_price: float
 
 @dataclass
-class Government:
+class Government(TrackedModel):
     id: int
     created_at: datetime
     taxrate: float
@@ -102,7 +170,7 @@ class Government:
     gambling_pool: float
 
 @dataclass
-class GovernmentGDP:
+class GovernmentGDP(TrackedModel):
     server_id: int
-    date: datetime
+    date: date
     gdp_value: float
\ No newline at end of file
@@ -0,0 +1,191 @@
+import asyncio
+
+from copy import copy
+from datetime import datetime, timezone
+from itertools import count
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+from src.db.catalog import normalize_tag
+from src.db.models import BuyOrder, SellOrder, OrderFill
+from src.metrics import CACHE_LOOKUPS
+
+
+BUY = "buy"
+SELL = "sell"
+
+
+def side_of(order) -> str:
+    return BUY if isinstance(order, BuyOrder) else SELL
+
+
+class OrderBook:
+    '''
+    Resting buy and sell orders of one item on one server with price-time priority.
+    Bids are sorted highest price first, asks lowest price first, equal prices by arrival.
+    Orders are keyed like the tables: (side, user_id, unit_price, is_company).
+    '''
+    def __init__(self):
+        self._levels = {BUY: SortedList(), SELL: SortedList()}
+        self._orders: Dict[Tuple, BuyOrder | SellOrder] = {}
+        self._entries: Dict[Tuple, Tuple] = {}
+        self._seq = count()
+
+    @staticmethod
+    def _key(side, user_id, unit_price, is_company) -> Tuple:
+        return side, int(user_id), float(unit_price), bool(is_company)
+
+    def add(self, order: BuyOrder | SellOrder):
+        side = side_of(order)
+        key = self._key(side, order.user_id, order.unit_price, order.is_company)
+        if key in self._orders:
+            # Merged into an existing order, keeps its time priority
+            self._orders[key].amount = order.amount
+            self._orders[key].mark_clean()
+            return
+        price = order.unit_price if side == SELL else -order.unit_price
+        entry = (price, next(self._seq), key)
+        self._levels[side].add(entry)
+        self._entries[key] = entry
+        self._orders[key] = copy(order).mark_clean()
+
+    def update(self, order: BuyOrder | SellOrder):
+        key = self._key(side_of(order), order.user_id, order.unit_price, order.is_company)
+        if key not in self._orders:
+            return
+        if order.amount <= 0:
+            self._discard(key)
+        else:
+            self._orders[key].amount = order.amount
+            self._orders[key].mark_clean()
+
+    def remove(self, side: str, user_id: int, unit_price: Optional[float] = None):
+        '''
+        Same rows as delete_buy_orders / delete_sell_orders: every order of the user, optionally only at one price.
+        '''
+        for key in [key for key in self._orders if key[0] == side and key[1] == int(user_id)
+                    and (unit_price is None or key[2] == float(unit_price))]:
+            self._discard(key)
+
+    def cancel(self, order: BuyOrder | SellOrder):
+        key = self._key(side_of(order), order.user_id, order.unit_price, order.is_company)
+        if key in self._orders:
+            self._discard(key)
+
+    def apply_fills(self, side: str, fills: List[OrderFill]):
+        '''
+        :param side: Side of the resting orders the fills were taken from
+        '''
+        for fill in fills:
+            key = self._key(side, fill.user_id, fill.unit_price, fill.is_company)
+            order = self._orders.get(key)
+            if order is None:
+                continue
+            order.amount -= fill.amount
+            if order.amount <= 0:
+                self._discard(key)
+            else:
+                order.mark_clean()
+
+    def _discard(self, key: Tuple):
+        self._levels[key[0]].remove(self._entries.pop(key))
+        del self._orders[key]
+
+    @staticmethod
+    def _is_live(order, now: Optional[datetime]) -> bool:
+        # Naive timestamps (datetime.now()) are local time
+        return now is None or order.expires_at is None or order.expires_at > now.astimezone(timezone.utc)
+
+    def _live(self, side: str, now: Optional[datetime]):
+        for entry in self._levels[side]:
+            order = self._orders[entry[2]]
+            if self._is_live(order, now):
+                yield order
+
+    def best(self, side: str, now: Optional[datetime] = None) -> Optional[BuyOrder | SellOrder]:
+        order = next(self._live(side, now), None)
+        return copy(order) if order else None
+
+    def crosses(self, side: str, unit_price: float, now: Optional[datetime] = None) -> bool:
+        '''
+        :param side: Side of the resting orders, e.g. SELL for an incoming buy
+        :return: True if at least one resting order on that side can be matched at unit_price
+        '''
+        best = self.best(side, now)
+        if best is None:
+            return False
+        return best.unit_price <= unit_price if side == SELL else best.unit_price >= unit_price
+
+    def orders(self, side: str, unit_price: Optional[float] = None, now: Optional[datetime] = None) -> List[BuyOrder | SellOrder]:
+        '''
+        :param unit_price: Only the orders that cross this price
+        :param now: Leave out the orders that expired before this
+        :return: Copies of the orders in matching order
+        '''
+        result = []
+        for order in self._live(side, now):
+            if unit_price is not None and (order.unit_price > unit_price if side == SELL else order.unit_price < unit_price):
+                break
+            result.append(copy(order))
+        return result
+
+    def own(self, side: str, user_id: int, unit_price: float, is_company) -> List[BuyOrder | SellOrder]:
+        '''
+        :param is_company: True, False or "both"
+        '''
+        variants = [False, True] if is_company == "both" else [is_company]
+        keys = (self._key(side, user_id, unit_price, variant) for variant in variants)
+        return [copy(self._orders[key]) for key in keys if key in self._orders]
+
+
+class OrderBooks:
+    '''
+    Resident order books per (server_id, item_tag). A book is loaded from the order tables on first use
+    and afterwards kept up to date by the order write functions in db_calls (write-through).
+
+    :param loader: Coroutine function (server_id, item_tag) -> (buy orders, sell orders) in arrival order, or None on error
+    '''
+    def __init__(self, loader: Callable[[int, str], Awaitable[Optional[Tuple[List[BuyOrder], List[SellOrder]]]]]):
+        self._loader = loader
+        self._books: Dict[Tuple[int, str], OrderBook] = {}
+        self._locks: Dict[Tuple[int, str], asyncio.Lock] = {}
+        self._changed_while_loading = set()
+
+    async def get(self, server_id: int, item_tag: str) -> Optional[OrderBook]:
+        key = (int(server_id), normalize_tag(item_tag))
+        book = self._books.get(key)
+        if book is not None:
+            CACHE_LOOKUPS.inc("order_books", "hit")
+            return book
+
+        CACHE_LOOKUPS.inc("order_books", "miss")
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            if key in self._books:
+                return self._books[key]
+
+            self._changed_while_loading.discard(key)
+            orders = await self._loader(server_id, item_tag)
+            if orders is None:
+                return None
+
+            book = OrderBook()
+            for order in orders[0] + orders[1]:
+                book.add(order)
+
+            # A write landed while the query was running, the result may miss it. Use it once, load again next time
+            if key not in self._changed_while_loading:
+                self._books[key] = book
+            return book
+
+    def loaded(self, server_id: int, item_tag: str) -> Optional[OrderBook]:
+        '''
+        Book for the write-through hooks. Returns None if it isn't loaded, it picks the change up on load.
+        '''
+        key = (int(server_id), normalize_tag(item_tag))
+        if key in self._locks and self._locks[key].locked():
+            self._changed_while_loading.add(key)
+        return self._books.get(key)
+
+    def invalidate(self, server_id: int, item_tag: str):
+        self._books.pop((int(server_id), normalize_tag(item_tag)), None)
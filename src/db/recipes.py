@@ -0,0 +1,167 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.db.catalog import ItemCatalog, normalize_tag
+from src.db.models import Item
+
+
+def parse_ingredients(ingredients: Optional[str]) -> List[Tuple[str, int]]:
+    '''
+    "Wood:2, Iron:1" -> [("Wood", 2), ("Iron", 1)]. Broken entries are printed and skipped.
+    '''
+    result = []
+    for entry in (ingredients or "").split(","):
+        if not entry.strip():
+            continue
+        try:
+            tag, amount = entry.split(":")
+            result.append((tag.strip(), int(amount)))
+        except ValueError:
+            print(f"Invalid ingredient entry: {entry!r}")
+    return result
+
+
+def format_amounts(amounts: Iterable[Tuple[str, int]]) -> str:
+    return ", ".join(f"{amount}x {tag}" for tag, amount in amounts)
+
+
+@dataclass(frozen=True)
+class Recipe:
+    '''
+    :param ingredients: Direct ingredients per unit, in the order of the Items row
+    :param raw_materials: Full bill of materials per unit: the ingredients without a recipe of their own, summed over all levels.
+        None if the item is part of a recipe cycle
+    :param total_worksteps: Worksteps of the item plus those of all ingredients it needs to be produced from scratch
+    '''
+    item_tag: str
+    ingredients: Tuple[Tuple[str, int], ...]
+    worksteps: int
+    raw_materials: Optional[Tuple[Tuple[str, int], ...]]
+    total_worksteps: Optional[int]
+
+
+class RecipeBook:
+    '''
+    Recipe graph of the item catalog, built once per catalog load.
+    Ingredient tags are resolved to the catalog spelling, the bill of materials is precomputed for every item.
+    '''
+    def __init__(self, items: Iterable[Item]):
+        items = {normalize_tag(item.item_tag): item for item in items}
+        parsed = {key: parse_ingredients(item.ingredients) for key, item in items.items()}
+        self._graph: Dict[str, List[Tuple[str, int]]] = {
+            key: [(normalize_tag(tag), amount) for tag, amount in ingredients]
+            for key, ingredients in parsed.items() if ingredients
+        }
+
+        def spelling(key: str, fallback: str) -> str:
+            return items[key].item_tag if key in items else fallback
+
+        self._recipes: Dict[str, Recipe] = {}
+        cyclic = self._find_cycles()
+        raw_cache: Dict[str, Dict[str, int]] = {}
+        steps_cache: Dict[str, int] = {}
+        for key, ingredients in self._graph.items():
+            item = items[key]
+            raw_materials, total_worksteps = None, None
+            if key not in cyclic:
+                raw = self._raw_materials(key, raw_cache)
+                raw_materials = tuple((spelling(tag, tag), amount) for tag, amount in raw.items())
+                total_worksteps = self._total_worksteps(key, items, steps_cache)
+            self._recipes[key] = Recipe(
+                item_tag=item.item_tag,
+                ingredients=tuple(
+                    (spelling(tag, raw_tag), amount)
+                    for (tag, amount), (raw_tag, _) in zip(ingredients, parsed[key])
+                ),
+                worksteps=item.worksteps or 0,
+                raw_materials=raw_materials,
+                total_worksteps=total_worksteps,
+            )
+
+    def _find_cycles(self) -> set:
+        # Depth-first search, an edge back to an item on the current path closes a cycle
+        visiting, done, cyclic = set(), set(), set()
+
+        def visit(key: str, path: List[str]):
+            if key in done or key not in self._graph:
+                return
+            if key in visiting:
+                cycle = path[path.index(key):]
+                cyclic.update(cycle)
+                print(f"Recipe cycle: {' -> '.join(cycle + [key])}")
+                return
+            visiting.add(key)
+            path.append(key)
+            for ingredient, _ in self._graph[key]:
+                visit(ingredient, path)
+            path.pop()
+            visiting.discard(key)
+            done.add(key)
+
+        for key in self._graph:
+            visit(key, [])
+
+        # Everything that needs a cyclic item has no finite bill of materials either
+        changed = True
+        while changed:
+            changed = False
+            for key, ingredients in self._graph.items():
+                if key not in cyclic and any(ingredient in cyclic for ingredient, _ in ingredients):
+                    cyclic.add(key)
+                    changed = True
+        return cyclic
+
+    def _raw_materials(self, key: str, cache: Dict[str, Dict[str, int]]) -> Dict[str, int]:
+        if key in cache:
+            return cache[key]
+        raw = defaultdict(int)
+        for ingredient, amount in self._graph[key]:
+            if ingredient in self._graph:
+                for tag, raw_amount in self._raw_materials(ingredient, cache).items():
+                    raw[tag] += amount * raw_amount
+            else:
+                raw[ingredient] += amount
+        cache[key] = dict(raw)
+        return cache[key]
+
+    def _total_worksteps(self, key: str, items: Dict[str, Item], cache: Dict[str, int]) -> int:
+        if key in cache:
+            return cache[key]
+        total = items[key].worksteps or 0
+        for ingredient, amount in self._graph[key]:
+            if ingredient in self._graph:
+                total += amount * self._total_worksteps(ingredient, items, cache)
+        cache[key] = total
+        return total
+
+    def get(self, item_tag: str) -> Optional[Recipe]:
+        '''
+        :return: None for items without ingredients
+        '''
+        return self._recipes.get(normalize_tag(item_tag))
+
+    def __len__(self):
+        return len(self._recipes)
+
+
+class Recipes:
+    '''
+    The RecipeBook of the current item catalog, built again after every catalog (re)load.
+    '''
+    def __init__(self, catalog: ItemCatalog):
+        self._catalog = catalog
+        self._book: Optional[RecipeBook] = None
+        self._built_for: Optional[datetime] = None
+
+    async def book(self) -> RecipeBook:
+        if self._book is None or self._catalog.is_stale or self._built_for != self._catalog.loaded_at:
+            items = await self._catalog.all()
+            self._book = RecipeBook(items)
+            self._built_for = self._catalog.loaded_at
+            print(f"Recipe book built ({len(self._book)} recipes)")
+        return self._book
+
+    async def get(self, item_tag: str) -> Optional[Recipe]:
+        return (await self.book()).get(item_tag)
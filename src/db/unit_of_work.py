@@ -0,0 +1,138 @@
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from src.db.catalog import normalize_tag
+from src.db.instrumentation import ConflictError
+from src.db.models import Player, Company, PlayerItem, CompanyItem, GovernmentGDP
+
+
+_PRIMARY_KEYS = {
+    Player: ("id", "server_id"),
+    Company: ("entrepreneur_id", "server_id"),
+    PlayerItem: ("user_id", "server_id", "item_tag"),
+    CompanyItem: ("company_entrepreneur_id", "server_id", "item_tag"),
+    GovernmentGDP: ("server_id", "date"),
+}
+
+_current: ContextVar[Optional["UnitOfWork"]] = ContextVar("unit_of_work", default=None)
+
+
+def identity_key(model, *pk) -> Tuple:
+    def normalize(value):
+        if isinstance(value, date):
+            return value.isoformat()
+        if isinstance(value, str):
+            return normalize_tag(value)
+        return value
+    return (model,) + tuple(normalize(value) for value in pk)
+
+
+def _key_of(obj) -> Tuple:
+    return identity_key(type(obj), *(getattr(obj, field) for field in _PRIMARY_KEYS[type(obj)]))
+
+
+class UnitOfWork:
+    '''
+    Request-scoped identity map for the rows a command touches.
+    Every entity is loaded at most once, updates only mark it dirty and each dirty row is written once on flush().
+    '''
+    def __init__(self):
+        self._identity_map: Dict[Tuple, Any] = {}
+        self._dirty: Dict[Tuple, Tuple[Any, Callable[[Any], Awaitable]]] = {}
+        self.wrote_through = False  # An insert / delete already went to the database directly
+
+    def get(self, key: Tuple):
+        return self._identity_map.get(key)
+
+    def track(self, obj):
+        key = _key_of(obj)
+        return self._identity_map.setdefault(key, obj)
+
+    def mark_dirty(self, obj, write: Callable[[Any], Awaitable]):
+        key = _key_of(obj)
+        self._identity_map[key] = obj
+        self._dirty[key] = (obj, write)
+
+    def forget(self, key: Tuple):
+        self._identity_map.pop(key, None)
+        self._dirty.pop(key, None)
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, {}
+        conflict = None
+        for obj, write in dirty.values():
+            try:
+                await write(obj)
+            except ConflictError as e:
+                # The other rows are still written, the command stops afterwards
+                conflict = conflict or e
+        if conflict:
+            raise conflict
+
+
+@asynccontextmanager
+async def unit_of_work():
+    '''
+    Collects the writes of everything awaited inside the block and flushes them at the end.
+    If the block raises, the pending writes are dropped, unless an insert / delete of the block already went through:
+    then they are flushed as well, so the command isn't left half applied (e.g. items added, but no cooldown).
+    '''
+    uow = _current.get()
+    if uow is not None:
+        # Nested: the outer unit of work flushes
+        yield uow
+        return
+
+    uow = UnitOfWork()
+    token = _current.set(uow)
+    completed = False
+    try:
+        yield uow
+        completed = True
+    finally:
+        _current.reset(token)
+        if completed or uow.wrote_through:
+            await uow.flush()
+
+
+def tracked(model, *pk):
+    uow = _current.get()
+    return uow.get(identity_key(model, *pk)) if uow else None
+
+
+def track(obj):
+    '''
+    Returns the instance the current unit of work already holds for this row, so every loader hands out the same object.
+    '''
+    uow = _current.get()
+    if uow is None or type(obj) not in _PRIMARY_KEYS:
+        return obj
+    return uow.track(obj)
+
+
+def defer_write(obj, write: Callable[[Any], Awaitable]) -> bool:
+    '''
+    :return: True if a unit of work is active and took over the write
+    '''
+    uow = _current.get()
+    if uow is None or type(obj) not in _PRIMARY_KEYS:
+        return False
+    uow.mark_dirty(obj, write)
+    return True
+
+
+def forget(model, *pk):
+    uow = _current.get()
+    if uow:
+        uow.forget(identity_key(model, *pk))
+
+
+def wrote_through():
+    '''
+    Marks that the current command wrote to the database directly (insert / delete), see unit_of_work()
+    '''
+    uow = _current.get()
+    if uow:
+        uow.wrote_through = True
@@ -4,6 +4,7 @@ from math import floor
 
 from src.db.models import Player, MarketItem, PlayerItem, CompanyItem, Government, GovernmentGDP, BuyOrder, SellOrder
 from src.db.db_calls import get_item
+from src.config import BUY_ORDER_DURATION, SELL_ORDER_DURATION
 
 def get_default_player(id, server_id):
     return Player(
@@ -31,16 +32,19 @@ async def get_default_player_item(user_id, server_id, item_tag, amount=1):
     return PlayerItem(
             user_id=user_id,
             server_id=server_id,
-            item_tag=item_tag,
+            item_tag=item.item_tag,
             amount=amount,
             durability=item.durability
         )
 
-def get_default_company_item(user_id, server_id, item_tag, amount=1):
+async def get_default_company_item(user_id, server_id, item_tag, amount=1):
+    item = await get_item(item_tag)
+    if not item:
+        raise Exception(f"{item_tag} not found")
     return CompanyItem(
             company_entrepreneur_id=user_id,
             server_id=server_id,
-            item_tag=item_tag,
+            item_tag=item.item_tag,
             amount=amount
         )
 
@@ -79,7 +83,8 @@ def get_default_buy_order(user_id, item_tag, server_id, amount, unit_price, is_c
         server_id=server_id,
         amount=amount,
         unit_price=unit_price,
-        is_company=is_company
+        is_company=is_company,
+        expires_at=datetime.datetime.now(datetime.timezone.utc) + BUY_ORDER_DURATION
     )
 
 def get_default_sell_order(user_id, item_tag, server_id, amount, unit_price, is_company):
@@ -89,5 +94,6 @@ def get_default_sell_order(user_id, item_tag, server_id, amount, unit_price, is_
         server_id=server_id,
         amount=amount,
         unit_price=unit_price,
-        is_company=is_company
+        is_company=is_company,
+        expires_at=datetime.datetime.now(datetime.timezone.utc) + SELL_ORDER_DURATION
     )
\ No newline at end of file
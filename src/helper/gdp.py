@@ -0,0 +1,72 @@
+import asyncio
+
+from collections import defaultdict
+from datetime import date
+from typing import Dict, List, Tuple
+
+from discord.ext import tasks
+
+from src.config import GDP_FLUSH_INTERVAL
+from src.db.db_calls import increment_gdp
+
+
+class GdpAccumulator:
+    '''
+    Sums up GDP increments in memory per (server_id, day) and writes each sum with one atomic increment on flush().
+    Saves the read + insert/update of Government_GDP on every wage and sale.
+    The sums only live in memory: a hard crash loses up to GDP_FLUSH_INTERVAL of GDP, a normal shutdown flushes everything.
+    '''
+    def __init__(self, increment):
+        self._increment = increment
+        self._pending: Dict[Tuple[int, date], float] = defaultdict(float)
+        # Amounts of the running flush, still counted by pending() until they are written
+        self._flushing: Dict[Tuple[int, date], float] = {}
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._pending) + len(self._flushing)
+
+    def add(self, server_id: int, amount: float, day: date = None):
+        self._pending[(int(server_id), day or date.today())] += amount
+
+    def pending(self, server_id: int, day: date) -> float:
+        key = (int(server_id), day)
+        return self._pending.get(key, 0.0) + self._flushing.get(key, 0.0)
+
+    def with_pending(self, server_id: int, entries, since: date) -> List[Tuple[date, float]]:
+        '''
+        :param entries: GovernmentGDP rows from the database
+        :return: (day, gdp) sorted by day, including the amounts that are not written yet
+        '''
+        by_day = defaultdict(float)
+        for entry in entries:
+            by_day[date.fromisoformat(str(entry.date)[:10])] += entry.gdp_value
+        for key in set(self._pending) | set(self._flushing):
+            if key[0] == int(server_id) and key[1] >= since:
+                by_day[key[1]] += self.pending(*key)
+        return sorted(by_day.items())
+
+    async def flush(self):
+        '''
+        Writes every pending sum. Sums that failed, or weren't sent because the flush was cancelled,
+        go back to pending for the next flush.
+        '''
+        async with self._lock:
+            self._flushing, self._pending = self._pending, defaultdict(float)
+            try:
+                for key in list(self._flushing):
+                    if await self._increment(*key, self._flushing[key]):
+                        del self._flushing[key]
+            finally:
+                for key, amount in self._flushing.items():
+                    self._pending[key] += amount
+                self._flushing = {}
+
+
+gdp_accumulator = GdpAccumulator(increment_gdp)
+
+
+@tasks.loop(seconds=GDP_FLUSH_INTERVAL.total_seconds())
+async def gdp_flusher():
+    # Cancelling the loop on shutdown doesn't interrupt a running flush, the next flush() waits for it on the lock
+    await asyncio.shield(gdp_accumulator.flush())
@@ -4,14 +4,29 @@ from typing import List
 from random import randint
 
 from src.db.db_calls import get_player, add_object, get_company, update_player, update_company
+from src.db.unit_of_work import unit_of_work
 from src.helper.defaults import get_default_player
-from src.helper.player_checks import check_if_employed_multiple, check_if_on_cooldown, get_tool, check_hunger_thirst_bar
+from src.db.catalog import normalize_tag
+from src.helper.player_checks import check_if_employed_multiple, check_if_on_cooldown, get_tool, check_hunger_thirst_bar, \
+    probe_job_tools
 from src.helper.randoms import generate_resources, generate_rare_resources
 from src.helper.item import use_item, add_player_item, add_company_item
 from src.helper.embed_creators import create_job_embed
 from src.helper.transactions import add_owed_taxes
 
 async def execute_job(interaction: Interaction, job_name: str, job_items: List[List[str]], err_message: str, resource_choices: List[str], job_verb: str):
+    # Everything the job loads is kept in one unit of work, so each changed row is written once at the end.
+    # The result is only sent after that, a failing Discord call can't cost the job its writes
+    async with unit_of_work():
+        embed = await work_job(interaction, job_name, job_items, err_message, resource_choices, job_verb)
+    if embed:
+        await interaction.followup.send(embed=embed)
+
+
+async def work_job(interaction: Interaction, job_name: str, job_items: List[List[str]], err_message: str, resource_choices: List[str], job_verb: str):
+    '''
+    :return: Embed with the result of the job, None if a check failed (the check already answered)
+    '''
     user_id = int(interaction.user.id)
     server_id = int(interaction.guild.id)
 
@@ -23,7 +38,9 @@ async def execute_job(interaction: Interaction, job_name: str, job_items: List[L
 
     if await check_if_employed_multiple(interaction, player, [job_name, "Worker"]): return
 
-    tool = await get_tool(interaction, player, job_items, err_message)
+    held_items = await probe_job_tools(player, job_items)
+
+    tool = await get_tool(interaction, player, job_items, err_message, held_items)
     if not tool: return
 
     if player.job == "Worker":
@@ -52,7 +69,8 @@ async def execute_job(interaction: Interaction, job_name: str, job_items: List[L
     else:
         resource, amount = generate_resources(resource_choices, tool)
 
-    durability = await use_item(user_id, server_id, tool)
+    tool_item = held_items.get(normalize_tag(tool))
+    durability = await use_item(user_id, server_id, tool, tool_item) if tool_item else None
 
 
     if player.job == "Worker":
@@ -68,5 +86,4 @@ async def execute_job(interaction: Interaction, job_name: str, job_items: List[L
     else:
         await add_player_item(user_id, server_id, resource, amount)
 
-    embed = create_job_embed(player, resource, amount, durability, old_hunger, old_thirst, tool, job_verb)
-    await interaction.followup.send(embed=embed)
\ No newline at end of file
+    return create_job_embed(player, resource, amount, durability, old_hunger, old_thirst, tool, job_verb)
@@ -1,16 +1,28 @@
 
 
 from src.db.models import PlayerItem
-from src.db.db_calls import get_player_item, get_item, get_company_item, delete_player_item, update_player_item, \
-    add_object, update_company_item
+from src.db.db_calls import get_player_item, get_player_items, get_item, get_company_item, delete_player_item, \
+    update_player_item, add_object, update_company_item, delete_company_item
 from src.helper.defaults import get_default_player_item, get_default_company_item
 
 async def has_player_item(user_id, server_id, item_tag, min_amount=1):
     return await get_player_item(user_id, server_id, item_tag, min_amount) is not None
 
 
-async def use_item(user_id, server_id, item_tag):
-    player_item = await get_player_item(user_id, server_id, item_tag)
+async def probe_player_items(user_id, server_id, item_tags, min_amount=1):
+    '''
+    Checks in a single query which of the given items the player holds at least min_amount times.
+    :return: Dict of normalized item tag -> PlayerItem for every item the player holds
+    '''
+    return await get_player_items(user_id, server_id, item_tags, min_amount) or {}
+
+
+async def use_item(user_id, server_id, item_tag, player_item: PlayerItem = None):
+    '''
+    :param player_item: The already loaded item, saves fetching it again
+    '''
+    if player_item is None:
+        player_item = await get_player_item(user_id, server_id, item_tag)
 
     if not player_item:
         return None
@@ -60,7 +72,7 @@ async def add_company_item(user_id, server_id, item_tag, amount):
         company_item.amount += amount
         await update_company_item(company_item)
     else:
-        company_item = get_default_company_item(user_id, server_id, item_tag, amount)
+        company_item = await get_default_company_item(user_id, server_id, item_tag, amount)
         await add_object(company_item, "Company_Items")
 
 async def remove_player_item(user_id: int, server_id: int, item_tag: str, amount: int = 1):
@@ -70,9 +82,27 @@ async def remove_player_item(user_id: int, server_id: int, item_tag: str, amount
         return False  # Item nicht vorhanden
 
     if player_item.amount < amount:
-        raise Exception(f"The amount of {item_tag} ({player_item.amout}) is not enough to remove {amount}x")
+        raise Exception(f"The amount of {item_tag} ({player_item.amount}) is not enough to remove {amount}x")
 
     player_item.amount -= amount
 
     if player_item.amount <= 0:
-        await delete_player_item(player_item.user_id, player_item.item_tag, player_item.server_id)
\ No newline at end of file
+        await delete_player_item(player_item.user_id, player_item.item_tag, player_item.server_id)
+    else:
+        await update_player_item(player_item)
+
+async def remove_company_item(user_id: int, server_id: int, item_tag: str, amount: int = 1):
+    company_item = await get_company_item(user_id, server_id, item_tag)
+
+    if not company_item:
+        return False  # Item nicht vorhanden
+
+    if company_item.amount < amount:
+        raise Exception(f"The company's amount of {item_tag} ({company_item.amount}) is not enough to remove {amount}x")
+
+    company_item.amount -= amount
+
+    if company_item.amount <= 0:
+        await delete_company_item(company_item.company_entrepreneur_id, company_item.item_tag, company_item.server_id)
+    else:
+        await update_company_item(company_item)
@@ -0,0 +1,23 @@
+from src.db.db_calls import add_market_items, item_catalog
+from src.helper.defaults import get_default_market_item
+
+
+# Servers whose market this process already initialized
+initialized_servers = set()
+
+
+async def ensure_market_initialized(server_id: int, force: bool = False):
+    '''
+    Creates the Market_Items rows of all items for a server with one bulk upsert.
+    Existing rows are left untouched, so concurrent calls and restarts can't duplicate or reset them.
+    :param force: Run again even if this server was already initialized, e.g. after new items were added
+    '''
+    server_id = int(server_id)
+    if server_id in initialized_servers and not force:
+        return
+
+    items = await item_catalog.all()
+    market_items = [get_default_market_item(item, server_id) for item in items]
+
+    if await add_market_items(market_items) is not None:
+        initialized_servers.add(server_id)
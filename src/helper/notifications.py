@@ -0,0 +1,90 @@
+import asyncio
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from discord import Client, Embed, Color, Forbidden, NotFound
+
+from src.config import DM_BATCH_WINDOW, DM_SEND_INTERVAL
+
+LINES_PER_DM = 20
+_STOP = object()  # Put into the queue by close(), the worker sends what it has and ends
+
+
+class DmQueue:
+    '''
+    DMs about filled orders go through this queue instead of being sent by the trading command.
+    The worker waits DM_BATCH_WINDOW for more fills, sends everything for one user and title as one DM
+    and leaves DM_SEND_INTERVAL between DMs. discord.py additionally waits out 429s.
+    '''
+    def __init__(self, batch_window: float, send_interval: float):
+        self._batch_window = batch_window
+        self._send_interval = send_interval
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._client: Optional[Client] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def start(self, client: Client):
+        self._client = client
+        self._worker = asyncio.create_task(self._run())
+
+    def enqueue(self, user_id: int, title: str, line: str):
+        self._queue.put_nowait((int(user_id), title, line))
+
+    def _drain(self, first) -> Tuple[Dict[Tuple[int, str], List[str]], bool]:
+        '''
+        :return: Lines per (user_id, title) and whether close() asked the worker to stop
+        '''
+        batches, stop = defaultdict(list), False
+        entries = [first]
+        while not self._queue.empty():
+            entries.append(self._queue.get_nowait())
+        for entry in entries:
+            if entry is _STOP:
+                stop = True
+            else:
+                batches[entry[:2]].append(entry[2])
+        return batches, stop
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if first is not _STOP:
+                await asyncio.sleep(self._batch_window)
+            batches, stop = self._drain(first)
+            for (user_id, title), lines in batches.items():
+                await self._send(user_id, title, lines)
+                await asyncio.sleep(self._send_interval)
+            if stop:
+                return
+
+    async def _send(self, user_id: int, title: str, lines: List[str]):
+        try:
+            user = self._client.get_user(user_id) or await self._client.fetch_user(user_id)
+            for start in range(0, len(lines), LINES_PER_DM):
+                await user.send(embed=Embed(
+                    title=title,
+                    description="\n".join(lines[start:start + LINES_PER_DM]),
+                    color=Color.green()
+                ))
+        except (Forbidden, NotFound):
+            pass  # DMs closed or user gone
+        except Exception as e:
+            # Keep the worker alive, the DM is lost
+            print(f"DM to {user_id} failed: {e}")
+
+    async def close(self):
+        '''
+        Lets the worker send everything that is queued or in its hands and waits for it, call it before the client closes.
+        '''
+        if self._worker is None:
+            return
+        worker, self._worker = self._worker, None
+        self._queue.put_nowait(_STOP)
+        await worker
+
+
+dm_queue = DmQueue(DM_BATCH_WINDOW.total_seconds(), DM_SEND_INTERVAL.total_seconds())
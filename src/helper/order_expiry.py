@@ -0,0 +1,18 @@
+from discord.ext import tasks
+
+from src.config import ORDER_SWEEP_INTERVAL
+from src.db.db_calls import expire_orders
+
+
+@tasks.loop(seconds=ORDER_SWEEP_INTERVAL.total_seconds())
+async def order_sweeper():
+    '''
+    Removes expired buy and sell orders in bulk, so matching and the order books only ever see live orders.
+    Items of expired sell orders go back to their owner.
+    '''
+    buy_orders, sell_orders = await expire_orders()
+
+    if buy_orders or sell_orders:
+        refunded = sum(order.amount for order in sell_orders)
+        print(f"Expired {len(buy_orders)} buy orders and {len(sell_orders)} sell orders ({refunded} items returned)")
+
@@ -1,38 +1,74 @@
-from discord import Interaction, Embed, Color, ui, ButtonStyle
+import asyncio
+
+from collections import OrderedDict
+
+from discord import Interaction, Embed, ui, ButtonStyle
 
 class Paginator(ui.View):
-    def __init__(self, get_page_embed, query_result):
+    '''
+    Only loads the page that is shown, prefetches the next one in the direction the user is paging
+    and keeps the last few pages, so going back and forth doesn't query again.
+
+    :param get_page_embed: (page, items of the page, max_page) -> Embed
+    :param fetch_page: Coroutine function (offset, limit) -> items, e.g. a ranged query
+    :param total: Number of items over all pages
+    '''
+    def __init__(self, get_page_embed, fetch_page, total, items_per_page=5, cached_pages=5):
         super().__init__(timeout=60)
         self.page = 0
         self.get_page_embed = get_page_embed
-        self.items_per_page = 5
-        self.max_page = (len(query_result) - 1) // self.items_per_page
-        self.query_result = query_result
+        self.fetch_page = fetch_page
+        self.items_per_page = items_per_page
+        self.max_page = max(0, (total - 1) // self.items_per_page)
+        self.cached_pages = cached_pages
+        self._pages = OrderedDict()
+        self._direction = 1
+
+    def _load(self, page):
+        if page not in self._pages:
+            self._pages[page] = asyncio.ensure_future(self.fetch_page(page * self.items_per_page, self.items_per_page))
+            while len(self._pages) > self.cached_pages:
+                self._pages.popitem(last=False)
+        self._pages.move_to_end(page)
+        return self._pages[page]
+
+    async def page_embed(self) -> Embed:
+        try:
+            items = await self._load(self.page)
+        except Exception:
+            # Don't keep the failed page around, the next click tries again
+            self._pages.pop(self.page, None)
+            raise
+
+        prefetch = self.page + self._direction
+        if 0 <= prefetch <= self.max_page:
+            self._load(prefetch)
+            # Keep the shown page the most recently used one
+            if self.page in self._pages:
+                self._pages.move_to_end(self.page)
+
+        return self.get_page_embed(self.page, items, self.max_page)
+
+    async def show(self, interaction_btn: Interaction, page):
+        if page == self.page:
+            await interaction_btn.response.defer()
+            return
+        self._direction = 1 if page > self.page else -1
+        self.page = page
+        await interaction_btn.response.edit_message(embed=await self.page_embed(), view=self)
 
     @ui.button(label="⏮️", style=ButtonStyle.secondary)
     async def first(self, interaction_btn: Interaction, _):
-        self.page = 0
-        await interaction_btn.response.edit_message(embed=self.get_page_embed(self.page, self.query_result, self.items_per_page, self.max_page), view=self)
+        await self.show(interaction_btn, 0)
 
     @ui.button(label="⬅️", style=ButtonStyle.primary)
     async def previous(self, interaction_btn: Interaction, _):
-        if self.page > 0:
-            self.page -= 1
-            await interaction_btn.response.edit_message(embed=self.get_page_embed(self.page, self.query_result, self.items_per_page, self.max_page), view=self)
-        else:
-            await interaction_btn.response.defer()
+        await self.show(interaction_btn, max(0, self.page - 1))
 
     @ui.button(label="➡️", style=ButtonStyle.primary)
     async def next(self, interaction_btn: Interaction, _):
-        if self.page < self.max_page:
-            self.page += 1
-            await interaction_btn.response.edit_message(embed=self.get_page_embed(self.page, self.query_result, self.items_per_page, self.max_page), view=self)
-        else:
-            await interaction_btn.response.defer()
+        await self.show(interaction_btn, min(self.max_page, self.page + 1))
 
     @ui.button(label="⏭️", style=ButtonStyle.secondary)
     async def last(self, interaction_btn: Interaction, _):
-        self.page = self.max_page
-        await interaction_btn.response.edit_message(embed=self.get_page_embed(self.page, self.query_result, self.items_per_page, self.max_page), view=self)
-
-
+        await self.show(interaction_btn, self.max_page)
@@ -4,7 +4,8 @@ from datetime import datetime
 from typing import List
 
 from src.db.db_calls import update_player
-from src.helper.item import has_player_item
+from src.db.catalog import normalize_tag
+from src.helper.item import probe_player_items
 from src.helper.randoms import get_hunger_depletion, get_thirst_depletion
 from src.config import WORK_COOLDOWN
 
@@ -55,19 +56,31 @@ async def check_if_on_cooldown(interaction, player):
 
     return False
 
-async def get_tool(interaction, player, items, err_message):
+HAND_TOOLS = ["F", "W", "N", "P"]
+
+def get_job_tools(player, items):
     # Aufbau items: List[List[str]] -> the first sublist is for miners, lumberjacks, etc; the second sublist for workers
-    if player.job == "Worker":
-        items = items[1]
-    else:
-        items = items[0]
+    return items[1] if player.job == "Worker" else items[0]
+
+async def probe_job_tools(player, items):
+    # One inventory query answers which of the job's tools the player owns
+    tools = [item for item in get_job_tools(player, items) if item not in HAND_TOOLS]
+    return await probe_player_items(player.id, player.server_id, tools)
+
+async def get_tool(interaction, player, items, err_message, held_items=None):
+    '''
+    :param held_items: Result of probe_job_tools. If None, the inventory is probed here
+    '''
+    if held_items is None:
+        held_items = await probe_job_tools(player, items)
+    items = get_job_tools(player, items)
 
     tool = None
     for item in items:
-        if item == "F" or item == "W" or item == "N" or item == "P":
+        if item in HAND_TOOLS:
             tool = f"Hand-{item}"
             continue
-        if await has_player_item(player.id, player.server_id, item, min_amount=1): tool = item
+        if normalize_tag(item) in held_items: tool = item
 
     if not tool:
         await interaction.followup.send(embed=Embed(
@@ -0,0 +1,39 @@
+import asyncio
+
+from functools import wraps
+from weakref import WeakValueDictionary
+
+from discord import Interaction
+
+
+class PlayerLocks:
+    '''
+    One asyncio.Lock per (server_id, user_id), so the commands of one user run one after another in this process.
+    A lock disappears once nobody holds or waits for it.
+    '''
+    def __init__(self):
+        self._locks = WeakValueDictionary()
+
+    def __call__(self, server_id: int, user_id: int) -> asyncio.Lock:
+        key = (int(server_id), int(user_id))
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+
+player_locks = PlayerLocks()
+
+
+def locks_player(command):
+    '''
+    Runs the command under the lock of the user that invoked it. Put it directly above the function,
+    below the app_commands decorators. Don't nest commands that use it, the lock isn't reentrant.
+    '''
+    @wraps(command)
+    async def wrapper(*args, **kwargs):
+        interaction = next(arg for arg in args if isinstance(arg, Interaction))
+        async with player_locks(interaction.guild.id, interaction.user.id):
+            return await command(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import os
+import uuid
+
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, Tuple
+
+from discord.ext import tasks
+
+from src.config import TAX_JOURNAL_PATH, TAX_SETTLE_INTERVAL
+from src.db.db_calls import settle_taxes
+
+
+class TaxLedger:
+    '''
+    Append-only record of accrued taxes. add_owed_taxes only appends an entry (memory + journal file),
+    settle() folds everything into taxes_owed with one batch write instead of one player / company update per income.
+
+    The journal survives a crash, recover() reads it again on startup. A batch is written to its own file
+    with an id before it is sent, so after a crash it is sent again with the same id and the database skips it if it was applied already.
+
+    :param settle: Coroutine function (batch_id, entries) -> True on success
+    '''
+    def __init__(self, settle, journal_path: str):
+        self._settle = settle
+        self._journal_path = journal_path
+        self._batch_path = journal_path + ".settling"
+        self._journal = None
+        self._pending: Dict[Tuple[int, int, bool], float] = defaultdict(float)
+        self._batch_id = None
+        self._batch: Dict[Tuple[int, int, bool], float] = {}
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._pending) + len(self._batch)
+
+    @staticmethod
+    def _read(path):
+        entries, batch_id = defaultdict(float), None
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Halb geschriebene Zeile vom Absturz
+                if "batch_id" in entry:
+                    batch_id = entry["batch_id"]
+                else:
+                    entries[(entry["server_id"], entry["user_id"], entry["is_company"])] += entry["amount"]
+        return entries, batch_id
+
+    def recover(self):
+        if os.path.exists(self._batch_path):
+            self._batch, self._batch_id = self._read(self._batch_path)
+        if os.path.exists(self._journal_path):
+            # A batch id in the journal means it crashed before the batch was moved out, nothing was sent yet
+            self._pending, _ = self._read(self._journal_path)
+        self._journal = open(self._journal_path, "a")
+        if self._journal.tell() and not self._ends_with_newline():
+            # Finish the half written line, otherwise the next entry would be glued to it and skipped too
+            self._journal.write("\n")
+            self._journal.flush()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self._journal_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _append(self, entry: dict):
+        if self._journal is None:
+            self.recover()
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()
+
+    def accrue(self, server_id: int, user_id: int, is_company: bool, amount: float):
+        server_id, user_id, is_company = int(server_id), int(user_id), bool(is_company)
+        self._append({"server_id": server_id, "user_id": user_id, "is_company": is_company, "amount": amount})
+        self._pending[(server_id, user_id, is_company)] += amount
+
+    def pending(self, server_id: int, user_id: int, is_company: bool) -> float:
+        key = (int(server_id), int(user_id), bool(is_company))
+        return self._pending.get(key, 0.0) + self._batch.get(key, 0.0)
+
+    def pending_for_server(self, server_id: int) -> Dict[Tuple[int, bool], float]:
+        '''
+        :return: (user_id, is_company) -> taxes that are not in taxes_owed yet
+        '''
+        result = defaultdict(float)
+        for accrued in (self._pending, self._batch):
+            for (entry_server_id, user_id, is_company), amount in accrued.items():
+                if entry_server_id == int(server_id):
+                    result[(user_id, is_company)] += amount
+        return result
+
+    def _start_batch(self):
+        # The batch id goes into the journal before the rename, so the batch file always has it
+        self._batch_id = str(uuid.uuid4())
+        self._append({"batch_id": self._batch_id})
+        self._journal.close()
+        os.replace(self._journal_path, self._batch_path)
+        self._journal = open(self._journal_path, "a")
+        self._batch, self._pending = self._pending, defaultdict(float)
+
+    async def _settle_locked(self):
+        if self._batch_id is None:
+            if not self._pending:
+                return
+            self._start_batch()
+
+        entries = [
+            {"server_id": server_id, "user_id": user_id, "is_company": is_company, "amount": round(amount, 2)}
+            for (server_id, user_id, is_company), amount in self._batch.items()
+        ]
+        if not await self._settle(self._batch_id, entries):
+            # Same batch with the same id next time
+            return
+
+        os.remove(self._batch_path)
+        self._batch_id, self._batch = None, {}
+
+    async def settle(self):
+        async with self._lock:
+            await self._settle_locked()
+
+    @asynccontextmanager
+    async def settled(self):
+        '''
+        Settles everything and keeps further settlements out until the block is done,
+        e.g. while taxes_owed is read and written back by /tax pay.
+        '''
+        async with self._lock:
+            await self._settle_locked()
+            yield
+
+    async def close(self):
+        await self.settle()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+tax_ledger = TaxLedger(settle_taxes, TAX_JOURNAL_PATH)
+
+
+@tasks.loop(seconds=TAX_SETTLE_INTERVAL.total_seconds())
+async def tax_settler():
+    await tax_ledger.settle()
@@ -0,0 +1,88 @@
+import asyncio
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from discord import Client, Guild, NotFound, HTTPException
+
+from src.config import USER_NAME_CACHE_SIZE, USER_NAME_TTL, USER_FETCH_CONCURRENCY
+
+
+class UserNameCache:
+    '''
+    Display names for user ids, for embeds that list many users (leaderboard, marketinfo, tax view, ...).
+    Looks in the guild's member cache first, then in an LRU cache with TTL,
+    and only fetches the rest from Discord, at most max_fetches at the same time.
+    '''
+    def __init__(self, max_size: int, ttl, max_fetches: int):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._names: OrderedDict[int, tuple] = OrderedDict()
+        self._fetch_limit = asyncio.Semaphore(max_fetches)
+        self._pending: Dict[int, asyncio.Future] = {}
+
+        self.member_hits = 0
+        self.cache_hits = 0
+        self.fetches = 0
+        self.failed_fetches = 0
+
+    def _cached(self, user_id: int) -> Optional[str]:
+        entry = self._names.get(user_id)
+        if entry is None:
+            return None
+        name, expires_at = entry
+        if expires_at < datetime.now():
+            del self._names[user_id]
+            return None
+        self._names.move_to_end(user_id)
+        return name
+
+    def _remember(self, user_id: int, name: str):
+        self._names[user_id] = (name, datetime.now() + self._ttl)
+        self._names.move_to_end(user_id)
+        while len(self._names) > self._max_size:
+            self._names.popitem(last=False)
+
+    async def _fetch(self, client: Client, user_id: int) -> str:
+        async with self._fetch_limit:
+            self.fetches += 1
+            try:
+                user = await client.fetch_user(user_id)
+                name = user.display_name
+            except NotFound:
+                # Deleted account, remember that as well
+                name = f"User {user_id}"
+            except HTTPException as e:
+                print(e)
+                self.failed_fetches += 1
+                return f"User {user_id}"
+        self._remember(user_id, name)
+        return name
+
+    async def get(self, client: Client, user_id: int, guild: Guild = None) -> str:
+        user_id = int(user_id)
+
+        member = guild.get_member(user_id) if guild else None
+        if member:
+            self.member_hits += 1
+            return member.display_name
+
+        name = self._cached(user_id)
+        if name is not None:
+            self.cache_hits += 1
+            return name
+
+        # Several renderers may ask for the same user at once, fetch it only once
+        if user_id not in self._pending:
+            self._pending[user_id] = asyncio.ensure_future(self._fetch(client, user_id))
+            self._pending[user_id].add_done_callback(lambda _: self._pending.pop(user_id, None))
+        return await asyncio.shield(self._pending[user_id])
+
+    async def get_many(self, client: Client, user_ids: Iterable[int], guild: Guild = None) -> Dict[int, str]:
+        user_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids))
+        names = await asyncio.gather(*(self.get(client, user_id, guild) for user_id in user_ids))
+        return dict(zip(user_ids, names))
+
+
+user_names = UserNameCache(USER_NAME_CACHE_SIZE, USER_NAME_TTL, USER_FETCH_CONCURRENCY)
@@ -1,8 +1,8 @@
 import discord
 from discord.ext import commands
 from discord.ext.commands import Bot
-from discord import app_commands, Embed, Interaction, User, ButtonStyle, Member
-from discord.ui import Button, View, button
+from discord import app_commands, Embed, Interaction, User, Member
+from discord.ui import Button
 from discord.app_commands import Choice
 from fastapi import FastAPI
 from fastapi.responses import PlainTextResponse
@@ -19,24 +19,39 @@ from time import time
 
 
 from src.commands import ping, get_items, stats, job, chop, mine, farm, harvest, drink, eat, consume, buy, sell, subsidize, sponsor, roulette
-from src.db.models import Player, PlayerItem, Item, MarketItem, BuyOrder, SellOrder, Company, Government, CompanyItem, CompanyJoinRequest, GovernmentGDP
+from src.db.models import Player, PlayerItem, Item, MarketItem, Company, Government, CompanyItem, CompanyJoinRequest, GovernmentGDP
 from src.config import TOKEN, GUILD_ID, JOB_SWITCH_COOLDOWN, WORK_COOLDOWN, BUY_ORDER_DURATION, SELL_ORDER_DURATION, GIFT_COOLDOWN, PORT
 from src.commands import order_view, order_remove
-from src.db.db_calls import (get_item, get_company, get_buy_orders, get_market_item, get_all_items, get_player, \
-                             get_own_sell_orders, get_own_buy_orders, get_sell_orders, get_employees,
+from src.db.catalog import normalize_tag
+from src.db.recipes import format_amounts
+from src.db.db_calls import (get_item, get_company, get_market_item, get_player, \
+                             get_own_sell_orders, get_own_buy_orders, get_employees,
                              get_company_inventory, \
-                             get_producible_items, get_company_item, get_user_join_request, get_item_buy_orders,
+                             get_producible_items, get_company_item, get_company_items, get_user_join_request, get_item_buy_orders,
                              get_item_sell_orders, \
                              get_government, get_tax_owing_players, get_tax_owing_companies, get_all_gdp_entries,
-                             get_join_requests, fire_employees, get_all_companies, get_all_players, \
+                             get_join_requests, fire_employees, \
                              get_player_item, update_player, update_buy_order, update_company, update_company_item,
                              update_company_join_request, delete_company, \
                              update_government, update_government_gdp, update_market_item, update_player_item,
-                             update_sell_order, delete_company_item, delete_buy_orders, add_object, delete_sell_orders, delete_join_requests, delete_player_item)
-from src.helper.defaults import get_default_market_item, get_default_player, get_default_government
-from src.helper.item import add_company_item, add_player_item, has_player_item, use_item
+                             update_sell_order, delete_company_item, add_object, delete_join_requests, delete_player_item,
+                             item_catalog, leaderboards, get_recipe, fill_buy_order, fill_sell_order)
+from src.helper.defaults import get_default_player, get_default_government, get_default_buy_order, \
+    get_default_sell_order
+from src.helper.item import add_company_item, add_player_item, has_player_item, use_item, remove_company_item
 from src.helper.randoms import get_hunger_depletion, get_thirst_depletion
-from src.helper.transactions import add_owed_taxes
+from src.helper.transactions import add_owed_taxes, notify_order_filled
+from src.db import executor
+from src.helper.order_expiry import order_sweeper
+from src.helper.gdp import gdp_accumulator, gdp_flusher
+from src.helper.tax_ledger import tax_ledger, tax_settler
+from src.helper.market import ensure_market_initialized
+from src.helper.user_names import user_names
+from src.helper.paginator import Paginator
+from src.helper.player_locks import locks_player
+from src.helper.notifications import dm_queue
+from src.metrics import registry, COMMAND_DURATION, COMMAND_DB_QUERIES, monitor_event_loop_lag
+from src.db.instrumentation import start_trace, ConflictError
 
 
 app = FastAPI()
@@ -46,20 +61,86 @@ def ping():
     return "pong"
 
 
+registry.gauge("queue_depth", "Entries waiting in the background queues", ("queue",), callback=lambda: {
+    ("dm",): len(dm_queue),
+    ("gdp",): len(gdp_accumulator),
+    ("tax",): len(tax_ledger),
+})
+registry.counter("user_name_lookups_total", "Display name lookups by where the name came from", ("result",), callback=lambda: {
+    ("member",): user_names.member_hits,
+    ("cache",): user_names.cache_hits,
+    ("fetch",): user_names.fetches,
+    ("failed_fetch",): user_names.failed_fetches,
+})
+
+
+@app.get("/metrics")
+async def metrics():
+    # async, so it renders on the event loop and not while a command changes the values
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def observe_command(interaction: Interaction, status: str):
+    command = interaction.command.qualified_name if interaction.command else "unknown"
+    COMMAND_DURATION.observe((discord.utils.utcnow() - interaction.created_at).total_seconds(), command, status)
+    trace = interaction.extras.get("db_trace")
+    if trace:
+        COMMAND_DB_QUERIES.observe(trace.queries, command)
+        print(f"/{command}: {trace.queries} queries, {trace.seconds * 1000:.0f} ms")
+
+
+class TracedCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        # Runs in the task of the command, so every query of the command ends up in this trace
+        interaction.extras["db_trace"] = start_trace()
+        return True
+
+
 class Client(commands.Bot):
     async def on_ready(self):
         print(f'Logged in as {self.user.name}')
+        await asyncio.gather(*(ensure_market_initialized(guild.id) for guild in self.guilds))
+
+    async def on_guild_join(self, guild):
+        await ensure_market_initialized(guild.id)
+
+    async def on_app_command_completion(self, interaction: Interaction, command):
+        observe_command(interaction, "ok")
 
     async def setup_hook(self):
+        await item_catalog.load()
+        order_sweeper.start()
+        gdp_flusher.start()
+        tax_ledger.recover()
+        tax_settler.start()
+        dm_queue.start(self)
         await self.tree.sync(guild=guild_id)
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-client = Client(command_prefix="!", intents=intents)
+client = Client(command_prefix="!", intents=intents, tree_cls=TracedCommandTree)
 
 guild_id = discord.Object(id=GUILD_ID)
 
+
+@client.tree.error
+async def on_app_command_error(interaction: Interaction, error: app_commands.AppCommandError):
+    observe_command(interaction, "error")
+    if isinstance(getattr(error, "original", error), ConflictError):
+        # update_player gave up, the command stopped before telling the user it worked
+        embed = discord.Embed(
+            title="Try Again",
+            description="Your account was changed by something else at the same time, this command didn't go through completely.",
+            color=discord.Color.red()
+        )
+        if interaction.response.is_done():
+            await interaction.followup.send(embed=embed, ephemeral=True)
+        else:
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+    # Default handling: log the traceback
+    await app_commands.CommandTree.on_error(client.tree, interaction, error)
+
 @client.tree.command(name="items", description="Shows all the items and their base values", guild=guild_id)
 async def init_items(interaction: Interaction):
     await interaction.response.defer(thinking=True)
@@ -94,18 +175,21 @@ async def init_stats(interaction: Interaction, user: discord.User | discord.Memb
     app_commands.Choice(name="entrepreneur", value="Entrepreneur"),
     app_commands.Choice(name="jobless", value="")  # Empty string means no job
 ])
+@locks_player
 async def init_job(interaction: Interaction, job_type: app_commands.Choice[str]):
     await interaction.response.defer(thinking=True)
     await job(interaction, job_type)
 
 
 @client.tree.command(name="chop", description="Used by lumberjacks to chop down trees.", guild=guild_id)
+@locks_player
 async def init_chop(interaction: Interaction):
     await interaction.response.defer(thinking=True)
     await chop(interaction)
 
 
 @client.tree.command(name="mine", description="Used by miners to mine resources.", guild=guild_id)
+@locks_player
 async def init_mine(interaction: discord.Interaction):
     await interaction.response.defer(thinking=True)
     await mine(interaction)
@@ -119,24 +203,28 @@ async def init_mine(interaction: discord.Interaction):
     app_commands.Choice(name="fish", value="Fish"),
     app_commands.Choice(name="leather", value="Leather"),
 ])
+@locks_player
 async def init_farm(interaction: Interaction, item: app_commands.Choice[str] = None):
     await interaction.response.defer(thinking=True)
     await farm(interaction, item)
 
 
 @client.tree.command(name="harvest", description="Used by special jobs to harvest their unique resource.", guild=guild_id)
+@locks_player
 async def init_harvest(interaction: Interaction):
     await interaction.response.defer(thinking=True)
     await harvest(interaction)
 
 
 @client.tree.command(name="drink", description="Consumes 1 water from your inventory and fills up your thirst bar.", guild=guild_id)
+@locks_player
 async def init_drink(interaction: Interaction):
     await interaction.response.defer(thinking=True)
     await drink(interaction)
 
 
 @client.tree.command(name="eat", description="Consumes 1 grocery from your inventory and fills up your hunger bar.", guild=guild_id)
+@locks_player
 async def init_eat(interaction: discord.Interaction):
     await interaction.response.defer(thinking=True)
     await eat(interaction)
@@ -153,6 +241,7 @@ async def init_eat(interaction: discord.Interaction):
     app_commands.Choice(name="grocery", value="Grocery"),
     app_commands.Choice(name="fish", value="Fish")
 ])
+@locks_player
 async def init_consume(interaction: discord.Interaction, item: app_commands.Choice[str]):
    await interaction.response.defer(thinking=True)
    await consume(interaction, item)
@@ -168,6 +257,7 @@ async def init_consume(interaction: discord.Interaction, item: app_commands.Choi
     unit_price="Maximum price you're willing to pay per unit",
     amount="How many you want to buy (default: 1)"
 )
+@locks_player
 async def init_buy(
     interaction: discord.Interaction,
     item: str,
@@ -187,6 +277,7 @@ async def init_buy(
     unit_price="Price you're selling for per unit",
     amount="How many you want to sell (default: 1)"
 )
+@locks_player
 async def init_sell(
     interaction: discord.Interaction,
     item: str,
@@ -225,6 +316,7 @@ class CompanyGroup(app_commands.Group):
         item="The item you want to sell",
         unit_price="Price you're selling for per unit",
     )
+    @locks_player
     async def company_sell(
             self,
             interaction: discord.Interaction,
@@ -353,12 +445,6 @@ class CompanyGroup(app_commands.Group):
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
 
-        # Abziehen
-        inv_item.amount -= amount
-        await update_company_item(inv_item)
-        if inv_item.amount <= 0:
-            await delete_company_item(company.entrepreneur_id, inv_item.item_tag, server_id)
-
         # Update hunger/thirst/cooldown
         old_hunger = player.hunger
         old_thirst = player.thirst
@@ -373,14 +459,7 @@ class CompanyGroup(app_commands.Group):
             durability = await use_item(player.id, server_id, "Calculator")
 
         # Markt initialisieren, falls nötig
-        market_entry = await get_market_item(server_id, item_tag)
-        if not market_entry:
-            items = await get_all_items()
-
-            for item in items:
-                market_item = get_default_market_item(item, server_id)
-                await add_object(market_item, "Market_Items")
-
+        await ensure_market_initialized(server_id)
         market_entry = await get_market_item(server_id, item_tag)
 
         if unit_price == -1:
@@ -394,6 +473,7 @@ class CompanyGroup(app_commands.Group):
         if len(existing_orders) > 0:
             existing_order = existing_orders[0]
             print("Merging orders")
+            await remove_company_item(user_id, server_id, item_tag, amount)
             existing_order.amount += amount
             await update_sell_order(existing_order)
             embed = discord.Embed(
@@ -412,79 +492,30 @@ class CompanyGroup(app_commands.Group):
 
 
 
-        # Buy Orders abrufen
-        buy_orders = await get_buy_orders(server_id, item_tag, unit_price, now)
-
-        total_sold = 0
-        total_earned = 0.0
-
-        for buy_order in buy_orders:
-            if total_sold >= amount:
-                break
-
-
-            sell_qty = min(buy_order.amount, amount - total_sold)
-            total_price = sell_qty * unit_price
-
-            # Validierung + Transaktion
-            if buy_order.is_company:
-                company_buyer = await get_company(buy_order.user_id, server_id)
-
-                if not company_buyer:
-                    # Firma existiert nicht mehr → Order löschen, Verkauf überspringen
-                    await delete_buy_orders(buy_order)
-                    continue
-
-                if company_buyer.capital < total_price:
-                    continue  # Firma hat nicht genug Geld → überspringen
-
-                # Transaktion Firma → Verkäufer
-                company_buyer.capital -= total_price
-                company.capital += total_price
-                await add_owed_taxes(user_id=company.entrepreneur_id, server_id=server_id,
-                                     amount=total_price, is_company=True)
-                await add_company_item(buy_order.user_id, server_id, item_tag, sell_qty, True)
-
-            else:
-                buyer = await get_player(buy_order.user_id, server_id)
-                if not buyer or buyer.money < total_price:
-                    continue
-
-
-
-                if buyer.money < total_price:
-                    sell_qty = int(buyer.money // unit_price)
-                    total_price = sell_qty * unit_price
-
-                if sell_qty <= 0:
-                    continue
-
-                # Transaktion Käufer → Verkäufer
-                buyer.money -= total_price
-                company.capital += total_price
-                await add_owed_taxes(user_id=company.entrepreneur_id, server_id=server_id,
-                                     amount=total_price, is_company=True)
-                await add_player_item(buy_order.user_id, server_id, item_tag, sell_qty)
-
-            # Buy Order anpassen oder löschen
-            buy_order.amount -= sell_qty
-            if buy_order.amount <= 0:
-                await delete_buy_orders(buy_order.user_id, buy_order.server_id, buy_order.item_tag)
-
-            total_sold += sell_qty
-            total_earned += total_price
+        # Matching, Geld, Steuern und Inventar macht die Datenbank in einer Transaktion (wie /sell)
+        fills = await fill_sell_order(user_id, server_id, item_tag, unit_price, amount, is_company=True)
+        total_sold = sum(fill.amount for fill in fills)
+        total_earned = sum(fill.total_price for fill in fills)
 
+        if fills:
             embed = discord.Embed(
-                title="Buy Order Fulfilled",
-                description=f"Your buy order of **{sell_qty}x {item_tag}** at **${unit_price:.2f}** each was successful (Total: **${total_price:.2f}**).",
+                title="Company Player Market Sale",
+                description=f"You sold **{total_sold}x {item_tag}** for **${total_earned:.2f}** total.",
                 color=discord.Color.green()
             )
-            try:
-                buyer_user = await interaction.client.fetch_user(buy_order.user_id)
-                await buyer_user.send(embed=embed)
-            except discord.Forbidden:
-                pass
+            embed.add_field(name="Hunger", value=f"{old_hunger} -> {player.hunger}")
+            embed.add_field(name="Thirst", value=f"{old_thirst} -> {player.thirst}")
+            await interaction.followup.send(embed=embed)
+
+            for fill in fills:
+                notify_order_filled(fill, "Buy", item_tag)
 
+            # Die Fills haben das Kapital der Firma in der Datenbank geändert
+            company = await get_company(user_id, server_id)
+
+        # Der Rest geht an den NPC-Markt oder in die neue Sell Order
+        if total_sold < amount:
+            await remove_company_item(user_id, server_id, item_tag, amount - total_sold)
 
         # NPC-Markt
         if total_sold < amount:
@@ -527,14 +558,7 @@ class CompanyGroup(app_commands.Group):
         if total_sold < amount:
             print("Creating new Sell Order")
             rest = amount - total_sold
-            new_order = SellOrder(
-                user_id=user_id,
-                item_tag=item_tag,
-                server_id=server_id,
-                amount=rest,
-                unit_price=unit_price,
-                is_company=True
-            )
+            new_order = get_default_sell_order(user_id, item_tag, server_id, rest, unit_price, is_company=True)
             await add_object(new_order, "Sell_Orders")
             embed = discord.Embed(
                     title="Company Sell Order Placed",
@@ -545,16 +569,6 @@ class CompanyGroup(app_commands.Group):
             embed.add_field(name="Thirst", value=f"{old_thirst} -> {player.thirst}")
             await interaction.followup.send(embed=embed)
 
-        if total_sold > 0:
-            embed = discord.Embed(
-                title="Company Player Market Sale",
-                description=f"You sold **{total_sold}x {item_tag}** for **${total_earned:.2f}** total.",
-                color=discord.Color.green()
-            )
-            embed.add_field(name="Hunger", value=f"{old_hunger} -> {player.hunger}")
-            embed.add_field(name="Thirst", value=f"{old_thirst} -> {player.thirst}")
-            await interaction.followup.send(embed=embed)
-
 
     @app_commands.command(name="buy", description="Buy items from the market")
     @app_commands.describe(
@@ -562,6 +576,7 @@ class CompanyGroup(app_commands.Group):
         unit_price="Maximum price you're willing to pay per unit",
         amount="How many you want to buy (default: 1)"
     )
+    @locks_player
     async def company_buy(
             self,
             interaction: discord.Interaction,
@@ -623,14 +638,7 @@ class CompanyGroup(app_commands.Group):
         
 
         # Markt initialisieren, falls nötig
-        market_entry = await get_market_item(server_id, item_tag)
-        if not market_entry:
-            items = await get_all_items()
-
-            for item in items:
-                market_item = get_default_market_item(item, server_id)
-                await add_object(market_item, "Market_Items")
-
+        await ensure_market_initialized(server_id)
         market_entry = await get_market_item(server_id, item_tag)
 
         if unit_price == -1:
@@ -685,8 +693,6 @@ class CompanyGroup(app_commands.Group):
             return
 
         # Bestehende BuyOrder checken
-        now = datetime.now()
-
         existing_orders = await get_own_buy_orders(user_id, server_id, item_tag, unit_price, is_company=True)
 
         if len(existing_orders) > 0:
@@ -709,97 +715,31 @@ class CompanyGroup(app_commands.Group):
         
 
 
-        # SELL-Orders finden
-        fulfilled_total = 0
-        total_spent = 0.0
-
-        sell_orders = await get_sell_orders(server_id, item_tag, unit_price, now)
-
-
-        for sell_order in sell_orders:
-            if company.capital < sell_order.unit_price:
-                break
-
-            match_amount = min(amount, sell_order.amount)
-            total_price = round(match_amount * sell_order.unit_price, 2)
-
-
-            if company.capital < total_price:
-                match_amount = int(company.capital // sell_order.unit_price)
-                total_price = round(match_amount * sell_order.unit_price, 2)
+        # Matching, Geld, Steuern und Inventar macht die Datenbank in einer Transaktion (wie /buy)
+        fills = await fill_buy_order(user_id, server_id, item_tag, unit_price, amount, is_company=True)
 
-            if match_amount <= 0:
-                break
+        if fills:
+            fulfilled_total = sum(fill.amount for fill in fills)
+            total_spent = sum(fill.total_price for fill in fills)
+            amount -= fulfilled_total
 
-
-            # Geld abziehen
-            company.capital -= total_price
-            await add_company_item(user_id, server_id, item_tag, match_amount)
-            await update_company(company)
-
-
-            if sell_order.is_company:
-                company_seller = await get_company(sell_order.user_id, server_id)
-                if company_seller:
-                    company_seller.capital += total_price
-                    await add_owed_taxes(user_id=company_seller.entrepreneur_id, server_id=server_id, amount=total_price, is_company=True)
-
-
-                else:
-                    await delete_sell_orders(sell_order.user_id, sell_order.server_id, sell_order.item_tag)
-                    await interaction.followup.send(
-                        embed=discord.Embed(
-                            title="Sell Order Removed",
-                            description="The company for one of the sell orders no longer exists. Sell order removed.",
-                            color=discord.Color.orange()
-                        )
-                    )
-                    continue
-            else:
-                seller = await get_player(sell_order.user_id, server_id)
-                if seller:
-                    seller.money += total_price
-                    await add_owed_taxes(user_id=seller.id, server_id=server_id,
-                                        amount=total_price, is_company=False)
-                    try:
-                        user_obj = await interaction.client.fetch_user(sell_order.user_id)
-                        await user_obj.send(embed=discord.Embed(
-                            title="Sell Order Fulfilled",
-                            description=f"Your sell order for **{match_amount}x {item_tag}** was fulfilled for **${total_price:.2f}**.",
-                            color=discord.Color.green()
-                        ))
-                    except discord.Forbidden:
-                        pass
-            if sell_order.amount == match_amount:
-                await delete_sell_orders(sell_order.user_id, sell_order.server_id, sell_order.item_tag)
-            else:
-                sell_order.amount -= match_amount
-
-            fulfilled_total += match_amount
-            total_spent += total_price
-            amount -= match_amount
-
-            await update_sell_order(sell_order)
-
-            if amount == 0:
-                await interaction.followup.send(
-                    embed=discord.Embed(
-                        title="Company Buy Order Fulfilled",
-                        description=f"You bought **{fulfilled_total}x {item_tag}** from player orders for **${total_spent:.2f}**.",
-                        color=discord.Color.green()
-                    )
-                )
-                return
-
-        if fulfilled_total > 0:
             await interaction.followup.send(
                 embed=discord.Embed(
-                    title="Buy Order Partially Fulfilled",
+                    title="Company Buy Order Fulfilled" if amount == 0 else "Buy Order Partially Fulfilled",
                     description=f"You bought **{fulfilled_total}x {item_tag}** from player orders for **${total_spent:.2f}**.",
                     color=discord.Color.green()
                 )
             )
 
+            for fill in fills:
+                notify_order_filled(fill, "Sell", item_tag)
+
+            if amount == 0:
+                return
+
+            # Die Fills haben das Kapital der Firma in der Datenbank geändert
+            company = await get_company(user_id, server_id)
+
 
         # NPC-Markt?
         if amount > 0 and unit_price >= market_entry.max_price and market_entry.stockpile > 0:
@@ -860,15 +800,8 @@ class CompanyGroup(app_commands.Group):
                         color=discord.Color.red()
                     )
                 )
-            new_order = BuyOrder(
-                user_id=user_id,
-                item_tag=item_tag,
-                server_id=server_id,
-                amount=amount,
-                unit_price=unit_price,
-                is_company=True
-            )
-            await add_object(new_order, "Buy_Order")
+            new_order = get_default_buy_order(user_id, item_tag, server_id, amount, unit_price, is_company=True)
+            await add_object(new_order, "Buy_Orders")
 
             await interaction.followup.send(
                 embed=discord.Embed(
@@ -933,7 +866,8 @@ class CompanyGroup(app_commands.Group):
         )
         embed.add_field(name="Capital", value=f"${company.capital:.2f}", inline=True)
         embed.add_field(name="Wage", value=f"${company.wage:.2f}", inline=True)
-        embed.add_field(name="Taxes Owed", value=f"${company.taxes_owed:.2f}", inline=True)
+        taxes_owed = company.taxes_owed + tax_ledger.pending(company.server_id, company.entrepreneur_id, True)
+        embed.add_field(name="Taxes Owed", value=f"${taxes_owed:.2f}", inline=True)
         embed.add_field(name="Producible Items",
                         value=company.producible_items.replace(",", ", ") if company.producible_items else "None",
                         inline=True)
@@ -945,11 +879,9 @@ class CompanyGroup(app_commands.Group):
 
         if players:
             employee_lines = []
+            names = await user_names.get_many(interaction.client, [player.id for player in players], interaction.guild)
             for player in players:
-                discord_player = await interaction.client.fetch_user(player.id)
-                line = f"{discord_player.name}"
-
-                employee_lines.append(line)
+                employee_lines.append(names[player.id])
             employees_string = "\n".join(employee_lines)
             embed.add_field(name="Employees", value=employees_string, inline=False)
         else:
@@ -960,11 +892,9 @@ class CompanyGroup(app_commands.Group):
 
         if requests:
             request_lines = []
+            names = await user_names.get_many(interaction.client, [request.user_id for request in requests], interaction.guild)
             for request in requests:
-                discord_request = await interaction.client.fetch_user(request.user_id)
-                line = f"{discord_request.name}"
-
-                request_lines.append(line)
+                request_lines.append(names[request.user_id])
             requests_string = "\n".join(request_lines)
             embed.add_field(name="Join Requests", value=requests_string, inline=False)
         else:
@@ -986,6 +916,7 @@ class CompanyGroup(app_commands.Group):
 
     @app_commands.command(name="deposit", description="Deposit money to the company account")
     @app_commands.describe(value="The amount of money you want to deposit")
+    @locks_player
     async def deposit(self, interaction: discord.Interaction, value: float):
         await interaction.response.defer(thinking=True)
         print(f"{interaction.user}: /company deposit {value}")
@@ -1059,6 +990,7 @@ class CompanyGroup(app_commands.Group):
 
     @app_commands.command(name="withdraw", description="Withdraw money from the company account")
     @app_commands.describe(value="The amount of money you want to withdraw")
+    @locks_player
     async def withdraw(self, interaction: discord.Interaction, value: float):
         await interaction.response.defer(thinking=True)
 
@@ -1131,6 +1063,7 @@ class CompanyGroup(app_commands.Group):
 
     @app_commands.command(name="create", description="Create a company if you don't have a job. Costs $1000")
     @app_commands.describe(name="The name of the company you want to create")
+    @locks_player
     async def create(self, interaction: discord.Interaction, name: str):
         await interaction.response.defer(thinking=True)
         print(f"{interaction.user}: /company create {name}")
@@ -1388,6 +1321,7 @@ async def setitems(interaction: discord.Interaction, item1: str, item2: str = ""
     guild=guild_id
 )
 @app_commands.describe(item="The item you want to produce")
+@locks_player
 async def work(interaction: discord.Interaction, item: str):
     await interaction.response.defer(thinking=True)
     print(f"{interaction.user}: /work {item}", flush=True)
@@ -1483,27 +1417,25 @@ async def work(interaction: discord.Interaction, item: str):
 
     item_index = allowed_tags.index(item)
 
-    ingredients = {}
-    if item_obj.ingredients:
-        for entry in item_obj.ingredients.split(","):
-            name, qty = entry.split(":")
-            ingredients[name] = int(qty)
+    recipe = await get_recipe(item_obj.item_tag)
+    ingredients = dict(recipe.ingredients) if recipe else {}
 
     # Wenn Worksteps = 0, dann Ressourcen prüfen und verbrauchen
     if worksteps_list[item_index] <= 0:
+        company_items = await get_company_items(company.entrepreneur_id, server_id, ingredients.keys())
         for tag, required_amount in ingredients.items():
-            company_item = await get_company_item(company.entrepreneur_id, server_id, tag)
+            company_item = company_items.get(normalize_tag(tag))
             if not company_item or company_item.amount < required_amount:
                 await interaction.followup.send(embed=discord.Embed(
                     title="Not enough resources!",
-                    description=f"You need: " + ", ".join(f"{v}x {k}" for k, v in ingredients.items()),
+                    description=f"You need: " + format_amounts(ingredients.items()),
                     color=discord.Color.red()
                 ), ephemeral=True)
                 return
 
         # Ressourcen abziehen
         for tag, required_amount in ingredients.items():
-            company_item = await get_company_item(company.entrepreneur_id, server_id, tag)
+            company_item = company_items[normalize_tag(tag)]
             company_item.amount -= required_amount
             await update_company_item(company_item)
 
@@ -1735,10 +1667,8 @@ async def marketinfo(interaction: discord.Interaction, item: str):
         )
         return
     
+    await ensure_market_initialized(server_id)
     market_entry = await get_market_item(server_id, item_obj.item_tag)
-    if market_entry is None:
-        market_entry = get_default_market_item(item_obj, server_id)
-        await add_object(market_entry, "Market_Items")
 
     now = datetime.now()
 
@@ -1748,10 +1678,11 @@ async def marketinfo(interaction: discord.Interaction, item: str):
     # SellOrders abrufen
     sell_orders = await get_item_sell_orders(server_id, market_entry.item_tag, now)
 
-    async def format_order(order):
-        user = await interaction.client.fetch_user(order.user_id)
+    names = await user_names.get_many(interaction.client, [o.user_id for o in buy_orders[:10] + sell_orders[:10]], interaction.guild)
+
+    def format_order(order):
         type_label = "🏭 " if order.is_company else ""
-        return f"{type_label}{order.amount}x @ ${order.unit_price:.2f} ({user.name})"
+        return f"{type_label}{order.amount}x @ ${order.unit_price:.2f} ({names[order.user_id]})"
 
     # Embed erstellen
     embed = discord.Embed(
@@ -1765,7 +1696,7 @@ async def marketinfo(interaction: discord.Interaction, item: str):
     if buy_orders:
         embed.add_field(
             name="Buy Orders (sorted by price ↓)",
-            value="\n".join([await format_order(o) for o in buy_orders[:10]]),
+            value="\n".join([format_order(o) for o in buy_orders[:10]]),
             inline=False
         )
     else:
@@ -1774,7 +1705,7 @@ async def marketinfo(interaction: discord.Interaction, item: str):
     if sell_orders:
         embed.add_field(
             name="Sell Orders (sorted by price ↑)",
-            value="\n".join([await format_order(o) for o in sell_orders[:10]]),
+            value="\n".join([format_order(o) for o in sell_orders[:10]]),
             inline=False
         )
     else:
@@ -1797,6 +1728,7 @@ async def marketinfo(interaction: discord.Interaction, item: str):
     user="The user you want to gift money to",
     value="The amount of money you want to gift"
 )
+@locks_player
 async def gift(interaction: discord.Interaction, user: discord.Member, value: float):
     await interaction.response.defer(thinking=True)
     print(f"{interaction.user}: /gift {user} {value}")
@@ -1901,6 +1833,7 @@ async def gift(interaction: discord.Interaction, user: discord.Member, value: fl
 @app_commands.describe(
     value="The amount of money you want to loan"
 )
+@locks_player
 async def loan(interaction: discord.Interaction, value: int):
     await interaction.response.defer(thinking=True)
     print(f"{interaction.user}: /loan {value}")
@@ -1996,6 +1929,7 @@ async def loan(interaction: discord.Interaction, value: int):
 @app_commands.describe(
     value="The amount of money you want to pay back"
 )
+@locks_player
 async def paydebt(interaction: discord.Interaction, value: float):
     await interaction.response.defer(thinking=True)
     print(f"{interaction.user}: /paydebt {value}")
@@ -2366,6 +2300,50 @@ async def setprice(interaction: discord.Interaction, item: str, min_price: float
 
 
 
+@client.tree.command(
+    name="reloaditems",
+    description="Reloads the item list after items were edited in the database.",
+    guild=guild_id
+)
+async def reloaditems(interaction: discord.Interaction):
+    await interaction.response.defer(thinking=True)
+    print(f"{interaction.user}: /reloaditems")
+
+    server_id = int(interaction.guild.id)
+    user_roles = [role.id for role in interaction.user.roles]
+
+    gov = await get_government(server_id)
+    if not gov:
+        gov = get_default_government(server_id)
+        await add_object(gov, "Government")
+
+    if gov.admin_role not in user_roles:
+        await interaction.followup.send(
+            embed=discord.Embed(
+                title="Permission denied",
+                description="You need admin rights to use this command.",
+                color=discord.Color.red()
+            ),
+            ephemeral=True
+        )
+        return
+
+    await item_catalog.reload()
+    items = await item_catalog.all()
+    # Market rows for items that were added
+    await ensure_market_initialized(server_id, force=True)
+
+    await interaction.followup.send(
+        embed=discord.Embed(
+            title="Items Reloaded",
+            description=f"Loaded **{len(items)}** items.",
+            color=discord.Color.green()
+        )
+    )
+
+
+
+
 @client.tree.command(
     name="setdebt",
     description="Sets the debt of a user.",
@@ -2740,17 +2718,22 @@ async def bailout(interaction: discord.Interaction, user: discord.Member):
         return
 
     # Tilgungslogik
-    if gov.treasury >= player.debt:
-        cleared_debt = player.debt
-        gov.treasury -= player.debt
-        player.debt = 0.0
-    else:
-        cleared_debt = gov.treasury
-        player.debt -= gov.treasury
-        gov.treasury = 0.0
+    cleared_debt = min(gov.treasury, player.debt)
+    gov.treasury -= cleared_debt
+    # Treasury first: the check above used the cached row, another bailout / subsidy may have spent it already
+    if not await update_government(gov):
+        await interaction.followup.send(
+            embed=discord.Embed(
+                title="Insufficient Treasury Funds",
+                description=f"The treasury changed in the meantime and only holds ${gov.treasury:.2f} now. Please try again.",
+                color=discord.Color.red()
+            ),
+            ephemeral=True
+        )
+        return
 
+    player.debt -= cleared_debt
     await update_player(player)
-    await update_government(gov)
 
     await interaction.followup.send(
         embed=discord.Embed(
@@ -2769,59 +2752,6 @@ async def bailout(interaction: discord.Interaction, user: discord.Member):
 
 
 
-class LeaderboardView(View):
-    def __init__(self, entries, current_user_id, per_page=10):
-        super().__init__(timeout=60)
-        self.entries = entries
-        self.current_user_id = current_user_id
-        self.per_page = per_page
-        self.current_page = 0
-        self.total_pages = ceil(len(entries) / per_page)
-        self.message = None
-
-    def get_embed(self):
-        start = self.current_page * self.per_page
-        end = start + self.per_page
-        embed = Embed(title="💰 Net Worth Leaderboard", color=0xFFD700)
-        for idx, (user_id, name, networth) in enumerate(self.entries[start:end], start=start + 1):
-            display = f"**{name}**" if user_id == self.current_user_id else name
-            embed.add_field(name=f"#{idx}", value=f"{display}: ${networth:,.2f}", inline=False)
-
-        # Footer with user position
-        rank = next((i + 1 for i, (uid, _, _) in enumerate(self.entries) if uid == self.current_user_id), None)
-        embed.set_footer(text=f"Your position: #{rank}" if rank else "You are not ranked.")
-        return embed
-
-    async def update_message(self):
-        if self.message:
-            await self.message.edit(embed=self.get_embed(), view=self)
-
-    @button(label="⏮", style=ButtonStyle.grey)
-    async def go_first(self, interaction: Interaction, _):
-        self.current_page = 0
-        await self.update_message()
-        await interaction.response.defer()
-
-    @button(label="⬅", style=ButtonStyle.blurple)
-    async def go_back(self, interaction: Interaction, _):
-        if self.current_page > 0:
-            self.current_page -= 1
-        await self.update_message()
-        await interaction.response.defer()
-
-    @button(label="➡", style=ButtonStyle.blurple)
-    async def go_next(self, interaction: Interaction, _):
-        if self.current_page < self.total_pages - 1:
-            self.current_page += 1
-        await self.update_message()
-        await interaction.response.defer()
-
-    @button(label="⏭", style=ButtonStyle.grey)
-    async def go_last(self, interaction: Interaction, _):
-        self.current_page = self.total_pages - 1
-        await self.update_message()
-        await interaction.response.defer()
-
 # Slash Command
 @client.tree.command(name="leaderboard", description="Shows who owns the most networth.", guild = guild_id)
 async def leaderboard(interaction: Interaction):
@@ -2831,29 +2761,37 @@ async def leaderboard(interaction: Interaction):
     user_id = int(interaction.user.id)
     server_id = int(interaction.guild.id)
 
-    players = await get_all_players(server_id)
-
-    companies = await get_all_companies(server_id)
+    # Kept up to date by every money / capital / debt write, only loaded on first use
+    board = await leaderboards.get(server_id)
+    if board is None:
+        await interaction.followup.send(
+            embed=discord.Embed(
+                title="Error!",
+                description="The leaderboard could not be loaded, please try again later.",
+                color=discord.Color.red()
+            ), ephemeral=True
+        )
+        return
 
-    player_data = {p.id: {"money": p.money, "debt": p.debt, "capital": 0.0} for p in players}
-    for c in companies:
-        if c.entrepreneur_id in player_data:
-            player_data[c.entrepreneur_id]["capital"] += c.capital
+    async def fetch_page(offset, limit):
+        entries = board.page(offset, limit)
+        names = await user_names.get_many(interaction.client, [uid for uid, _ in entries], interaction.guild)
+        return [(uid, names[uid], networth) for uid, networth in entries]
 
-    entries = []
-    for uid, data in player_data.items():
-        net = data["money"] + data["capital"] - data["debt"]
-        try:
-            user = await interaction.client.fetch_user(uid)
-            name = user.display_name if hasattr(user, "display_name") else user.name
-        except:
-            name = f"User {uid}"
-        entries.append((uid, name, net))
+    def get_page_embed(page, entries, max_page):
+        start = page * paginator.items_per_page
+        embed = Embed(title="💰 Net Worth Leaderboard", color=0xFFD700)
+        for idx, (uid, name, networth) in enumerate(entries, start=start + 1):
+            display = f"**{name}**" if uid == user_id else name
+            embed.add_field(name=f"#{idx}", value=f"{display}: ${networth:,.2f}", inline=False)
 
-    entries.sort(key=lambda x: x[2], reverse=True)
+        # Footer with user position
+        rank = board.rank_of(user_id)
+        embed.set_footer(text=f"Your position: #{rank}" if rank else "You are not ranked.")
+        return embed
 
-    view = LeaderboardView(entries, user_id)
-    view.message = await interaction.followup.send(embed=view.get_embed(), view=view)
+    paginator = Paginator(get_page_embed, fetch_page, len(board), items_per_page=10)
+    await interaction.followup.send(embed=await paginator.page_embed(), view=paginator)
 
 
 
@@ -2887,7 +2825,8 @@ async def ingredients(interaction: Interaction, item: str):
         )
         return
 
-    if not item_obj.ingredients:
+    recipe = await get_recipe(item_obj.item_tag)
+    if not recipe:
         await interaction.followup.send(
             embed=Embed(
                 title=f"{item_obj.item_tag} has no ingredients",
@@ -2901,10 +2840,7 @@ async def ingredients(interaction: Interaction, item: str):
     total_cost = 0.0
     lines = []
 
-    for entry in item_obj.ingredients.split(","):
-        tag, amount_str = entry.split(":")
-        amount = int(amount_str)
-
+    for tag, amount in recipe.ingredients:
         # Fetch market price
         market_entry = await get_market_item(server_id, tag)
 
@@ -2928,6 +2864,20 @@ async def ingredients(interaction: Interaction, item: str):
         inline=False
     )
 
+    # Alles bis runter zu den Rohstoffen, aus dem Katalog (Base Price), ohne weitere Abfragen
+    if recipe.raw_materials is None:
+        embed.add_field(name="Raw Materials", value="Recipe cycle, can't be broken down", inline=False)
+    else:
+        raw_cost = 0.0
+        for tag, amount in recipe.raw_materials:
+            raw_item = await get_item(tag)
+            raw_cost += (raw_item.base_price if raw_item else 0.0) * amount
+        embed.add_field(
+            name="Raw Materials (Base Price)",
+            value=f"{format_amounts(recipe.raw_materials)}\n${raw_cost:.2f}, {recipe.total_worksteps} worksteps in total",
+            inline=False
+        )
+
     await interaction.followup.send(embed=embed)
 
 
@@ -2941,6 +2891,7 @@ async def ingredients(interaction: Interaction, item: str):
     amount="How many times you want to be able to produce that item",
     buy_price="0 = min price, 1 = max price. Values in between = Buy Orders"
 )
+@locks_player
 async def buymaterials(interaction: discord.Interaction, item: str, amount: int = 1, buy_price: float = 1.0):
     await interaction.response.defer(thinking=True)
     print(f"{interaction.user}: /buymaterials item:{item}, amount:{amount}, buy_price:{buy_price}")
@@ -2976,8 +2927,8 @@ async def buymaterials(interaction: discord.Interaction, item: str, amount: int
         return
 
     # Item + ingredients
-    item_data = await get_item(item)
-    if not item_data or not item_data.ingredients:
+    recipe = await get_recipe(item)
+    if not recipe:
         await interaction.followup.send(
             embed=discord.Embed(
                 title="Invalid Item",
@@ -2988,15 +2939,13 @@ async def buymaterials(interaction: discord.Interaction, item: str, amount: int
         )
         return
 
-    ingredients = item_data.ingredients.split(",")
     purchases = []
     total_cost = 0.0
     buy_orders_created = []
     npc_purchase = False
 
-    for ing in ingredients:
-        tag, qty_str = ing.split(":")
-        qty = int(qty_str) * amount
+    for tag, qty in recipe.ingredients:
+        qty *= amount
 
         market_item = await get_market_item(server_id, tag)
         if not market_item:
@@ -3031,14 +2980,7 @@ async def buymaterials(interaction: discord.Interaction, item: str, amount: int
             if existing_order:
                 existing_order.amount += qty
             else:
-                new_order = BuyOrder(
-                    user_id=user_id,
-                    server_id=server_id,
-                    item_tag=tag,
-                    unit_price=unit_price,
-                    amount=qty,
-                    is_company=True,
-                )
+                new_order = get_default_buy_order(user_id, tag, server_id, qty, unit_price, is_company=True)
                 await add_object(new_order, "Buy_Orders")
                 buy_orders_created.append((tag, qty, unit_price))
 
@@ -3123,15 +3065,24 @@ class TaxCommandGroup(app_commands.Group):
 
         companies = await get_tax_owing_companies(server_id)
 
+        # Settled taxes + what was accrued since the last settlement
+        owed = tax_ledger.pending_for_server(server_id)
+        for company in companies:
+            owed[(company.entrepreneur_id, True)] += company.taxes_owed
+        for player in players:
+            owed[(player.id, False)] += player.taxes_owed
+
         lines = []
 
-        for company in companies:
-            owner = await interaction.client.fetch_user(company.entrepreneur_id)
-            lines.append(f"🏭 **{owner.display_name}**'s company owes ${company.taxes_owed:.2f}")
+        names = await user_names.get_many(interaction.client, list({user_id for user_id, _ in owed}), interaction.guild)
 
-        for player in players:
-            user = await interaction.client.fetch_user(player.id)
-            lines.append(f"🧍 **{user.display_name}** owes ${player.taxes_owed:.2f}")
+        for (user_id, is_company), amount in sorted(owed.items(), key=lambda entry: (not entry[0][1], -entry[1])):
+            if amount <= 0:
+                continue
+            if is_company:
+                lines.append(f"🏭 **{names[user_id]}**'s company owes ${amount:.2f}")
+            else:
+                lines.append(f"🧍 **{names[user_id]}** owes ${amount:.2f}")
 
         
 
@@ -3148,49 +3099,52 @@ class TaxCommandGroup(app_commands.Group):
 
     @app_commands.command(name="pay", description="Pay your personal or company taxes")
     @app_commands.describe(amount="Amount to pay (optional)")
+    @locks_player
     async def pay(self, interaction: discord.Interaction, amount: float = None):
         await interaction.response.defer(thinking=True)
         print(f"{interaction.user}: /tax pay {amount}")
         server_id = interaction.guild.id
         user_id = interaction.user.id
 
-        player = await get_player(user_id, server_id)
-        if not player:
-            # Standardwerte
-            player = get_default_player()
-            await add_object(player, "Players")
-
-        company = await get_company(user_id, server_id)
-        total_personal = player.taxes_owed
-        total_company = company.taxes_owed if company else 0
-        total_owed = total_personal + total_company
-
-        if total_owed <= 0:
-            await interaction.followup.send("You have no taxes to pay.")
-            return
+        # Everything accrued so far is in taxes_owed, and no settlement lands between reading and writing it back
+        async with tax_ledger.settled():
+            player = await get_player(user_id, server_id)
+            if not player:
+                # Standardwerte
+                player = get_default_player()
+                await add_object(player, "Players")
+
+            company = await get_company(user_id, server_id)
+            total_personal = player.taxes_owed
+            total_company = company.taxes_owed if company else 0
+            total_owed = total_personal + total_company
+
+            if total_owed <= 0:
+                await interaction.followup.send("You have no taxes to pay.")
+                return
 
-        if amount is None:
-            amount = total_owed
+            if amount is None:
+                amount = total_owed
 
-        paid = 0
-        msg = ""
+            paid = 0
+            msg = ""
 
-        if company and company.taxes_owed > 0 and amount > 0:
-            pay = min(company.taxes_owed, company.capital, amount)
-            company.taxes_owed -= pay
-            company.capital -= pay
-            paid += pay
-            amount -= pay
-            msg += f"🏭 Paid ${pay:.2f} in company taxes.\n"
-            await update_company(company)
+            if company and company.taxes_owed > 0 and amount > 0:
+                pay = min(company.taxes_owed, company.capital, amount)
+                company.taxes_owed -= pay
+                company.capital -= pay
+                paid += pay
+                amount -= pay
+                msg += f"🏭 Paid ${pay:.2f} in company taxes.\n"
+                await update_company(company)
 
-        if player.taxes_owed > 0 and amount > 0:
-            pay = min(player.taxes_owed, player.money, amount)
-            player.taxes_owed -= pay
-            player.money -= pay
-            paid += pay
-            msg += f"🧍 Paid ${pay:.2f} in personal taxes."
-            await update_player(player)
+            if player.taxes_owed > 0 and amount > 0:
+                pay = min(player.taxes_owed, player.money, amount)
+                player.taxes_owed -= pay
+                player.money -= pay
+                paid += pay
+                msg += f"🧍 Paid ${pay:.2f} in personal taxes."
+                await update_player(player)
 
         # ➕ Regierung laden und Geld in die Treasury
         gov = await get_government(server_id)
@@ -3276,8 +3230,7 @@ async def government(interaction: discord.Interaction):
         title="Government Overview",
         color=discord.Color.yellow()
     )
-    dt = datetime.fromisoformat(gov.created_at)
-    embed.add_field(name="📅 Created At", value=dt.strftime("%d.%m.%Y %H:%M UTC"), inline=False)
+    embed.add_field(name="📅 Created At", value=gov.created_at.strftime("%d.%m.%Y %H:%M UTC"), inline=False)
     embed.add_field(name="💸 Tax Rate", value=f"{gov.taxrate * 100:.2f}%", inline=True)
     embed.add_field(name="🏦 Interest Rate", value=f"{gov.interest_rate * 100:.2f}%", inline=True)
     embed.add_field(name="💰 Treasury", value=f"${gov.treasury:,.2f}", inline=False)
@@ -3291,18 +3244,15 @@ async def government(interaction: discord.Interaction):
     seven_days_ago = today - timedelta(days=6)
 
     gdp_entries = await get_all_gdp_entries(server_id, seven_days_ago)
+    # Plus what was earned since the last GDP flush
+    gdp_by_day = gdp_accumulator.with_pending(server_id, gdp_entries or [], seven_days_ago)
 
 
-    if gdp_entries:
+    if gdp_by_day:
         gdp_text = ""
-        for entry in gdp_entries:
-            entry_date = (
-                datetime.fromisoformat(entry.date).date()
-                if isinstance(entry.date, str)
-                else entry.date
-            )
+        for entry_date, gdp_value in gdp_by_day:
             day_label = "📅 Today" if entry_date == today else entry_date.strftime("%d.%m.%Y")
-            gdp_text += f"{day_label}: ${entry.gdp_value:,.2f}\n"
+            gdp_text += f"{day_label}: ${gdp_value:,.2f}\n"
         embed.add_field(name="📊 GDP (Last 7 Days)", value=gdp_text, inline=False)
 
     await interaction.followup.send(embed=embed)
@@ -3377,6 +3327,7 @@ async def help_command(interaction: discord.Interaction):
             "`/setdebt`, `/adddebt` – Modify user debt\n"
             "`/setprice`, `/setsupply` – Control NPC market\n"
             "`/additem`, `/removeitem` – Grant or remove items\n"
+            "`/reloaditems` – Reload items after editing them\n"
             "`/tax rate` – Change tax rate\n"
         ),
         inline=False
@@ -3460,6 +3411,7 @@ async def init_sponsor(interaction: discord.Interaction, amount: int):
     app_commands.Choice(name="red", value="red"),
     app_commands.Choice(name="black", value="black"),
 ])
+@locks_player
 async def init_roulette(interaction: discord.Interaction, color: app_commands.Choice[str], amount: float):
     await interaction.response.defer(thinking=True)
     await roulette(interaction, color.value, amount)
@@ -3475,4 +3427,19 @@ client.tree.add_command(TaxCommandGroup(), guild=guild_id)
 @app.on_event("startup")
 async def startup_event():
     import asyncio
-    asyncio.create_task(client.start(TOKEN))
\ No newline at end of file
+    asyncio.create_task(client.start(TOKEN))
+    app.state.loop_lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.loop_lag_monitor.cancel()
+    order_sweeper.cancel()
+    gdp_flusher.cancel()
+    # Write the GDP that was collected since the last flush before the db pool goes away.
+    # A periodic flush that was running keeps going (shielded), this one waits for it and sends the rest
+    await gdp_accumulator.flush()
+    tax_settler.cancel()
+    await tax_ledger.close()
+    await dm_queue.close()
+    await client.close()
+    executor.shutdown()
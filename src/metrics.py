@@ -0,0 +1,155 @@
+import asyncio
+
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+
+# Sekunden, passend für Discord-Commands und einzelne Queries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), callback: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        '''
+        :param callback: Returns {label values: value} when rendering, instead of values set from the code
+        '''
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._callback = callback
+        self._values: Dict[Tuple, float] = defaultdict(float)
+
+    def _samples(self):
+        values = self._callback() if self._callback else self._values
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount: float = 1.0):
+        self._values[label_values] += amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, *label_values):
+        self._values[label_values] = value
+
+    def inc(self, *label_values, amount: float = 1.0):
+        self._values[label_values] += amount
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._counts: Dict[Tuple, list] = {}
+        self._sums: Dict[Tuple, float] = defaultdict(float)
+
+    def observe(self, value: float, *label_values):
+        counts = self._counts.get(label_values)
+        if counts is None:
+            counts = self._counts[label_values] = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[label_values] += value
+
+    def _samples(self):
+        for label_values, counts in sorted(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(self._sums[label_values])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=(), callback=None) -> Counter:
+        return self._register(Counter(name, help, labels, callback))
+
+    def gauge(self, name, help, labels=(), callback=None) -> Gauge:
+        return self._register(Gauge(name, help, labels, callback))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        '''
+        All metrics in the Prometheus text format (version 0.0.4)
+        '''
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+COMMAND_DURATION = registry.histogram(
+    "command_duration_seconds", "Time from the interaction until the command finished", ("command", "status"))
+DB_CALL_DURATION = registry.histogram(
+    "db_call_duration_seconds", "Duration of the db_calls functions", ("function", "status"))
+DB_QUERIES = registry.counter(
+    "db_queries_total", "Queries sent per db_calls function, including nested calls", ("function",))
+DB_ROWS = registry.counter(
+    "db_rows_total", "Rows returned per db_calls function, including nested calls", ("function",))
+DB_PAYLOAD_BYTES = registry.counter(
+    "db_payload_bytes_total", "Size of the returned rows as JSON per db_calls function, including nested calls", ("function",))
+COMMAND_DB_QUERIES = registry.histogram(
+    "command_db_queries", "Queries sent by one command", ("command",), buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+DB_QUERIES_IN_FLIGHT = registry.gauge(
+    "db_queries_in_flight", "Queries waiting for or running in the db thread pool")
+CACHE_LOOKUPS = registry.counter(
+    "cache_lookups_total", "Lookups of the resident caches, result is hit or miss", ("cache", "result"))
+EVENT_LOOP_LAG = registry.gauge(
+    "event_loop_lag_seconds", "How late the last event loop probe woke up")
+
+
+async def monitor_event_loop_lag(interval: float = 1.0):
+    '''
+    Sleeps interval seconds in a loop, anything on top is time the loop was blocked or busy.
+    '''
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.set(max(0.0, loop.time() - started - interval))
+
@@ -0,0 +1,105 @@
+"""
+GdpAccumulator.flush (src/helper/gdp.py): sums that aren't written go back to pending instead of getting lost.
+
+Run with: python -m pytest tests
+"""
+import asyncio
+import unittest
+
+from datetime import date
+from unittest.mock import patch
+
+from src.benchmarks import fake_supabase
+
+fake_supabase.install(0.0)
+
+from src.db.models import GovernmentGDP
+from src.helper import gdp
+from src.helper.gdp import GdpAccumulator
+
+DAY = date(2026, 1, 1)
+
+
+class FakeIncrement:
+    def __init__(self, delay: float = 0.0, failing=()):
+        self.delay = delay
+        self.failing = set(failing)
+        self.written = {}
+
+    async def __call__(self, server_id, day, amount):
+        await asyncio.sleep(self.delay)
+        if server_id in self.failing:
+            return False
+        self.written[(server_id, day)] = self.written.get((server_id, day), 0.0) + amount
+        return True
+
+
+class GdpAccumulatorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_sums_are_sent_with_the_next_flush(self):
+        increment = FakeIncrement(failing={2})
+        accumulator = GdpAccumulator(increment)
+        accumulator.add(1, 10.0, DAY)
+        accumulator.add(2, 5.0, DAY)
+
+        await accumulator.flush()
+        self.assertEqual(increment.written, {(1, DAY): 10.0})
+        self.assertEqual(accumulator.pending(2, DAY), 5.0)
+
+        increment.failing.clear()
+        accumulator.add(2, 1.0, DAY)
+        await accumulator.flush()
+        self.assertEqual(increment.written, {(1, DAY): 10.0, (2, DAY): 6.0})
+        self.assertEqual(len(accumulator), 0)
+
+    async def test_cancelled_flush_keeps_the_unsent_sums(self):
+        increment = FakeIncrement(delay=0.05)
+        accumulator = GdpAccumulator(increment)
+        for server_id in (1, 2, 3):
+            accumulator.add(server_id, 10.0, DAY)
+
+        flush = asyncio.create_task(accumulator.flush())
+        await asyncio.sleep(0.07)
+        flush.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await flush
+
+        # Server 1 went through, 2 was cancelled mid-write and 3 never started
+        self.assertEqual(increment.written, {(1, DAY): 10.0})
+        self.assertEqual(accumulator.pending(2, DAY) + accumulator.pending(3, DAY), 20.0)
+        await accumulator.flush()
+        self.assertEqual(sum(increment.written.values()), 30.0)
+
+    async def test_cancelling_the_loop_lets_the_running_flush_finish(self):
+        increment = FakeIncrement(delay=0.05)
+        accumulator = GdpAccumulator(increment)
+        for server_id in (1, 2, 3):
+            accumulator.add(server_id, 10.0, DAY)
+
+        with patch.object(gdp, "gdp_accumulator", accumulator):
+            iteration = asyncio.create_task(gdp.gdp_flusher.coro())
+            await asyncio.sleep(0.07)
+            # What shutdown_event does
+            iteration.cancel()
+            accumulator.add(4, 1.0, DAY)
+            await accumulator.flush()
+
+        self.assertEqual(increment.written, {(1, DAY): 10.0, (2, DAY): 10.0, (3, DAY): 10.0, (4, DAY): 1.0})
+        self.assertEqual(len(accumulator), 0)
+
+    async def test_written_sums_are_not_counted_twice_while_flushing(self):
+        increment = FakeIncrement(delay=0.05)
+        accumulator = GdpAccumulator(increment)
+        accumulator.add(1, 10.0, DAY)
+        accumulator.add(2, 10.0, DAY)
+
+        flush = asyncio.create_task(accumulator.flush())
+        await asyncio.sleep(0.07)
+        # Server 1 is in the database now, server 2 still on its way
+        entries = [GovernmentGDP(server_id=1, date=DAY, gdp_value=value) for value in increment.written.values()]
+        self.assertEqual(accumulator.with_pending(1, entries, DAY), [(DAY, 10.0)])
+        self.assertEqual(accumulator.with_pending(2, [], DAY), [(DAY, 10.0)])
+        await flush
+
+
+if __name__ == "__main__":
+    unittest.main()
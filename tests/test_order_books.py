@@ -0,0 +1,60 @@
+"""
+The resident order books against the in-memory database (src/benchmarks/fake_supabase.py).
+
+Run with: python -m pytest tests
+"""
+import unittest
+
+from datetime import datetime, timezone
+
+from src.benchmarks import fake_supabase
+
+db = fake_supabase.install(0.0)
+
+from src.db.db_calls import fill_buy_order, get_own_sell_orders, get_sell_orders, item_catalog, to_row
+from src.helper.defaults import get_default_player
+
+SELLER = 1
+BUYER = 2
+
+
+class OrderBookTagTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        if not db.tables["Items"]:
+            db.insert("Items", {"item_tag": "Wood", "producible": False, "ingredients": None, "worksteps": None,
+                                "base_price": 10.0, "durability": None})
+            await item_catalog.load()
+
+    def seed(self, server_id: int):
+        for user_id in (SELLER, BUYER):
+            player = to_row(get_default_player(user_id, server_id))
+            player["money"] = 1000.0
+            db.insert("Players", player)
+        db.insert("Sell_Orders", {"user_id": SELLER, "item_tag": "Wood", "server_id": server_id, "amount": 10,
+                                  "unit_price": 10.0, "is_company": False})
+
+    async def test_lowercase_lookup_then_fill(self):
+        server_id = 100
+        self.seed(server_id)
+
+        # /order remove passes the tag like the user typed it, the first lookup loads the book
+        self.assertEqual(len(await get_own_sell_orders(SELLER, server_id, "wood", 10.0, "both")), 1)
+        self.assertEqual(len(await get_sell_orders(server_id, "Wood", 10.0, datetime.now(timezone.utc))), 1)
+
+        fills = await fill_buy_order(BUYER, server_id, "Wood", 10.0, 3)
+        self.assertEqual([(fill.user_id, fill.amount) for fill in fills], [(SELLER, 3)])
+        self.assertEqual(db.find("Sell_Orders", {"user_id": SELLER, "item_tag": "Wood", "server_id": server_id,
+                                                 "unit_price": 10.0, "is_company": False})["amount"], 7)
+
+    async def test_lookup_with_spaces_then_fill(self):
+        server_id = 101
+        self.seed(server_id)
+
+        self.assertEqual(len(await get_sell_orders(server_id, " WOOD ", 10.0, datetime.now(timezone.utc))), 1)
+        fills = await fill_buy_order(BUYER, server_id, "wood", 10.0, 10)
+        self.assertEqual([fill.amount for fill in fills], [10])
+        self.assertEqual(await get_sell_orders(server_id, "Wood", 10.0, datetime.now(timezone.utc)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Version-checked update_player (retry + rebase) and the capital deltas of update_company,
+against the in-memory database (src/benchmarks/fake_supabase.py).
+
+Run with: python -m pytest tests
+"""
+import unittest
+
+from src.benchmarks import fake_supabase
+
+db = fake_supabase.install(0.0)
+
+from src.config import PLAYER_UPDATE_RETRIES
+from src.db.db_calls import get_player, update_player, get_company, update_company, to_row, PLAYER_DELTA_FIELDS
+from src.db.instrumentation import ConflictError
+from src.helper.defaults import get_default_player
+
+USER = 1
+
+
+class RebaseTest(unittest.TestCase):
+    def player(self, **values):
+        player = get_default_player(USER, 1)
+        player.money, player.job = 100.0, "Miner"
+        player.mark_clean()
+        for name, value in values.items():
+            setattr(player, name, value)
+        return player
+
+    def test_delta_fields_keep_their_difference(self):
+        player = self.player()
+        player.money -= 30.0
+        current = self.player(money=150.0, version=4)
+
+        player.rebase(current, PLAYER_DELTA_FIELDS)
+
+        self.assertEqual(player.money, 120.0)
+        self.assertEqual(player.version, 4)
+        self.assertEqual(player.changed_fields(), ["money"])
+
+    def test_other_fields_overwrite(self):
+        player = self.player()
+        player.job = "Farmer"
+        current = self.player(job="Lumberjack", money=150.0)
+
+        player.rebase(current, PLAYER_DELTA_FIELDS)
+
+        self.assertEqual(player.job, "Farmer")
+        # Not changed here, so the concurrent value stays
+        self.assertEqual(player.money, 150.0)
+        self.assertEqual(player.changed_fields(), ["job"])
+
+
+class UpdatePlayerTest(unittest.IsolatedAsyncioTestCase):
+    def seed(self, server_id: int) -> dict:
+        row = to_row(get_default_player(USER, server_id))
+        row["money"] = 100.0
+        return db.insert("Players", row)
+
+    def change_before_every_update(self, row: dict, values: dict):
+        '''
+        Another command writes the row right before each update of update_player reaches the database.
+        '''
+        run = db.run
+
+        def interfering_run(operation):
+            query = getattr(operation, "__self__", None)
+            if isinstance(query, fake_supabase.Query) and query._table == "Players" and query._operation == "update":
+                db.update("Players", row, {name: row[name] + value for name, value in values.items()})
+            return run(operation)
+        db.run = interfering_run
+        self.addCleanup(vars(db).pop, "run")
+
+    async def test_conflict_is_rebased_and_retried(self):
+        row = self.seed(200)
+        player = await get_player(USER, 200)
+        # e.g. a sell fill credited the player after the command loaded it
+        db.update("Players", row, {"money": row["money"] + 50.0})
+
+        player.money -= 30.0
+        player.job = "Farmer"
+        await update_player(player)
+
+        self.assertEqual(row["money"], 120.0)
+        self.assertEqual(row["job"], "Farmer")
+        self.assertEqual(player.money, 120.0)
+        self.assertEqual(player.version, row["version"])
+        self.assertEqual(player.changed_fields(), [])
+
+    async def test_gives_up_with_conflict_error(self):
+        row = self.seed(201)
+        player = await get_player(USER, 201)
+        self.change_before_every_update(row, {"money": 1.0})
+
+        player.money -= 30.0
+        with self.assertRaises(ConflictError):
+            await update_player(player)
+
+        # Only the concurrent writes reached the row, the -30 was not applied partly
+        self.assertEqual(row["money"], 100.0 + PLAYER_UPDATE_RETRIES)
+
+    async def test_unchanged_player_sends_nothing(self):
+        self.seed(202)
+        player = await get_player(USER, 202)
+        round_trips = db.round_trips
+
+        self.assertEqual(await update_player(player), [])
+        self.assertEqual(db.round_trips, round_trips)
+
+
+class UpdateCompanyTest(unittest.IsolatedAsyncioTestCase):
+    async def test_capital_is_sent_as_difference(self):
+        row = db.insert("Companies", {"entrepreneur_id": USER, "server_id": 300, "producible_items": "Chair",
+                                      "capital": 1000.0, "worksteps": 0, "wage": 10.0, "name": "Test Inc.", "taxes_owed": 0.0})
+        company = await get_company(USER, 300)
+        # /company deposit of the entrepreneur while a worker's wage is paid from the loaded row
+        db.update("Companies", row, {"capital": row["capital"] + 100.0})
+
+        company.capital -= 10.0
+        company.name = "Renamed Inc."
+        await update_company(company)
+
+        self.assertEqual(row["capital"], 1090.0)
+        self.assertEqual(row["name"], "Renamed Inc.")
+        self.assertEqual(company.capital, 1090.0)
+        self.assertEqual(company.changed_fields(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
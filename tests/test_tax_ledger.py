@@ -0,0 +1,128 @@
+"""
+Journal recovery of the TaxLedger (src/helper/tax_ledger.py): a new ledger on the same journal stands for the bot after a crash.
+
+Run with: python -m pytest tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.benchmarks import fake_supabase
+
+fake_supabase.install(0.0)
+
+from src.helper.tax_ledger import TaxLedger
+
+
+class Crash(Exception):
+    pass
+
+
+def close_journal(ledger: TaxLedger):
+    # Closes the file without settling, like a crash would
+    if ledger._journal is not None:
+        ledger._journal.close()
+        ledger._journal = None
+
+
+class FakeSettlements:
+    '''
+    Like the settle_taxes SQL function: a batch id that was settled before is skipped.
+    '''
+    def __init__(self):
+        self.owed = {}
+        self.batch_ids = []
+        self.fail = False
+        self.crash_after_commit = False
+
+    async def __call__(self, batch_id, entries):
+        if self.fail:
+            return False
+        self.batch_ids.append(batch_id)
+        if self.batch_ids.count(batch_id) == 1:
+            for entry in entries:
+                key = (entry["server_id"], entry["user_id"], entry["is_company"])
+                self.owed[key] = round(self.owed.get(key, 0.0) + entry["amount"], 2)
+        if self.crash_after_commit:
+            # Written in the database, but the bot died before it saw the answer
+            raise Crash()
+        return True
+
+
+class TaxLedgerRecoveryTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "tax_journal.jsonl")
+        self.settlements = FakeSettlements()
+
+    def ledger(self) -> TaxLedger:
+        ledger = TaxLedger(self.settlements, self.path)
+        ledger.recover()
+        self.addCleanup(close_journal, ledger)
+        return ledger
+
+    async def test_accrued_taxes_survive_a_crash(self):
+        ledger = self.ledger()
+        ledger.accrue(1, 10, False, 2.5)
+        ledger.accrue(1, 10, False, 1.5)
+        ledger.accrue(1, 20, True, 3.0)
+
+        recovered = self.ledger()
+        self.assertEqual(recovered.pending(1, 10, False), 4.0)
+        self.assertEqual(recovered.pending(1, 20, True), 3.0)
+
+        await recovered.settle()
+        self.assertEqual(self.settlements.owed, {(1, 10, False): 4.0, (1, 20, True): 3.0})
+        self.assertEqual(len(recovered), 0)
+
+    async def test_unsent_batch_is_sent_again_with_its_id(self):
+        ledger = self.ledger()
+        ledger.accrue(1, 10, False, 2.0)
+        self.settlements.fail = True
+        await ledger.settle()
+        # Accrued while the batch is open, goes into the next batch
+        ledger.accrue(1, 10, False, 1.0)
+
+        recovered = self.ledger()
+        self.assertEqual(recovered.pending(1, 10, False), 3.0)
+
+        self.settlements.fail = False
+        await recovered.settle()
+        await recovered.settle()
+        self.assertEqual(self.settlements.owed, {(1, 10, False): 3.0})
+        self.assertEqual(len(self.settlements.batch_ids), 2)
+
+    async def test_batch_applied_before_the_crash_is_not_added_twice(self):
+        ledger = self.ledger()
+        ledger.accrue(1, 10, False, 5.0)
+        self.settlements.crash_after_commit = True
+        with self.assertRaises(Crash):
+            await ledger.settle()
+
+        self.settlements.crash_after_commit = False
+        recovered = self.ledger()
+        await recovered.settle()
+
+        self.assertEqual(self.settlements.owed, {(1, 10, False): 5.0})
+        self.assertEqual(self.settlements.batch_ids[0], self.settlements.batch_ids[1])
+        self.assertFalse(os.path.exists(self.path + ".settling"))
+
+    async def test_half_written_line_is_skipped(self):
+        ledger = self.ledger()
+        ledger.accrue(1, 10, False, 2.0)
+        close_journal(ledger)
+        with open(self.path, "a") as f:
+            f.write('{"server_id": 1, "user_id": 10, "is_com')
+
+        recovered = self.ledger()
+        self.assertEqual(recovered.pending(1, 10, False), 2.0)
+        # The next entry doesn't end up on the broken line
+        recovered.accrue(1, 10, False, 1.0)
+        close_journal(recovered)
+        self.assertEqual(self.ledger().pending(1, 10, False), 3.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
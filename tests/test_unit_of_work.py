@@ -0,0 +1,115 @@
+"""
+When the request-scoped unit of work (src/db/unit_of_work.py) writes and when it drops the deferred writes,
+against the in-memory database (src/benchmarks/fake_supabase.py).
+
+Run with: python -m pytest tests
+"""
+import unittest
+
+from src.benchmarks import fake_supabase
+
+db = fake_supabase.install(0.0)
+
+from src.db.db_calls import get_player, update_player, add_object, to_row
+from src.db.instrumentation import ConflictError
+from src.db.unit_of_work import unit_of_work
+from src.helper.defaults import get_default_player
+
+
+class Failed(Exception):
+    pass
+
+
+class UnitOfWorkTest(unittest.IsolatedAsyncioTestCase):
+    def seed(self, user_id: int, server_id: int) -> dict:
+        row = to_row(get_default_player(user_id, server_id))
+        row["money"] = 100.0
+        return db.insert("Players", row)
+
+    async def test_rows_are_loaded_once_and_written_once_at_the_end(self):
+        row = self.seed(1, 400)
+        round_trips = db.round_trips
+
+        async with unit_of_work():
+            player = await get_player(1, 400)
+            self.assertIs(await get_player(1, 400), player)
+            player.money += 10.0
+            await update_player(player)
+            player.hunger -= 5
+            await update_player(player)
+            self.assertEqual(row["money"], 100.0)
+
+        self.assertEqual(row["money"], 110.0)
+        self.assertEqual(row["hunger"], player.hunger)
+        # One select, one update
+        self.assertEqual(db.round_trips - round_trips, 2)
+
+    async def test_error_drops_the_deferred_writes(self):
+        row = self.seed(1, 401)
+
+        with self.assertRaises(Failed):
+            async with unit_of_work():
+                player = await get_player(1, 401)
+                player.money += 10.0
+                await update_player(player)
+                raise Failed()
+
+        self.assertEqual(row["money"], 100.0)
+
+    async def test_error_after_a_direct_insert_still_flushes(self):
+        row = self.seed(1, 402)
+
+        with self.assertRaises(Failed):
+            async with unit_of_work():
+                player = await get_player(1, 402)
+                player.money -= 10.0
+                await update_player(player)
+                # Already in the database, the money change has to follow
+                await add_object(get_default_player(2, 402), "Players")
+                raise Failed()
+
+        self.assertEqual(row["money"], 90.0)
+        self.assertIsNotNone(db.find("Players", {"id": 2, "server_id": 402}))
+
+    async def test_nested_block_leaves_the_flush_to_the_outer_one(self):
+        row = self.seed(1, 403)
+
+        async with unit_of_work():
+            async with unit_of_work():
+                player = await get_player(1, 403)
+                player.money += 10.0
+                await update_player(player)
+            self.assertEqual(row["money"], 100.0)
+
+        self.assertEqual(row["money"], 110.0)
+
+    async def test_conflict_writes_the_other_rows_and_raises(self):
+        first = self.seed(1, 404)
+        second = self.seed(2, 404)
+
+        run = db.run
+
+        def conflicting_run(operation):
+            query = getattr(operation, "__self__", None)
+            if isinstance(query, fake_supabase.Query) and query._table == "Players" and query._operation == "update":
+                # Someone else keeps writing player 1
+                db.update("Players", first, {})
+            return run(operation)
+
+        with self.assertRaises(ConflictError):
+            async with unit_of_work():
+                one = await get_player(1, 404)
+                two = await get_player(2, 404)
+                one.money += 10.0
+                two.money += 20.0
+                await update_player(one)
+                await update_player(two)
+                db.run = conflicting_run
+                self.addCleanup(vars(db).pop, "run", None)
+
+        self.assertEqual(first["money"], 100.0)
+        self.assertEqual(second["money"], 120.0)
+
+
+if __name__ == "__main__":
+    unittest.main()